@@ -0,0 +1,85 @@
+import inspect
+
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView с асинхронными обработчиками методов.
+
+    Django запускает такое представление в цикле событий ASGI сервера
+    без перехода в поток через sync_to_async. Разбор запроса,
+    согласование формата, проверка прав и обработка исключений
+    выполняются как в APIView, ограничения частоты проверяются через
+    `aallow_request()` с асинхронным API кеша.
+
+    Аутентификация синхронная и выполняется в отдельном потоке, поэтому
+    представлениям, которым не нужен пользователь, следует отключить ее
+    пустым `authentication_classes`.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self,
+                    request.method.lower(),
+                    self.http_method_not_allowed,
+                )
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS обрабатывается синхронным методом APIView
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        """Асинхронный initial()."""
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        neg = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = neg
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+
+        if request.authenticators:
+            await sync_to_async(self.perform_authentication)(request)
+        else:
+            self.perform_authentication(request)
+        self.check_permissions(request)
+        await self.acheck_throttles(request)
+
+    async def acheck_throttles(self, request):
+        """Асинхронный check_throttles()."""
+        throttle_durations = []
+        for throttle in self.get_throttles():
+            if hasattr(throttle, "aallow_request"):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = await sync_to_async(throttle.allow_request)(
+                    request, self
+                )
+            if not allowed:
+                throttle_durations.append(throttle.wait())
+
+        if throttle_durations:
+            durations = [
+                duration
+                for duration in throttle_durations
+                if duration is not None
+            ]
+            self.throttled(request, max(durations, default=None))
@@ -0,0 +1,136 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .profile_cache import profile_cache
+from .replication import read_from_primary
+
+
+class TokenSnapshotCache:
+    """
+    Ограниченный по размеру LRU кеш пользователей по ключу токена.
+
+    Пользователь хранится в сериализованном виде, поэтому каждый запрос
+    получает собственную копию объекта. Записи устаревают через `ttl`
+    секунд.
+
+    Запись хранится вместе с версией профиля пользователя из общего
+    кеша `versions` (ProfileCache), которая проверяется при каждом
+    чтении. Снимок содержит те же данные, что и профиль, и версия
+    заменяется в любом процессе при их изменении, поэтому записи
+    с прежней версией во всех процессах перестают читаться. Потеря
+    версии в общем кеше тоже делает запись недействительной.
+    """
+
+    def __init__(self, max_size: int, ttl: float, versions):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user_id, version, data = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        if self.versions.current_version(user_id) != version:
+            self.invalidate_token(key)
+            return None
+        return pickle.loads(data)
+
+    def set(self, key: str, user) -> None:
+        data = pickle.dumps(user)
+        version = self.versions.version(user.pk)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (
+                time.monotonic() + self.ttl,
+                user.pk,
+                version,
+                data,
+            )
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_token(self, key: str) -> None:
+        """Удаление записи токена в текущем процессе."""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_users(self, user_ids) -> None:
+        """
+        Удаление записей пользователей в текущем процессе, в остальных
+        процессах их отбрасывает замена версий профилей.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                for key in self._keys_by_user.pop(user_id, ()):
+                    self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1]]
+
+
+token_cache = TokenSnapshotCache(
+    max_size=settings.TOKEN_AUTH_CACHE["MAX_SIZE"],
+    ttl=settings.TOKEN_AUTH_CACHE["TTL"],
+    versions=profile_cache,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кешированием пользователя.
+
+    Пользователь загружается вместе с инвайт-кодом и данными реферала,
+    поэтому профиль можно отдать без повторного запроса пользователя.
+    При отсутствии в кеше пользователь читается с основной базы: запись
+    заменяет снимок, устаревший после изменения, и по ней строится
+    профиль в общем кеше.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user = token_cache.get(key)
+        if user is None:
+            try:
+                with read_from_primary():
+                    token = model.objects.select_related(
+                        "user__invite_code", "user__referral_info"
+                    ).get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_("Invalid token."))
+            user = token.user
+            if not user.is_active:
+                raise AuthenticationFailed(_("User inactive or deleted."))
+            token_cache.set(key, user)
+        return (user, model(key=key, user=user))
@@ -0,0 +1,169 @@
+from datetime import timedelta
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import VerificationCode
+
+
+class BaseCodeStore:
+    """
+    Хранилище кодов верификации.
+
+    Хранилище должно быть общим для всех процессов приложения: код,
+    выданный одним воркером, проверяется другим. Проверка кода атомарно
+    сравнивает и удаляет его, поэтому код можно использовать один раз.
+    После `max_attempts` неудачных попыток код перестает действовать.
+    """
+
+    def __init__(self, ttl: int = 300, max_attempts: int = 5, **options):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+
+    def issue(self, phone_number: str, code: str) -> None:
+        """Сохранение нового кода вместо ранее выданного."""
+        raise NotImplementedError
+
+    def verify(self, phone_number: str, code: str) -> bool:
+        """Проверка и удаление кода при совпадении."""
+        raise NotImplementedError
+
+    async def aissue(self, phone_number: str, code: str) -> None:
+        """Асинхронный issue(), по умолчанию в отдельном потоке."""
+        await sync_to_async(self.issue)(phone_number, code)
+
+    async def averify(self, phone_number: str, code: str) -> bool:
+        """Асинхронный verify(), по умолчанию в отдельном потоке."""
+        return await sync_to_async(self.verify)(phone_number, code)
+
+
+class DatabaseCodeStore(BaseCodeStore):
+    """Хранилище кодов верификации в таблице базы данных."""
+
+    def issue(self, phone_number: str, code: str) -> None:
+        VerificationCode.objects.update_or_create(
+            phone_number=phone_number,
+            defaults={
+                "code": code,
+                "attempts": 0,
+                "expires_at": timezone.now() + timedelta(seconds=self.ttl),
+            },
+        )
+
+    async def aissue(self, phone_number: str, code: str) -> None:
+        await VerificationCode.objects.aupdate_or_create(
+            phone_number=phone_number,
+            defaults={
+                "code": code,
+                "attempts": 0,
+                "expires_at": timezone.now() + timedelta(seconds=self.ttl),
+            },
+        )
+
+    def _matching(self, phone_number: str, code: str):
+        return VerificationCode.objects.filter(
+            phone_number=phone_number,
+            code=code,
+            attempts__lt=self.max_attempts,
+            expires_at__gt=timezone.now(),
+        )
+
+    def verify(self, phone_number: str, code: str) -> bool:
+        # условия проверки и удаление выполняются одним запросом DELETE,
+        # поэтому из параллельных запросов код примет только один
+        deleted, _ = self._matching(phone_number, code).delete()
+        if deleted:
+            return True
+        VerificationCode.objects.filter(phone_number=phone_number).update(
+            attempts=F("attempts") + 1
+        )
+        return False
+
+    async def averify(self, phone_number: str, code: str) -> bool:
+        deleted, _ = await self._matching(phone_number, code).adelete()
+        if deleted:
+            return True
+        await VerificationCode.objects.filter(
+            phone_number=phone_number
+        ).aupdate(attempts=F("attempts") + 1)
+        return False
+
+
+class RedisCodeStore(BaseCodeStore):
+    """
+    Хранилище кодов верификации в Redis.
+
+    Требует установленного пакета `redis`. Срок действия кода задается
+    временем жизни ключа, проверка выполняется Lua-скриптом. Асинхронные
+    методы работают через отдельный клиент redis.asyncio.
+    """
+
+    VERIFY_SCRIPT = """
+    local code = redis.call('HGET', KEYS[1], 'code')
+    if not code then
+        return 0
+    end
+    if code == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        return 1
+    end
+    local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+    if attempts >= tonumber(ARGV[2]) then
+        redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", **options):
+        super().__init__(**options)
+        import redis
+        import redis.asyncio
+
+        self.client = redis.Redis.from_url(url)
+        self.verify_script = self.client.register_script(self.VERIFY_SCRIPT)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+        self.async_verify_script = self.async_client.register_script(
+            self.VERIFY_SCRIPT
+        )
+
+    def get_key(self, phone_number: str) -> str:
+        return f"{settings.CACHE_KEY_OF_CONFIRM_CODE}:{phone_number}"
+
+    def issue(self, phone_number: str, code: str) -> None:
+        key = self.get_key(phone_number)
+        with self.client.pipeline() as pipeline:
+            pipeline.delete(key)
+            pipeline.hset(key, mapping={"code": code, "attempts": 0})
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+
+    def verify(self, phone_number: str, code: str) -> bool:
+        key = self.get_key(phone_number)
+        result = self.verify_script(keys=[key], args=[code, self.max_attempts])
+        return bool(result)
+
+    async def aissue(self, phone_number: str, code: str) -> None:
+        key = self.get_key(phone_number)
+        async with self.async_client.pipeline() as pipeline:
+            pipeline.delete(key)
+            pipeline.hset(key, mapping={"code": code, "attempts": 0})
+            pipeline.expire(key, self.ttl)
+            await pipeline.execute()
+
+    async def averify(self, phone_number: str, code: str) -> bool:
+        key = self.get_key(phone_number)
+        result = await self.async_verify_script(
+            keys=[key], args=[code, self.max_attempts]
+        )
+        return bool(result)
+
+
+@lru_cache
+def get_code_store() -> BaseCodeStore:
+    """Хранилище кодов верификации из настроек проекта."""
+    config = settings.VERIFICATION_CODE_STORE
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+
+class Message(NamedTuple):
+    """Сообщение с кодом верификации."""
+
+    phone_number: str
+    text: str
+
+
+class DeliveryUnavailable(APIException):
+    """Очередь отправки переполнена."""
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Сервис отправки кодов перегружен, повторите позже."
+    default_code = "delivery_unavailable"
+
+
+class BaseSender:
+    """
+    Способ доставки сообщений.
+
+    `send_many` получает пакет сообщений и вызывает исключение, если
+    пакет не доставлен. В этом случае пакет отправляется повторно.
+    """
+
+    def send_many(self, messages: list) -> None:
+        raise NotImplementedError
+
+
+class FileSender(BaseSender):
+    """Эмуляция отправки: сообщения дописываются в один файл."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send_many(self, messages: list) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(
+                f"{message.phone_number}\t{message.text}\n"
+                for message in messages
+            )
+
+
+class LogSender(BaseSender):
+    """Эмуляция отправки: сообщения записываются в лог."""
+
+    def send_many(self, messages: list) -> None:
+        for message in messages:
+            logger.info("SMS %s: %s", message.phone_number, message.text)
+
+
+class SmsGatewaySender(BaseSender):
+    """
+    Отправка через HTTP API СМС-шлюза.
+
+    Пакет сообщений отправляется одним POST запросом в формате JSON:
+    {"messages": [{"phone": ..., "text": ...}, ...]}.
+    """
+
+    def __init__(self, url: str, token: str = "", timeout: float = 5):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send_many(self, messages: list) -> None:
+        body = json.dumps(
+            {
+                "messages": [
+                    {"phone": message.phone_number, "text": message.text}
+                    for message in messages
+                ]
+            }
+        ).encode()
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.token}",
+            },
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class DeliveryPipeline:
+    """
+    Очередь отправки кодов верификации.
+
+    Представления только добавляют сообщения в очередь, а пул фоновых
+    потоков забирает их пакетами до `batch_size` штук и передает
+    отправителю. Неудачный пакет отправляется повторно с экспоненциальной
+    задержкой до `max_retries` раз.
+    """
+
+    def __init__(
+        self,
+        sender: BaseSender,
+        workers: int = 2,
+        batch_size: int = 100,
+        batch_timeout: float = 0.05,
+        max_retries: int = 3,
+        retry_delay: float = 1,
+        max_queue_size: int = 10000,
+    ):
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество сообщений, ожидающих отправки."""
+        return self.queue.qsize()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"code-delivery-{number}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, phone_number: str, text: str) -> None:
+        """Добавление сообщения в очередь отправки."""
+        self.start()
+        try:
+            self.queue.put_nowait(Message(phone_number, text))
+        except queue.Full:
+            raise DeliveryUnavailable
+
+    def flush(self) -> None:
+        """Ожидание отправки всех сообщений из очереди."""
+        self.queue.join()
+
+    def _next_batch(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch: list) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.sender.send_many(batch)
+                return
+            except Exception:
+                logger.exception(
+                    "Не удалось отправить %s сообщений, попытка %s",
+                    len(batch),
+                    attempt + 1,
+                )
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * 2**attempt)
+        logger.error("Сообщения не доставлены: %s", len(batch))
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                self._send(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+@lru_cache
+def get_delivery_pipeline() -> DeliveryPipeline:
+    """Очередь отправки кодов из настроек проекта."""
+    config = settings.CODE_DELIVERY
+    sender = import_string(config["SENDER"])(
+        **config.get("SENDER_OPTIONS", {})
+    )
+    return DeliveryPipeline(sender, **config.get("OPTIONS", {}))
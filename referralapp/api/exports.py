@@ -0,0 +1,119 @@
+import csv
+import io
+from datetime import datetime
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+
+from users.models import Referral
+
+User = get_user_model()
+
+# количество строк, читаемых из курсора и отправляемых клиенту за раз
+CHUNK_SIZE = 2000
+
+
+class Export:
+    """
+    Выгрузка таблицы.
+
+    `columns` сопоставляет колонку выгрузки с путем к значению
+    в values_list(), `timestamp` - поле времени создания строки, по
+    которому выполняется инкрементальная выгрузка, `ordering` - порядок
+    строк.
+    """
+
+    def __init__(self, queryset, columns: dict, timestamp: str, ordering):
+        self.queryset = queryset
+        self.columns = columns
+        self.timestamp = timestamp
+        self.ordering = ordering
+
+    def rows(self, since=None):
+        """
+        Строки выгрузки в виде кортежей.
+
+        Строки читаются итератором пакетами по CHUNK_SIZE, в PostgreSQL
+        через серверный курсор, поэтому вся таблица не загружается
+        в память.
+        """
+        queryset = self.queryset.order_by(*self.ordering)
+        if since is not None:
+            queryset = queryset.filter(**{f"{self.timestamp}__gte": since})
+        return queryset.values_list(*self.columns.values()).iterator(
+            chunk_size=CHUNK_SIZE
+        )
+
+
+EXPORTS = {
+    "users": Export(
+        User.objects.all(),
+        {
+            "id": "id",
+            "phone_number": "phone_number",
+            "email": "email",
+            "first_name": "first_name",
+            "last_name": "last_name",
+            "date_joined": "date_joined",
+            "invite_code": "invite_code__code",
+            "invited_count": "invite_code__invited_count",
+        },
+        timestamp="date_joined",
+        ordering=("id",),
+    ),
+    "referrals": Export(
+        Referral.objects.all(),
+        {
+            "id": "id",
+            "inviter_id": "inviter_id",
+            "invitee_id": "invitee_id",
+            "activated_invite_code": "activated_invite_code",
+            "created_at": "created_at",
+        },
+        timestamp="created_at",
+        # порядок совпадает с индексом referral_created
+        ordering=("created_at",),
+    ),
+}
+
+
+def _chunks(rows):
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        yield chunk
+
+
+def ndjson_lines(columns, rows):
+    """Строки в формате NDJSON: по одному JSON объекту на строку."""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in _chunks(rows):
+        yield "".join(
+            encoder.encode(dict(zip(columns, row))) + "\n" for row in chunk
+        )
+
+
+def csv_lines(columns, rows):
+    """Строки в формате CSV с заголовком."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows(
+            [
+                (
+                    value.isoformat() if isinstance(value, datetime) else value
+                    for value in row
+                )
+                for row in chunk
+            ]
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv; charset=utf-8"),
+}
@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# границы гистограммы времени обработки запроса в секундах
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Показатели одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        # количество выполнений каждого шаблона SQL запроса
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL запроса, см. execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold: int) -> dict:
+        """Шаблоны запросов, выполненные не менее `threshold` раз."""
+        return {
+            sql: count
+            for sql, count in self.statements.items()
+            if count >= threshold
+        }
+
+
+class TimedSerializerMixin:
+    """
+    Учет времени сериализации в показателях запроса.
+
+    Учитывается только внешний сериализатор: вложенные сериализаторы
+    выполняются внутри него и повторно не суммируются.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializer_depth -= 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Накопленные показатели запросов в памяти процесса.
+
+    Показатели группируются по имени маршрута (представление и действие)
+    и HTTP методу и выводятся в текстовом формате Prometheus.
+    """
+
+    COUNTERS = (
+        ("requests_total", "Количество запросов."),
+        ("db_queries_total", "Количество SQL запросов."),
+        ("db_duplicate_queries_total", "Количество повторных SQL запросов."),
+        ("db_duration_seconds_total", "Время выполнения SQL запросов."),
+        ("serializer_duration_seconds_total", "Время сериализации."),
+        ("response_bytes_total", "Размер ответов."),
+    )
+
+    def __init__(self, prefix: str = "referralapp"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._durations = {}
+
+    def observe(self, labels: tuple, values: dict, duration: float) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(labels, Counter())
+            counters["requests_total"] += 1
+            counters.update(values)
+            buckets = self._durations.setdefault(
+                labels, [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            )
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[index] += 1
+            buckets[-2] += 1
+            buckets[-1] += duration
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._durations.clear()
+
+    def render(self, gauges: dict = None) -> str:
+        """
+        Показатели в текстовом формате Prometheus.
+
+        `gauges` - дополнительные текущие значения: имя -> (описание,
+        значение).
+        """
+        with self._lock:
+            counters = {
+                labels: Counter(values)
+                for labels, values in self._counters.items()
+            }
+            durations = {
+                labels: list(values)
+                for labels, values in self._durations.items()
+            }
+        lines = []
+        for name, description in self.COUNTERS:
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for labels, values in sorted(counters.items()):
+                lines.append(
+                    f"{metric}{{{self._labels(labels)}}} {values[name]}"
+                )
+        metric = f"{self.prefix}_request_duration_seconds"
+        lines.append(f"# HELP {metric} Время обработки запроса.")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, buckets in sorted(durations.items()):
+            label_text = self._labels(labels)
+            for bound, count in zip(DURATION_BUCKETS, buckets):
+                lines.append(
+                    f'{metric}_bucket{{{label_text},le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'{metric}_bucket{{{label_text},le="+Inf"}} {buckets[-2]}'
+            )
+            lines.append(f"{metric}_sum{{{label_text}}} {buckets[-1]}")
+            lines.append(f"{metric}_count{{{label_text}}} {buckets[-2]}")
+        for name, (description, value) in (gauges or {}).items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, labels: tuple) -> str:
+        view, method = labels
+        return f'view="{_escape(view)}",method="{_escape(method)}"'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """
+    Сбор показателей запроса: количество и время SQL запросов, повторные
+    запросы (признак N+1), время сериализации и размер ответа.
+
+    Показатели добавляются в заголовок Server-Timing и в общий реестр,
+    который отдается по адресу /metrics/. Обертка запросов только
+    считает время и шаблоны запросов, поэтому накладные расходы
+    не зависят от размера ответа.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.REQUEST_METRICS
+        self.duplicate_threshold = config["DUPLICATE_QUERY_THRESHOLD"]
+        self.server_timing = config["SERVER_TIMING"]
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        duplicates = metrics.duplicates(self.duplicate_threshold)
+        # повторными считаются все выполнения шаблона, кроме первого
+        repeated = sum(count - 1 for count in duplicates.values())
+        for sql, count in duplicates.items():
+            logger.warning(
+                "Запрос выполнен %s раз в %s %s: %s",
+                count,
+                request.method,
+                view,
+                sql,
+            )
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(
+            (view, request.method),
+            {
+                "db_queries_total": metrics.queries,
+                "db_duplicate_queries_total": repeated,
+                "db_duration_seconds_total": metrics.sql_time,
+                "serializer_duration_seconds_total": metrics.serializer_time,
+                "response_bytes_total": size,
+            },
+            duration,
+        )
+        if self.server_timing:
+            response["Server-Timing"] = (
+                f"db;dur={metrics.sql_time * 1000:.2f};"
+                f'desc="{metrics.queries} queries, {repeated} duplicates", '
+                f"serializer;dur={metrics.serializer_time * 1000:.2f}, "
+                f"total;dur={duration * 1000:.2f}"
+            )
+        return response
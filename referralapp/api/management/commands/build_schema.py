@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.schema import SchemaArtifact, source_fingerprint
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерация схемы OpenAPI в каталог OPENAPI_SCHEMA['DIR']. "
+        "Выполняется при сборке, чтобы /schema/ отдавал готовый файл "
+        "без обхода представлений."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        directory = settings.OPENAPI_SCHEMA["DIR"]
+        artifact = SchemaArtifact.build(source_fingerprint())
+        artifact.save(directory)
+        for format, content in artifact.documents.items():
+            self.stdout.write(
+                f"{SchemaArtifact.path(directory, artifact.version, format)}"
+                f": {len(content)} байт"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Схема {artifact.version} сгенерирована за "
+                f"{time.perf_counter() - started:.2f} с."
+            )
+        )
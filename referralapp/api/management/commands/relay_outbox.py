@@ -0,0 +1,60 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.outbox import get_outbox_relay, outbox_lag
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Публикация событий outbox получателю из настройки OUTBOX. "
+        "Команда работает постоянно и опрашивает очередь событий, "
+        "с --once публикует накопленные события и завершается."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Опубликовать накопленные события и завершиться.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Количество событий в одном пакете.",
+        )
+
+    def handle(self, *args, **options):
+        config = settings.OUTBOX
+        relay = get_outbox_relay()
+        if options["batch_size"]:
+            relay.batch_size = options["batch_size"]
+        while True:
+            started = time.perf_counter()
+            try:
+                published = relay.publish_batch()
+            except Exception as error:
+                if options["once"]:
+                    raise CommandError(f"Ошибка публикации: {error}")
+                logger.exception("Ошибка публикации событий outbox")
+                time.sleep(config["RETRY_DELAY"])
+                continue
+            if published:
+                pending, lag = outbox_lag()
+                self.stdout.write(
+                    f"Опубликовано событий: {published} за "
+                    f"{time.perf_counter() - started:.2f} с, в очереди: "
+                    f"{pending}, задержка: {lag:.1f} с"
+                )
+                continue
+            purged = relay.purge(config["RETENTION_DAYS"])
+            if purged:
+                self.stdout.write(f"Удалено опубликованных событий: {purged}")
+            if options["once"]:
+                break
+            time.sleep(config["POLL_INTERVAL"])
+        self.stdout.write(self.style.SUCCESS("События опубликованы."))
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificationCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15, unique=True, verbose_name='номер телефона')),
+                ('code', models.CharField(max_length=4, verbose_name='код верификации')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='количество неудачных попыток')),
+                ('expires_at', models.DateTimeField(verbose_name='действует до')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class VerificationCode(models.Model):
+    """Выданный код верификации."""
+
+    phone_number = models.CharField(
+        unique=True, max_length=15, verbose_name="номер телефона"
+    )
+    code = models.CharField(max_length=4, verbose_name="код верификации")
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name="количество неудачных попыток"
+    )
+    expires_at = models.DateTimeField(verbose_name="действует до")
+
+    def __str__(self):
+        return f"Код для {self.phone_number}"
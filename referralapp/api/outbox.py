@@ -0,0 +1,184 @@
+import json
+import os
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from users.models import OutboxEvent
+
+
+class BaseSink:
+    """
+    Получатель событий outbox.
+
+    `publish` получает пакет событий в порядке id и вызывает исключение,
+    если пакет не доставлен. Тогда пакет публикуется повторно, поэтому
+    потребитель может получить событие больше одного раза и должен
+    отбрасывать уже обработанные id.
+    """
+
+    def publish(self, events: list) -> None:
+        raise NotImplementedError
+
+
+class FileSink(BaseSink):
+    """События дописываются в файл NDJSON, по одному на строку."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, events: list) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(encoder.encode(event) + "\n" for event in events)
+            file.flush()
+            # пакет считается опубликованным только после записи на диск
+            os.fsync(file.fileno())
+
+
+class WebhookSink(BaseSink):
+    """
+    Публикация через HTTP: пакет отправляется одним POST запросом
+    в формате JSON {"events": [...]}. Ответ с кодом не 2xx считается
+    ошибкой доставки.
+    """
+
+    def __init__(self, url: str, token: str = "", timeout: float = 10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def publish(self, events: list) -> None:
+        body = json.dumps({"events": events}, cls=DjangoJSONEncoder).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def event_data(event: OutboxEvent) -> dict:
+    """Событие в виде, передаваемом получателю."""
+    return {
+        "id": event.id,
+        "type": event.type,
+        "created_at": event.created_at,
+        "payload": event.payload,
+    }
+
+
+class OutboxRelay:
+    """
+    Публикация событий outbox пакетами до `batch_size` штук.
+
+    Пакет выбирается из неопубликованных событий в порядке id и
+    занимается на `claim_timeout` секунд в короткой транзакции. После
+    ее фиксации пакет передается получателю и отмечается
+    опубликованным, поэтому транзакция и блокировки строк не
+    удерживаются на время доставки. Если получатель не принял пакет,
+    пакет освобождается, а если процесс остановился до отметки,
+    пакет займется повторно по истечении `claim_timeout` (доставка
+    "хотя бы один раз").
+
+    id событий возрастают, поэтому служат курсором потребителя. id
+    выдается при записи события, а видно оно становится при фиксации
+    транзакции, и событие с меньшим id может стать видно позже
+    события с большим. Поэтому публикуются только события старше
+    `visibility_delay` секунд: окно должно быть больше времени от
+    записи события до фиксации самой долгой такой транзакции.
+    Несколько процессов публикуют разные пакеты, но порядок между
+    ними не гарантируется.
+    """
+
+    def __init__(
+        self,
+        sink: BaseSink,
+        batch_size: int = 500,
+        visibility_delay: float = 0,
+        claim_timeout: float = 60,
+    ):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.visibility_delay = visibility_delay
+        self.claim_timeout = claim_timeout
+
+    def claim_batch(self) -> list:
+        """Занятие пакета видимых неопубликованных событий."""
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.unpublished()
+                .filter(
+                    Q(claimed_until__isnull=True) | Q(claimed_until__lte=now),
+                    created_at__lte=now
+                    - timedelta(seconds=self.visibility_delay),
+                )
+                .select_for_update(skip_locked=True)
+                .order_by("id")[: self.batch_size]
+            )
+            if events:
+                OutboxEvent.objects.filter(
+                    pk__in=[event.pk for event in events]
+                ).update(
+                    claimed_until=now + timedelta(seconds=self.claim_timeout)
+                )
+        return events
+
+    def publish_batch(self) -> int:
+        """Публикация одного пакета, возвращает количество событий."""
+        events = self.claim_batch()
+        if not events:
+            return 0
+        claimed = OutboxEvent.objects.filter(
+            pk__in=[event.pk for event in events]
+        )
+        try:
+            self.sink.publish([event_data(event) for event in events])
+        except Exception:
+            claimed.update(claimed_until=None)
+            raise
+        claimed.update(published_at=timezone.now(), claimed_until=None)
+        return len(events)
+
+    def purge(self, retention_days: int) -> int:
+        """Удаление событий, опубликованных раньше `retention_days` дней."""
+        deleted, _ = OutboxEvent.objects.filter(
+            published_at__lt=timezone.now() - timedelta(days=retention_days)
+        ).delete()
+        return deleted
+
+
+def outbox_lag() -> tuple:
+    """
+    Количество неопубликованных событий и возраст самого старого
+    из них в секундах.
+    """
+    stats = OutboxEvent.objects.unpublished().aggregate(
+        pending=Count("id"), oldest=Min("created_at")
+    )
+    if stats["oldest"] is None:
+        return 0, 0.0
+    return (
+        stats["pending"],
+        (timezone.now() - stats["oldest"]).total_seconds(),
+    )
+
+
+def get_outbox_relay() -> OutboxRelay:
+    """Публикация событий с получателем из настроек проекта."""
+    config = settings.OUTBOX
+    sink = import_string(config["SINK"])(**config.get("SINK_OPTIONS", {}))
+    return OutboxRelay(
+        sink,
+        batch_size=config["BATCH_SIZE"],
+        visibility_delay=config["VISIBILITY_DELAY"],
+        claim_timeout=config["CLAIM_TIMEOUT"],
+    )
@@ -0,0 +1,46 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация списка пользователей по первичному ключу.
+
+    Выборка страницы строится по условию `id > <курсор>`, поэтому
+    стоимость запроса не зависит от номера страницы.
+    """
+
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class InvitedUserCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация приглашенных пользователей.
+
+    Сначала отображаются последние активации инвайт-кода. Время
+    активации может совпадать, поэтому порядок дополняется первичным
+    ключом: иначе элементы на границе страниц повторяются или
+    пропускаются. Порядок совпадает с индексом referral_inviter_created
+    и с последними приглашенными в профиле.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class DescendantCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация дерева приглашенных пользователей.
+
+    Пути упорядочены по первичному ключу, то есть по времени появления
+    пользователя в дереве.
+    """
+
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
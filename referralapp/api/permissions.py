@@ -1,3 +1,6 @@
+import hmac
+
+from django.conf import settings
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
 
@@ -12,3 +15,24 @@ class IsAdminOrReadOnly(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return request.method in SAFE_METHODS or request.user.is_staff
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    """
+    Доступ для персонала или по общему токену REQUEST_METRICS["TOKEN"],
+    переданному в заголовке `Authorization: Bearer <токен>`.
+
+    Адрес клиента не проверяется: за обратным прокси все запросы
+    приходят с адреса прокси.
+    """
+
+    keyword = "Bearer"
+
+    def has_permission(self, request, view):
+        if request.user.is_staff:
+            return True
+        token = settings.REQUEST_METRICS["TOKEN"]
+        authorization = request.META.get("HTTP_AUTHORIZATION", "")
+        return bool(token) and hmac.compare_digest(
+            authorization.encode(), f"{self.keyword} {token}".encode()
+        )
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .replication import read_from_primary
+
+
+class ProfileCache:
+    """
+    Кеш сериализованных профилей пользователей в общем кеше Django.
+
+    Профиль хранится под ключом из id пользователя и версии. Версия -
+    случайная строка, которая заменяется при изменении данных профиля,
+    поэтому прежние записи больше не читаются и истекают сами. Потеря
+    версии (вытеснение или истечение) тоже дает новую версию, поэтому
+    устаревшая запись не может стать снова доступной.
+
+    Версия заменяется сразу при изменении и повторно после фиксации
+    транзакции: запрос, прочитавший версию до фиксации и данные
+    из базы до нее, сохраняет профиль под уже неактуальной версией.
+    """
+
+    def __init__(self, alias: str, timeout: int, prefix: str = "profile"):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version_key(self, user_id) -> str:
+        return f"{self.prefix}:version:{user_id}"
+
+    def current_version(self, user_id):
+        """Версия профиля или None, если ее еще нет или она потеряна."""
+        return self.cache.get(self._version_key(user_id))
+
+    def version(self, user_id) -> str:
+        """Версия профиля, при отсутствии создается новая."""
+        key = self._version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            # при одновременном создании версии побеждает первая запись
+            version = uuid.uuid4().hex
+            self.cache.add(key, version, self.timeout)
+            version = self.cache.get(key, version)
+        return version
+
+    def get_or_build(self, user_id: int, build) -> tuple:
+        """
+        Профиль пользователя и его ETag.
+
+        `build` вызывается при отсутствии записи и возвращает данные
+        сериализатора. Версия читается до вызова `build`, поэтому данные,
+        прочитанные до изменения, сохраняются под прежней версией.
+
+        `build` читает с основной базы: после изменения профиля версия
+        заменяется, и запись, построенная по отстающей реплике, хранилась
+        бы под новой версией до истечения `timeout`.
+        """
+        key = f"{self.prefix}:{user_id}:{self.version(user_id)}"
+        entry = self.cache.get(key)
+        if entry is None:
+            with read_from_primary():
+                data = build()
+            content = json.dumps(data, sort_keys=True, default=str)
+            digest = hashlib.blake2b(content.encode(), digest_size=16)
+            entry = (f'"{digest.hexdigest()}"', data)
+            self.cache.set(key, entry, self.timeout)
+        return entry
+
+    def invalidate(self, user_ids) -> None:
+        """Замена версий профилей сейчас и после фиксации транзакции."""
+        user_ids = {user_id for user_id in user_ids if user_id}
+        if not user_ids:
+            return
+        self._replace_versions(user_ids)
+        transaction.on_commit(lambda: self._replace_versions(user_ids))
+
+    def _replace_versions(self, user_ids) -> None:
+        self.cache.set_many(
+            {
+                self._version_key(user_id): uuid.uuid4().hex
+                for user_id in user_ids
+            },
+            self.timeout,
+        )
+
+
+profile_cache = ProfileCache(
+    alias=settings.PROFILE_CACHE["ALIAS"],
+    timeout=settings.PROFILE_CACHE["TIMEOUT"],
+)
@@ -0,0 +1,149 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import SAFE_METHODS
+
+# запрос читает с основной базы
+pinned_to_primary = ContextVar("pinned_to_primary", default=False)
+
+
+@contextmanager
+def read_from_primary():
+    """Чтение с основной базы внутри блока независимо от клиента."""
+    token = pinned_to_primary.set(True)
+    try:
+        yield
+    finally:
+        pinned_to_primary.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Маршрутизация чтения на реплики, записи на основную базу.
+
+    Чтение выполняется на основной базе, если запрос закреплен за ней
+    (PrimaryStickinessMiddleware) или идет внутри транзакции основной
+    базы. Остальное чтение распределяется между репликами случайно.
+    """
+
+    def __init__(self):
+        self.replicas = settings.DATABASE_REPLICATION["REPLICAS"]
+
+    def db_for_read(self, model, **hints):
+        if (
+            not self.replicas
+            or pinned_to_primary.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплик обновляется репликацией
+        return db == DEFAULT_DB_ALIAS
+
+
+def client_key(request):
+    """
+    Клиент запроса: ключ токена из заголовка Authorization или сессия.
+    """
+    keyword = f"{TokenAuthentication.keyword} "
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    if authorization.startswith(keyword):
+        return authorization[len(keyword) :].strip()
+    return request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+
+
+def _sticky_key(client: str) -> str:
+    # ключ токена в кеше не хранится
+    digest = hashlib.sha256(client.encode()).hexdigest()[:32]
+    return f"replication:primary:{digest}"
+
+
+def _cache():
+    return caches[settings.DATABASE_REPLICATION["CACHE"]]
+
+
+def stick_to_primary(client: str) -> None:
+    """
+    Закрепление клиента за основной базой на STICKY_SECONDS.
+
+    Вызывается после записи, чтобы следующие запросы клиента читали
+    свои изменения, даже если реплики от них отстают.
+    """
+    config = settings.DATABASE_REPLICATION
+    if config["REPLICAS"] and client:
+        _cache().set(_sticky_key(client), True, config["STICKY_SECONDS"])
+
+
+async def astick_to_primary(client: str) -> None:
+    """Асинхронный stick_to_primary()."""
+    config = settings.DATABASE_REPLICATION
+    if config["REPLICAS"] and client:
+        await _cache().aset(
+            _sticky_key(client), True, config["STICKY_SECONDS"]
+        )
+
+
+class PrimaryStickinessMiddleware:
+    """
+    Чтение своих записей при работе с репликами.
+
+    Изменяющие запросы (POST, PUT, PATCH, DELETE) целиком выполняются
+    на основной базе, после них клиент закрепляется за основной базой
+    на STICKY_SECONDS, и его запросы в это время тоже читают с нее.
+    Клиент определяется по токену или сессии. Чтение через GET
+    в проекте ничего не записывает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        client = client_key(request)
+        writes = request.method not in SAFE_METHODS
+        pinned = writes or bool(client and _cache().get(_sticky_key(client)))
+        token = pinned_to_primary.set(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
+        if writes:
+            stick_to_primary(client)
+        return response
+
+    async def __acall__(self, request):
+        client = client_key(request)
+        writes = request.method not in SAFE_METHODS
+        pinned = writes or bool(
+            client and await _cache().aget(_sticky_key(client))
+        )
+        token = pinned_to_primary.set(pinned)
+        try:
+            response = await self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
+        if writes:
+            await astick_to_primary(client)
+        return response
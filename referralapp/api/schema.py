@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+from importlib.metadata import version
+from pathlib import Path
+
+from django.conf import settings
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+logger = logging.getLogger(__name__)
+
+# код, от которого зависит схема
+SOURCE_DIRS = ("api", "users", "referralapp")
+PACKAGES = ("django", "djangorestframework", "drf-spectacular")
+# форматы артефакта, совпадают с форматами рендереров SpectacularAPIView
+RENDERERS = {"yaml": OpenApiYamlRenderer, "json": OpenApiJsonRenderer}
+
+
+def source_fingerprint() -> str:
+    """
+    Отпечаток кода, настроек и версий пакетов, из которых строится схема.
+
+    Меняется при любом изменении модулей приложений, поэтому артефакт
+    с прежним отпечатком не используется.
+    """
+    digest = hashlib.sha256()
+    for directory in SOURCE_DIRS:
+        for path in sorted((settings.BASE_DIR / directory).rglob("*.py")):
+            if path.name == "tests.py":
+                continue
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    for package in PACKAGES:
+        digest.update(f"{package}=={version(package)}".encode())
+    schema_settings = (
+        settings.SPECTACULAR_SETTINGS,
+        settings.REST_FRAMEWORK,
+        settings.ASYNC_AUTH_VIEWS,
+        settings.LANGUAGE_CODE,
+    )
+    digest.update(json.dumps(schema_settings, default=str).encode())
+    return digest.hexdigest()[:16]
+
+
+def generate_schema() -> dict:
+    """Схема, построенная обходом представлений, как в SpectacularAPIView."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF
+    )
+    return generator.get_schema(
+        request=None, public=spectacular_settings.SERVE_PUBLIC
+    )
+
+
+class SchemaArtifact:
+    """
+    Схема OpenAPI, отрендеренная во всех форматах.
+
+    `version` - отпечаток кода, из которого построена схема, `documents`
+    сопоставляет формат с содержимым файла, `etags` - формат со строгим
+    ETag по содержимому.
+    """
+
+    def __init__(self, version: str, documents: dict):
+        self.version = version
+        self.documents = documents
+        self.etags = {
+            format: f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+            for format, content in documents.items()
+        }
+
+    @classmethod
+    def build(cls, version: str) -> "SchemaArtifact":
+        schema = generate_schema()
+        return cls(
+            version,
+            {
+                format: renderer().render(schema, renderer_context={})
+                for format, renderer in RENDERERS.items()
+            },
+        )
+
+    @staticmethod
+    def path(directory, version: str, format: str) -> Path:
+        return Path(directory) / f"schema.{version}.{format}"
+
+    @classmethod
+    def load(cls, directory, version: str):
+        """Артефакт из каталога или None, если его нет."""
+        try:
+            return cls(
+                version,
+                {
+                    format: cls.path(directory, version, format).read_bytes()
+                    for format in RENDERERS
+                },
+            )
+        except FileNotFoundError:
+            return None
+
+    def save(self, directory) -> None:
+        """Запись файлов артефакта, артефакты других версий удаляются."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for format, content in self.documents.items():
+            path = self.path(directory, self.version, format)
+            # файл подменяется целиком, чтобы другие процессы
+            # не прочитали его частично
+            temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            temporary.write_bytes(content)
+            os.replace(temporary, path)
+        for path in directory.glob("schema.*"):
+            if path.name.split(".")[1] != self.version:
+                path.unlink(missing_ok=True)
+
+
+@lru_cache
+def get_schema_artifact() -> SchemaArtifact:
+    """
+    Артефакт схемы для текущего кода.
+
+    Берется из каталога OPENAPI_SCHEMA["DIR"], куда его записывает
+    команда build_schema при сборке. Если артефакта для текущего
+    отпечатка нет, схема генерируется один раз на процесс.
+    """
+    directory = settings.OPENAPI_SCHEMA["DIR"]
+    fingerprint = source_fingerprint()
+    artifact = SchemaArtifact.load(directory, fingerprint)
+    if artifact is None:
+        logger.warning(
+            "Артефакт схемы %s не найден в %s, схема генерируется. "
+            "Выполните manage.py build_schema при сборке.",
+            fingerprint,
+            directory,
+        )
+        artifact = SchemaArtifact.build(fingerprint)
+        try:
+            artifact.save(directory)
+        except OSError:
+            logger.exception("Не удалось сохранить артефакт схемы")
+    return artifact
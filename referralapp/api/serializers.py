@@ -1,11 +1,22 @@
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
 
-from users.models import Referral
+from users.leaderboard import PERIODS
+from users.models import InviteCode, LeaderboardEntry, Referral, ReferralPath
+from users.referrals import ReferralCycleError, create_referral
 from users.validators import validate_invite_code, validate_phone_number
 
+from .instrumentation import TimedSerializerMixin
+from .pagination import InvitedUserCursorPagination
+
 User = get_user_model()
 
+# максимальное количество активаций в одном запросе
+BATCH_ACTIVATION_MAX_SIZE = 5000
+
 
 class PhoneSerializer(serializers.Serializer):
     """Сериализатор для авторизации пользователя."""
@@ -50,7 +61,7 @@ class InviteCodeSerializer(serializers.Serializer):
     )
 
 
-class ReferralSerializer(serializers.ModelSerializer):
+class ReferralSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Вложенный сериализатор для отображения номеров телефонов
     приглашенных пользователей.
@@ -65,14 +76,147 @@ class ReferralSerializer(serializers.ModelSerializer):
         fields = ("phone_number",)
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Сериализатор пользователя."""
+class InvitedUserSerializer(ReferralSerializer):
+    """Сериализатор приглашенного пользователя."""
+
+    id = serializers.ReadOnlyField(source="invitee_id", label="id")
+    activated_at = serializers.ReadOnlyField(
+        source="created_at", label="Дата активации"
+    )
+
+    class Meta(ReferralSerializer.Meta):
+        fields = ("id", "phone_number", "activated_at")
+
+
+class DownlineLevelSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Количество пользователей на уровне дерева приглашений."""
+
+    depth = serializers.IntegerField(label="Уровень")
+    count = serializers.IntegerField(label="Количество пользователей")
+
+
+class AncestorSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор пригласившего пользователя в цепочке приглашений."""
+
+    id = serializers.ReadOnlyField(source="ancestor_id", label="id")
+    phone_number = serializers.ReadOnlyField(
+        source="ancestor.phone_number", label="номер телефона"
+    )
+
+    class Meta:
+        model = ReferralPath
+        fields = ("id", "phone_number", "depth")
+
+
+class DescendantSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор пользователя из дерева приглашенных."""
+
+    id = serializers.ReadOnlyField(source="descendant_id", label="id")
+    phone_number = serializers.ReadOnlyField(
+        source="descendant.phone_number", label="номер телефона"
+    )
+
+    class Meta:
+        model = ReferralPath
+        fields = ("id", "phone_number", "depth")
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    """Параметры запроса таблицы лидеров."""
+
+    period = serializers.ChoiceField(
+        choices=PERIODS,
+        default=LeaderboardEntry.WEEK,
+        help_text="Период: day, week или all.",
+    )
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=100,
+        default=10,
+        help_text="Количество пользователей в топе.",
+    )
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    """Параметры выгрузки."""
+
+    output = serializers.ChoiceField(
+        choices=("ndjson", "csv"),
+        default="ndjson",
+        help_text="Формат выгрузки: ndjson или csv.",
+    )
+    since = serializers.DateTimeField(
+        required=False,
+        help_text=(
+            "Только строки, созданные не раньше указанного момента, "
+            "включительно."
+        ),
+    )
+
+
+class BatchActivationItemSerializer(serializers.Serializer):
+    """Активация инвайт-кода в пакете."""
+
+    invitee = serializers.IntegerField(
+        min_value=1, help_text="id приглашенного пользователя."
+    )
+    invite_code = serializers.CharField(
+        help_text="Инвайт-код пригласившего пользователя."
+    )
+
+
+class BatchActivationSerializer(serializers.Serializer):
+    """Пакет активаций инвайт-кодов."""
+
+    activations = BatchActivationItemSerializer(
+        many=True, min_length=1, max_length=BATCH_ACTIVATION_MAX_SIZE
+    )
+
+
+class LeaderboardEntrySerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    """Место пользователя в таблице лидеров."""
+
+    rank = serializers.IntegerField(read_only=True, label="Место")
+    id = serializers.ReadOnlyField(source="user_id", label="id")
+    phone_number = serializers.ReadOnlyField(
+        source="user.phone_number", label="номер телефона"
+    )
+
+    class Meta:
+        model = LeaderboardEntry
+        fields = ("rank", "id", "phone_number", "invited_count")
+
+
+class LeaderboardSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Таблица лидеров за период и место текущего пользователя."""
+
+    period = serializers.CharField(label="Период")
+    results = LeaderboardEntrySerializer(many=True, label="Топ")
+    me = LeaderboardEntrySerializer(
+        allow_null=True, label="Место текущего пользователя"
+    )
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Сериализатор пользователя.
+
+    Поле `inviters` содержит только последних приглашенных пользователей,
+    которых представление подгружает в атрибут `invited_preview`. Полный
+    список доступен по адресу /users/{id}/invited/.
+    """
 
     inviters = ReferralSerializer(
-        source="invited_users",
+        source="invited_preview",
         many=True,
         read_only=True,
-        label="Приглашенные пользователи",
+        label="Последние приглашенные пользователи",
+    )
+    invited_count = serializers.ReadOnlyField(
+        source="invite_code.invited_count",
+        label="Количество приглашенных пользователей",
     )
     invite_code = serializers.ReadOnlyField(
         source="invite_code.code", label="инвайт-код пользователя"
@@ -92,9 +236,65 @@ class UserSerializer(serializers.ModelSerializer):
             "last_name",
             "activated_invite_code",
             "invite_code",
+            "invited_count",
             "inviters",
         )
 
+    # поля профиля в порядке Meta.fields, кроме inviters, и пути
+    # к их значениям в values()
+    VALUE_FIELDS = (
+        ("id", "id"),
+        ("phone_number", "phone_number"),
+        ("email", "email"),
+        ("first_name", "first_name"),
+        ("last_name", "last_name"),
+        ("activated_invite_code", "referral_info__activated_invite_code"),
+        ("invite_code", "invite_code__code"),
+        ("invited_count", "invite_code__invited_count"),
+    )
+
+    @classmethod
+    def values(cls, queryset):
+        """Выборка значений полей профиля без создания объектов моделей."""
+        return queryset.prefetch_related(None).values(
+            *(source for _, source in cls.VALUE_FIELDS)
+        )
+
+    @classmethod
+    def from_values(cls, rows, preview_size: int) -> list:
+        """
+        Профили пользователей из строк `values()`.
+
+        Быстрый путь для списков: словари собираются напрямую, без полей
+        сериализатора, а последние `preview_size` приглашенных всех
+        пользователей загружаются одним запросом с нумерацией строк
+        внутри пригласившего. Результат совпадает с `data` сериализатора
+        с полем `invited_preview`.
+        """
+        previews = {row["id"]: [] for row in rows}
+        invited = (
+            Referral.objects.filter(inviter_id__in=previews)
+            .annotate(
+                position=Window(
+                    RowNumber(),
+                    partition_by=F("inviter_id"),
+                    order_by=InvitedUserCursorPagination.ordering,
+                )
+            )
+            .filter(position__lte=preview_size)
+            .order_by("inviter_id", *InvitedUserCursorPagination.ordering)
+            .values_list("inviter_id", "invitee__phone_number")
+        )
+        if previews:
+            for inviter_id, phone_number in invited:
+                previews[inviter_id].append({"phone_number": phone_number})
+        users = []
+        for row in rows:
+            user = {name: row[source] for name, source in cls.VALUE_FIELDS}
+            user["inviters"] = previews[row["id"]]
+            users.append(user)
+        return users
+
 
 class ReferralCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для активации инвайт-кода."""
@@ -115,32 +315,48 @@ class ReferralCreateSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         invitee = self.context["request"].user
         invite_code = attrs.get("activated_invite_code")
-        inviter = (
-            User.objects.filter(invite_code__code=invite_code)
-            .select_related("invite_code")
+        inviter_id = (
+            InviteCode.objects.filter(code=invite_code)
+            .values_list("user_id", flat=True)
             .first()
         )
-        if Referral.objects.filter(invitee=invitee).exists():
+        if inviter_id is None:
             raise serializers.ValidationError(
-                {"invite_code": "Инвайт код уже активирован."}
+                {"invite_code": "Указанный инвайт-код не существует."}
             )
-        if invitee == inviter:
+        if inviter_id == invitee.id:
             raise serializers.ValidationError(
                 {
                     "invite_code": "Пользователь не может пригласить самого себя."
                 }
             )
-        if not inviter:
-            raise serializers.ValidationError(
-                {"invite_code": "Указанный инвайт-код не существует."}
-            )
-        attrs["inviter"] = inviter
+        attrs["inviter_id"] = inviter_id
         return super().validate(attrs)
 
     def create(self, validated_data):
-        invitee = validated_data.get("invitee")
-        inviter = validated_data.get("inviter")
-        return Referral.objects.create(inviter=inviter, invitee=invitee)
+        try:
+            return create_referral(
+                validated_data["inviter_id"],
+                validated_data["invitee"],
+                validated_data["activated_invite_code"],
+            )
+        except IntegrityError:
+            # приглашенный уже активировал инвайт-код, в том числе
+            # в параллельном запросе
+            raise serializers.ValidationError(
+                {"invite_code": ["Инвайт код уже активирован."]}
+            )
+        except ReferralCycleError:
+            # цикл проверяется под блокировкой, поэтому учитывает
+            # и активации из параллельных запросов
+            raise serializers.ValidationError(
+                {
+                    "invite_code": [
+                        "Нельзя активировать инвайт-код приглашенного "
+                        "вами пользователя."
+                    ]
+                }
+            )
 
 
 # Сериализаторы для документации
@@ -161,3 +377,13 @@ class ErrorResponseSerializer(serializers.Serializer):
 
 class TokenResponseSerializer(serializers.Serializer):
     token = serializers.CharField()
+
+
+class BatchActivationResultSerializer(BatchActivationItemSerializer):
+    activated = serializers.BooleanField()
+    error = serializers.CharField(allow_null=True)
+
+
+class BatchActivationResponseSerializer(serializers.Serializer):
+    activated = serializers.IntegerField()
+    results = BatchActivationResultSerializer(many=True)
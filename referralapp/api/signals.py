@@ -0,0 +1,80 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import InviteCode, Referral
+from users.signals import referrals_created
+
+from .authentication import token_cache
+from .profile_cache import profile_cache
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """
+    Удаление пользователя удаленного токена из кеша аутентификации.
+    Замена версии профиля отбрасывает его и в других процессах.
+    """
+    token_cache.invalidate_users([instance.user_id])
+    profile_cache.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, signal, created=False, **kwargs):
+    """
+    Удаление измененного пользователя из кеша аутентификации и замена
+    версии его профиля.
+
+    Номер телефона приглашенного показывается в профиле пригласившего,
+    поэтому при изменении номера заменяется и профиль пригласившего.
+    Новый пользователь еще не мог попасть в кеши.
+    """
+    if created:
+        return
+    token_cache.invalidate_users([instance.pk])
+    user_ids = [instance.pk]
+    if signal is post_save and instance.phone_number_changed:
+        user_ids.extend(
+            Referral.objects.filter(invitee_id=instance.pk).values_list(
+                "inviter_id", flat=True
+            )
+        )
+    profile_cache.invalidate(user_ids)
+
+
+@receiver(post_save, sender=InviteCode)
+@receiver(post_delete, sender=InviteCode)
+def invalidate_invite_code_user(sender, instance, created=False, **kwargs):
+    """Замена версии профиля владельца измененного инвайт-кода."""
+    # инвайт-код создается вместе с пользователем
+    if not created:
+        profile_cache.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=Referral)
+@receiver(post_delete, sender=Referral)
+def invalidate_referral_users(sender, instance, **kwargs):
+    """
+    Удаление участников реферала из кешей аутентификации и профилей.
+
+    В кеше хранятся инвайт-код со счетчиком приглашенных и данные
+    активированного кода, которые меняются вместе с рефералом, а профиль
+    пригласившего содержит последних приглашенных.
+    """
+    token_cache.invalidate_users([instance.invitee_id, instance.inviter_id])
+    profile_cache.invalidate([instance.invitee_id, instance.inviter_id])
+
+
+@receiver(referrals_created)
+def invalidate_created_referral_users(sender, referrals, **kwargs):
+    """Удаление участников массово созданных рефералов из кешей."""
+    user_ids = set()
+    for referral in referrals:
+        user_ids.update((referral.invitee_id, referral.inviter_id))
+    user_ids.discard(None)
+    token_cache.invalidate_users(user_ids)
+    profile_cache.invalidate(user_ids)
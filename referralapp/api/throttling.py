@@ -0,0 +1,86 @@
+from collections.abc import Mapping
+
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class AuthRateThrottle(SimpleRateThrottle):
+    """
+    Базовое ограничение частоты запросов к эндпоинтам авторизации.
+
+    Область ограничения складывается из атрибута `throttle_scope`
+    представления и суффикса класса, например `phone_auth_ip`. История
+    запросов хранится в отдельном кеше "throttle" и учитывается
+    скользящим окном.
+    """
+
+    scope_suffix = None
+
+    @property
+    def cache(self):
+        return caches["throttle"]
+
+    def __init__(self):
+        # частота определяется в allow_request по области представления
+        pass
+
+    def configure(self, view) -> None:
+        self.scope = f"{view.throttle_scope}_{self.scope_suffix}"
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+    def allow_request(self, request, view):
+        self.configure(view)
+        return super().allow_request(request, view)
+
+    async def aallow_request(self, request, view):
+        """
+        Асинхронная проверка для асинхронных представлений.
+
+        Повторяет allow_request(), но читает и записывает историю
+        запросов через асинхронный API кеша.
+        """
+        self.configure(view)
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.history = await self.cache.aget(self.key, [])
+        self.now = self.timer()
+        while self.history and self.history[-1] <= self.now - self.duration:
+            self.history.pop()
+        if len(self.history) >= self.num_requests:
+            return self.throttle_failure()
+        self.history.insert(0, self.now)
+        await self.cache.aset(self.key, self.history, self.duration)
+        return True
+
+
+class ClientIPRateThrottle(AuthRateThrottle):
+    """Ограничение частоты запросов с одного IP адреса."""
+
+    scope_suffix = "ip"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": self.get_ident(request),
+        }
+
+
+class PhoneNumberRateThrottle(AuthRateThrottle):
+    """Ограничение частоты запросов для одного номера телефона."""
+
+    scope_suffix = "phone"
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.data, Mapping):
+            # тело не объект JSON, запрос отклонит сериализатор
+            return None
+        phone_number = str(request.data.get("phone_number", "")).strip()
+        if not phone_number:
+            # запрос без номера отклонит сериализатор
+            return None
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": phone_number,
+        }
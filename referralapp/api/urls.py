@@ -1,16 +1,39 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import CodeVerificationView, PhoneAuthView, UserViewSet
+from .views import (
+    AsyncCodeVerificationView,
+    AsyncPhoneAuthView,
+    BatchActivationView,
+    CodeVerificationView,
+    ExportView,
+    PhoneAuthView,
+    UserViewSet,
+)
 
 app_name = "api"
 
 router = DefaultRouter()
 router.register("users", UserViewSet, basename="users")
 
+# под ASGI сервером авторизация обрабатывается асинхронными представлениями
+if settings.ASYNC_AUTH_VIEWS:
+    phone_auth_view = AsyncPhoneAuthView
+    code_verification_view = AsyncCodeVerificationView
+else:
+    phone_auth_view = PhoneAuthView
+    code_verification_view = CodeVerificationView
+
 
 urlpatterns = [
     path("", include(router.urls)),
-    path("auth/phone/", PhoneAuthView.as_view(), name="phone_auth"),
-    path("auth/verify/", CodeVerificationView.as_view(), name="code_verify"),
+    path("auth/phone/", phone_auth_view.as_view(), name="phone_auth"),
+    path("auth/verify/", code_verification_view.as_view(), name="code_verify"),
+    path("export/<str:resource>/", ExportView.as_view(), name="export"),
+    path(
+        "activate-invite-codes/",
+        BatchActivationView.as_view(),
+        name="batch_activation",
+    ),
 ]
@@ -1,38 +1,173 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.http import parse_etags
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (
     OpenApiExample,
+    OpenApiParameter,
     OpenApiResponse,
     extend_schema,
     extend_schema_view,
 )
+from drf_spectacular.views import (
+    SpectacularAPIView,
+    SpectacularRedocView,
+    SpectacularSwaggerView,
+)
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    NotFound,
+    ValidationError,
+)
 from rest_framework.mixins import (
     DestroyModelMixin,
     ListModelMixin,
     RetrieveModelMixin,
 )
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from .permissions import IsAdminOrReadOnly
+from users import leaderboard
+from users.models import Referral, ReferralPath
+from users.referrals import activate_invite_codes
+from users.signals import referrals_created
+
+from .async_views import AsyncAPIView
+from .authentication import token_cache
+from .delivery import get_delivery_pipeline
+from .exports import EXPORTS, FORMATS
+from .instrumentation import registry
+from .outbox import outbox_lag
+from .pagination import (
+    DescendantCursorPagination,
+    InvitedUserCursorPagination,
+    UserCursorPagination,
+)
+from .permissions import IsAdminOrReadOnly, IsStaffOrMetricsToken
+from .profile_cache import profile_cache
+from .replication import astick_to_primary, stick_to_primary
+from .schema import get_schema_artifact
 from .serializers import (
+    AncestorSerializer,
     AuthTokenSerializer,
+    BatchActivationResponseSerializer,
+    BatchActivationSerializer,
+    DescendantSerializer,
+    DownlineLevelSerializer,
     DummyDetailSerializer,
     ErrorResponseSerializer,
+    ExportQuerySerializer,
     InviteCodeSerializer,
+    InvitedUserSerializer,
+    LeaderboardQuerySerializer,
+    LeaderboardSerializer,
     PhoneSerializer,
     ReferralCreateSerializer,
     TokenResponseSerializer,
     UserSerializer,
 )
-from .utils import send_confirmation_code, verify_confirm_code
+from .throttling import ClientIPRateThrottle, PhoneNumberRateThrottle
+from .utils import (
+    asend_confirmation_code,
+    averify_confirm_code,
+    send_confirmation_code,
+    verify_confirm_code,
+)
 
 User = get_user_model()
 
+# количество последних приглашенных пользователей в профиле
+INVITED_PREVIEW_SIZE = 5
+# номера телефонов последних приглашенных подгружаются одним запросом
+# вместе с рефералами, а не отдельным запросом на каждого
+INVITED_PREVIEW = Prefetch(
+    "invited_users",
+    queryset=Referral.objects.select_related("invitee")
+    .only("inviter_id", "invitee__phone_number")
+    .order_by(*InvitedUserCursorPagination.ordering)[:INVITED_PREVIEW_SIZE],
+    to_attr="invited_preview",
+)
+
+
+# описание эндпоинтов авторизации общее для синхронных и асинхронных
+# представлений
+phone_auth_schema = extend_schema(
+    operation_id="Вход или регистрация пользователя.",
+    request=PhoneSerializer,
+    responses={
+        200: OpenApiResponse(
+            response=DummyDetailSerializer,
+            description="Код успешно отправлен на указанный номер телефона.",
+            examples=[
+                OpenApiExample(
+                    name="message",
+                    value={"message": "Код отправлен на номер +1234567890"},
+                )
+            ],
+        ),
+    },
+    description=(
+        "Пользователь указывает номер телефона на который будет "
+        "отправлен код верификации."
+    ),
+)
+
+code_verification_schema = extend_schema(
+    operation_id="Получение токена по номеру телефона и коду верификации",
+    request=AuthTokenSerializer,
+    responses={
+        200: OpenApiResponse(
+            response=TokenResponseSerializer,
+            description="Успешная верификация кода. Возвращается токен пользователя.",
+            examples=[
+                OpenApiExample(
+                    name="token",
+                    value={
+                        "token": "9754d29331447ec35a23e9141c6b48ec7309d141"
+                    },
+                )
+            ],
+        ),
+        400: OpenApiResponse(
+            response=ErrorResponseSerializer,
+            description="Ошибки в процессе верификации. Например, неверный код или номер телефона.",
+            examples=[
+                OpenApiExample(
+                    name="error 400",
+                    value={"error": "Неверный код верификации."},
+                )
+            ],
+        ),
+        404: OpenApiResponse(
+            response=ErrorResponseSerializer,
+            description="Номер телефона не найден.",
+            examples=[
+                OpenApiExample(
+                    name="error 404",
+                    value={
+                        "error": "Неверный или не существующий номер телефона"
+                    },
+                )
+            ],
+        ),
+    },
+    description="Вход или регистрация пользователя. Отправляет код на указанный номер телефона.",
+)
+
 
 @extend_schema(tags=["Аутентификация"])
 class PhoneAuthView(APIView):
@@ -40,29 +175,10 @@ class PhoneAuthView(APIView):
 
     serializer_class = PhoneSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [ClientIPRateThrottle, PhoneNumberRateThrottle]
+    throttle_scope = "phone_auth"
 
-    @extend_schema(
-        operation_id="Вход или регистрация пользователя.",
-        request=PhoneSerializer,
-        responses={
-            200: OpenApiResponse(
-                response=DummyDetailSerializer,
-                description="Код успешно отправлен на указанный номер телефона.",
-                examples=[
-                    OpenApiExample(
-                        name="message",
-                        value={
-                            "message": "Код отправлен на номер +1234567890"
-                        },
-                    )
-                ],
-            ),
-        },
-        description=(
-            "Пользователь указывает номер телефона на который будет "
-            "отправлен код верификации."
-        ),
-    )
+    @phone_auth_schema
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -83,60 +199,107 @@ class CodeVerificationView(APIView):
 
     serializer_class = AuthTokenSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [ClientIPRateThrottle, PhoneNumberRateThrottle]
+    throttle_scope = "code_verify"
 
-    @extend_schema(
-        operation_id="Получение токена по номеру телефона и коду верификации",
-        request=AuthTokenSerializer,
-        responses={
-            200: OpenApiResponse(
-                response=TokenResponseSerializer,
-                description="Успешная верификация кода. Возвращается токен пользователя.",
-                examples=[
-                    OpenApiExample(
-                        name="token",
-                        value={
-                            "token": "9754d29331447ec35a23e9141c6b48ec7309d141"
-                        },
-                    )
-                ],
-            ),
-            400: OpenApiResponse(
-                response=ErrorResponseSerializer,
-                description="Ошибки в процессе верификации. Например, неверный код или номер телефона.",
-                examples=[
-                    OpenApiExample(
-                        name="error 400",
-                        value={"error": "Неверный код верификации."},
-                    )
-                ],
-            ),
-            404: OpenApiResponse(
-                response=ErrorResponseSerializer,
-                description="Номер телефона не найден.",
-                examples=[
-                    OpenApiExample(
-                        name="error 404",
-                        value={
-                            "error": "Неверный или не существующий номер телефона"
-                        },
-                    )
-                ],
-            ),
-        },
-        description="Вход или регистрация пользователя. Отправляет код на указанный номер телефона.",
-    )
+    @code_verification_schema
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         phone_number = serializer.validated_data.get("phone_number")
         confirmation_code = serializer.validated_data.get("confirmation_code")
-        user, _ = User.objects.get_or_create(phone_number=phone_number)
+        # пользователь создается только после успешной проверки кода
         if not verify_confirm_code(phone_number, confirmation_code):
             return Response(
                 {"error": "Неверный код верификации."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        token, _ = Token.objects.get_or_create(user=user)
+        user = (
+            User.objects.select_related("auth_token")
+            .filter(phone_number=phone_number)
+            .first()
+        )
+        if user is None:
+            user, token = self.create_user(phone_number)
+        else:
+            token = getattr(user, "auth_token", None)
+            if token is None:
+                token = Token.objects.create(user=user)
+        # запрос пришел без токена, поэтому клиент закрепляется за основной
+        # базой по новому токену: реплика может еще не содержать
+        # пользователя
+        stick_to_primary(token.key)
+        return Response({"token": token.key})
+
+    def create_user(self, phone_number: str) -> tuple:
+        """Создание пользователя и его токена."""
+        with transaction.atomic():
+            user = User.objects.create(phone_number=phone_number)
+            token = Token.objects.create(user=user)
+        return user, token
+
+
+@extend_schema(tags=["Аутентификация"])
+class AsyncPhoneAuthView(AsyncAPIView, PhoneAuthView):
+    """
+    Асинхронный PhoneAuthView для запуска под ASGI сервером.
+
+    Код сохраняется через асинхронный API хранилища кодов, ограничения
+    частоты проверяются через асинхронный API кеша.
+    """
+
+    # вход не требует пользователя, токен из заголовка не проверяется
+    authentication_classes = ()
+
+    @phone_auth_schema
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phone_number = serializer.validated_data.get("phone_number")
+        # TODO: код подтверждения отправляем клиенту для
+        # тестирования верификации, нужно убрать из кода
+        new_code = await asend_confirmation_code(phone_number)
+        return Response(
+            {"message": f"Код {new_code} отправлен на номер {phone_number}"},
+            status=status.HTTP_200_OK,
+        )
+
+
+@extend_schema(tags=["Аутентификация"])
+class AsyncCodeVerificationView(AsyncAPIView, CodeVerificationView):
+    """
+    Асинхронный CodeVerificationView для запуска под ASGI сервером.
+
+    Код проверяется и пользователь читается через асинхронный ORM.
+    Транзакции в асинхронном коде Django не поддерживаются, поэтому
+    новый пользователь с токеном создается в одном вызове sync_to_async.
+    """
+
+    authentication_classes = ()
+
+    @code_verification_schema
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phone_number = serializer.validated_data.get("phone_number")
+        confirmation_code = serializer.validated_data.get("confirmation_code")
+        if not await averify_confirm_code(phone_number, confirmation_code):
+            return Response(
+                {"error": "Неверный код верификации."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        user = (
+            await User.objects.select_related("auth_token")
+            .filter(phone_number=phone_number)
+            .afirst()
+        )
+        if user is None:
+            user, token = await sync_to_async(self.create_user)(phone_number)
+        else:
+            token = getattr(user, "auth_token", None)
+            if token is None:
+                token = await Token.objects.acreate(user=user)
+        await astick_to_primary(token.key)
         return Response({"token": token.key})
 
 
@@ -144,11 +307,51 @@ class CodeVerificationView(APIView):
 @extend_schema_view(
     list=extend_schema(
         operation_id="Список пользователей",
+        parameters=[
+            OpenApiParameter(
+                "phone_number",
+                str,
+                description="Начало номера телефона.",
+            )
+        ],
         responses={200: UserSerializer},
     ),
     retrieve=extend_schema(
         operation_id="Получение одного пользователя",
-        responses={200: UserSerializer},
+        responses={
+            200: UserSerializer,
+            304: OpenApiResponse(
+                description="Профиль не изменился с версии из If-None-Match."
+            ),
+        },
+    ),
+    invited=extend_schema(
+        operation_id="Приглашенные пользователи",
+        responses={200: InvitedUserSerializer(many=True)},
+    ),
+    downline=extend_schema(
+        operation_id="Количество приглашенных по уровням",
+        responses={200: DownlineLevelSerializer(many=True)},
+    ),
+    upline=extend_schema(
+        operation_id="Цепочка пригласивших пользователей",
+        responses={200: AncestorSerializer(many=True)},
+    ),
+    descendants=extend_schema(
+        operation_id="Дерево приглашенных пользователей",
+        parameters=[
+            OpenApiParameter(
+                "depth",
+                int,
+                description="Только пользователи указанного уровня.",
+            )
+        ],
+        responses={200: DescendantSerializer(many=True)},
+    ),
+    leaderboard=extend_schema(
+        operation_id="Таблица лидеров",
+        parameters=[LeaderboardQuerySerializer],
+        responses={200: LeaderboardSerializer},
     ),
 )
 class UserViewSet(
@@ -159,8 +362,64 @@ class UserViewSet(
     serializer_class = UserSerializer
     queryset = User.objects.select_related(
         "invite_code", "referral_info"
-    ).prefetch_related("invited_users")
+    ).prefetch_related(INVITED_PREVIEW)
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "list":
+            # поиск по началу номера использует индекс varchar_pattern_ops,
+            # который Django создает для уникального поля в PostgreSQL
+            phone_number = self.request.query_params.get("phone_number")
+            if phone_number:
+                queryset = queryset.filter(
+                    phone_number__startswith=phone_number
+                )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список пользователей.
+
+        Страница читается через values() и собирается без объектов
+        моделей и полей сериализатора, ответ совпадает с UserSerializer.
+        """
+        queryset = UserSerializer.values(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(
+            UserSerializer.from_values(page, INVITED_PREVIEW_SIZE)
+        )
+
+    def retrieve(self, request, pk=None):
+        if not str(pk).isdigit():
+            raise NotFound
+        return self.profile_response(request, int(pk), self.get_object)
+
+    def profile_response(self, request, user_id: int, load) -> Response:
+        """
+        Профиль пользователя из кеша профилей.
+
+        `load` загружает пользователя при отсутствии записи в кеше.
+        Если ETag профиля совпадает с заголовком If-None-Match, профиль
+        не передается повторно и возвращается ответ 304.
+        """
+        etag, data = profile_cache.get_or_build(
+            user_id, lambda: self.get_serializer(load()).data
+        )
+        # клиент проверяет актуальность профиля при каждом запросе
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = {
+            tag.removeprefix("W/")
+            for tag in parse_etags(request.headers.get("If-None-Match", ""))
+        }
+        if etag in if_none_match or "*" in if_none_match:
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        return Response(data, headers=headers)
 
     @extend_schema(operation_id="Профиль пользователя")
     @action(
@@ -170,10 +429,14 @@ class UserViewSet(
     )
     def me(self, request):
         """Профиль пользователя."""
-        current_user = self.get_queryset().filter(id=request.user.id).first()
         if request.method == "GET":
-            serializer = self.serializer_class(current_user)
-            return Response(serializer.data)
+            # пользователь уже загружен аутентификацией вместе
+            # с инвайт-кодом и рефералом, при отсутствии записи в кеше
+            # профилей загружаются только последние приглашенные
+            return self.profile_response(
+                request, request.user.pk, self.with_invited_preview
+            )
+        current_user = self.current_user()
         serializer = self.serializer_class(
             current_user, data=request.data, partial=True
         )
@@ -187,6 +450,129 @@ class UserViewSet(
         serializer.save()
         return Response(serializer.data)
 
+    def with_invited_preview(self):
+        """Пользователь запроса с последними приглашенными."""
+        user = self.request.user
+        prefetch_related_objects([user], INVITED_PREVIEW)
+        return user
+
+    def current_user(self):
+        """
+        Пользователь запроса из базы.
+
+        Пользователь, удаленный после аутентификации, считается
+        неаутентифицированным.
+        """
+        user = self.get_queryset().filter(pk=self.request.user.pk).first()
+        if user is None:
+            raise AuthenticationFailed("Пользователь удален.")
+        return user
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        serializer_class=InvitedUserSerializer,
+        pagination_class=InvitedUserCursorPagination,
+    )
+    def invited(self, request, pk=None):
+        """Постраничный список пользователей, приглашенных пользователем."""
+        user = get_object_or_404(User.objects.only("id"), pk=pk)
+        queryset = Referral.objects.filter(inviter=user).select_related(
+            "invitee"
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        serializer_class=DownlineLevelSerializer,
+        pagination_class=None,
+    )
+    def downline(self, request, pk=None):
+        """Количество приглашенных пользователей на каждом уровне."""
+        user = get_object_or_404(User.objects.only("id"), pk=pk)
+        levels = (
+            ReferralPath.objects.filter(ancestor=user)
+            .values("depth")
+            .annotate(count=Count("id"))
+            .order_by("depth")
+        )
+        serializer = self.get_serializer(levels, many=True)
+        return Response(serializer.data)
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        serializer_class=AncestorSerializer,
+        pagination_class=None,
+    )
+    def upline(self, request, pk=None):
+        """Цепочка пригласивших пользователей, начиная с ближайшего."""
+        user = get_object_or_404(User.objects.only("id"), pk=pk)
+        paths = (
+            ReferralPath.objects.filter(descendant=user)
+            .select_related("ancestor")
+            .only("ancestor_id", "ancestor__phone_number", "depth")
+            .order_by("depth")
+        )
+        serializer = self.get_serializer(paths, many=True)
+        return Response(serializer.data)
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        serializer_class=DescendantSerializer,
+        pagination_class=DescendantCursorPagination,
+    )
+    def descendants(self, request, pk=None):
+        """Постраничный список всех пользователей из дерева приглашенных."""
+        user = get_object_or_404(User.objects.only("id"), pk=pk)
+        paths = (
+            ReferralPath.objects.filter(ancestor=user)
+            .select_related("descendant")
+            .only("id", "descendant_id", "descendant__phone_number", "depth")
+        )
+        depth = request.query_params.get("depth")
+        if depth is not None:
+            if not depth.isdigit():
+                raise ValidationError(
+                    {"depth": "Уровень должен быть положительным числом."}
+                )
+            paths = paths.filter(depth=depth)
+        page = self.paginate_queryset(paths)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        serializer_class=LeaderboardSerializer,
+        pagination_class=None,
+    )
+    def leaderboard(self, request):
+        """
+        Пользователи с наибольшим количеством приглашенных за период
+        и место текущего пользователя.
+        """
+        params = LeaderboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        period = params.validated_data["period"]
+        me = None
+        if request.user.is_authenticated:
+            me = leaderboard.rank(period, request.user)
+        serializer = self.get_serializer(
+            {
+                "period": period,
+                "results": leaderboard.top(
+                    period, params.validated_data["limit"]
+                ),
+                "me": me,
+            }
+        )
+        return Response(serializer.data)
+
     @extend_schema(
         operation_id="Активация инвайт-кода",
         request=InviteCodeSerializer,
@@ -225,3 +611,232 @@ class UserViewSet(
                 status=status.HTTP_201_CREATED,
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(exclude=True)
+class MetricsView(APIView):
+    """Показатели запросов в текстовом формате Prometheus."""
+
+    permission_classes = [IsStaffOrMetricsToken]
+
+    def get(self, request):
+        pending_events, outbox_lag_seconds = outbox_lag()
+        gauges = {
+            "code_delivery_queue_depth": (
+                "Количество сообщений в очереди отправки кодов.",
+                get_delivery_pipeline().queue_depth,
+            ),
+            "token_cache_size": (
+                "Количество пользователей в кеше аутентификации.",
+                len(token_cache),
+            ),
+            "outbox_pending_events": (
+                "Количество неопубликованных событий outbox.",
+                pending_events,
+            ),
+            "outbox_lag_seconds": (
+                "Возраст самого старого неопубликованного события.",
+                outbox_lag_seconds,
+            ),
+        }
+        return HttpResponse(
+            registry.render(gauges),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+@extend_schema(tags=["Выгрузка"])
+class ExportView(APIView):
+    """
+    Потоковая выгрузка пользователей и рефералов.
+
+    Строки читаются из базы пакетами и сразу отправляются клиенту,
+    поэтому память не зависит от размера таблицы.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        operation_id="Выгрузка пользователей и рефералов",
+        parameters=[
+            OpenApiParameter(
+                "resource",
+                str,
+                OpenApiParameter.PATH,
+                enum=list(EXPORTS),
+                description="Выгружаемая таблица: users или referrals.",
+            ),
+            ExportQuerySerializer,
+        ],
+        responses={
+            (200, "application/x-ndjson"): OpenApiResponse(
+                response=OpenApiTypes.STR,
+                description=(
+                    "Строки таблицы, по одному JSON объекту на строку."
+                ),
+            ),
+            (200, "text/csv"): OpenApiResponse(
+                response=OpenApiTypes.STR,
+                description="Строки таблицы в CSV с заголовком.",
+            ),
+        },
+        description=(
+            "Потоковая выгрузка всех строк таблицы для администраторов. "
+            "Строки упорядочены по времени создания (пользователи - по id), "
+            "`since` выгружает только строки, созданные с указанного момента: "
+            "для пользователей - по дате регистрации, для рефералов - "
+            "по дате создания."
+        ),
+    )
+    def get(self, request, resource):
+        export = EXPORTS.get(resource)
+        if export is None:
+            raise NotFound()
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        output = params.validated_data["output"]
+        lines, content_type = FORMATS[output]
+        rows = export.rows(params.validated_data.get("since"))
+        response = StreamingHttpResponse(
+            lines(list(export.columns), rows), content_type=content_type
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{resource}.{output}"'
+        )
+        return response
+
+
+@extend_schema(tags=["Активация инвайт-кода"])
+class BatchActivationView(APIView):
+    """
+    Пакетная активация инвайт-кодов.
+
+    Партнеры регистрируют пользователей пачками и активируют их
+    инвайт-коды одним запросом вместо запроса на каждого пользователя.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        operation_id="Пакетная активация инвайт-кодов",
+        request=BatchActivationSerializer,
+        responses={
+            200: OpenApiResponse(
+                response=BatchActivationResponseSerializer,
+                description=(
+                    "Результат активации для каждой пары в порядке запроса."
+                ),
+            ),
+            409: OpenApiResponse(
+                response=ErrorResponseSerializer,
+                description=(
+                    "Приглашенный из пакета активировал инвайт-код "
+                    "в параллельном запросе. Пакет не записан, запрос "
+                    "можно повторить."
+                ),
+            ),
+        },
+        description=(
+            "Активация инвайт-кодов для пар (приглашенный, инвайт-код) "
+            "от имени администратора или сервисной учетной записи. "
+            "Пары с ошибкой (неизвестный код или пользователь, "
+            "самоприглашение, повторная активация, цикл приглашений) "
+            "пропускаются, остальные активируются в одной транзакции."
+        ),
+    )
+    def post(self, request):
+        serializer = BatchActivationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        activations = serializer.validated_data["activations"]
+        try:
+            results = activate_invite_codes(
+                (item["invitee"], item["invite_code"]) for item in activations
+            )
+        except IntegrityError:
+            return Response(
+                {"error": "Инвайт код уже активирован в другом запросе."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        referrals = [
+            result for result in results if isinstance(result, Referral)
+        ]
+        referrals_created.send(sender=Referral, referrals=referrals)
+        return Response(
+            {
+                "activated": len(referrals),
+                "results": [
+                    {
+                        **item,
+                        "activated": isinstance(result, Referral),
+                        "error": (
+                            None if isinstance(result, Referral) else result
+                        ),
+                    }
+                    for item, result in zip(activations, results)
+                ],
+            }
+        )
+
+
+@extend_schema(exclude=True)
+class SchemaView(APIView):
+    """
+    Схема OpenAPI из артефакта, сгенерированного при сборке.
+
+    Формат выбирается согласованием, как в SpectacularAPIView. Адрес
+    с версией схемы не меняет содержимого и кешируется на год, адрес
+    без версии проверяется клиентом по ETag при каждом запросе.
+    """
+
+    renderer_classes = SpectacularAPIView.renderer_classes
+    permission_classes = [AllowAny]
+    authentication_classes = ()
+
+    def get(self, request, version=None):
+        artifact = get_schema_artifact()
+        if version is not None and version != artifact.version:
+            raise NotFound()
+        renderer = request.accepted_renderer
+        etag = artifact.etags[renderer.format]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": (
+                "public, max-age=31536000, immutable"
+                if version
+                else "no-cache"
+            ),
+        }
+        if_none_match = {
+            tag.removeprefix("W/")
+            for tag in parse_etags(request.headers.get("If-None-Match", ""))
+        }
+        if etag in if_none_match or "*" in if_none_match:
+            return HttpResponse(
+                status=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f"; charset={renderer.charset}"
+        return HttpResponse(
+            artifact.documents[renderer.format],
+            content_type=content_type,
+            headers=headers,
+        )
+
+
+class VersionedSchemaMixin:
+    """Страница документации загружает схему по адресу с версией."""
+
+    def _get_schema_url(self, request):
+        return reverse(
+            "schema-version",
+            kwargs={"version": get_schema_artifact().version},
+        )
+
+
+class SwaggerView(VersionedSchemaMixin, SpectacularSwaggerView):
+    pass
+
+
+class RedocView(VersionedSchemaMixin, SpectacularRedocView):
+    pass
@@ -0,0 +1,59 @@
+"""
+Бенчмарки проекта.
+
+Запускаются из папки `referralapp` как модули, например:
+
+    python -m benchmarks.invite_codes --count 1000000
+
+Каждый бенчмарк работает с отдельной тестовой базой данных, которая
+создается перед запуском и удаляется после него.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup() -> None:
+    """Настройка Django для запуска бенчмарка вне manage.py."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "referralapp.settings")
+    os.environ.setdefault("ALLOWED_HOSTS", "testserver 127.0.0.1 localhost")
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def test_database(name: str = None):
+    """
+    Создание временной базы данных на время бенчмарка.
+
+    `name` задает имя тестовой базы, например файл SQLite, который нужен
+    для одновременной работы нескольких потоков сервера. Без `name`
+    используется имя Django по умолчанию, для SQLite - база в памяти,
+    а не файл тестовой базы из настроек.
+    """
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment,
+        teardown_test_environment,
+    )
+
+    setup_test_environment()
+    connection.settings_dict["TEST"]["NAME"] = name
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer(title: str, count: int):
+    """Замер времени выполнения и вывод количества операций в секунду."""
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    print(f"{title}: {count} за {elapsed:.2f} с ({count / elapsed:,.0f}/с)")
@@ -0,0 +1,269 @@
+"""
+Бенчмарк эндпоинтов авторизации под WSGI и ASGI.
+
+Каждый клиент проходит вход нового пользователя: запрос кода
+и верификацию. Запросы передаются обработчикам Django напрямую, без
+сети, с `--concurrency` одновременными клиентами:
+
+- `wsgi` - синхронные представления, WSGIHandler в пуле потоков;
+- `asgi-sync` - синхронные представления под ASGIHandler, каждое
+  выполняется в потоке через sync_to_async;
+- `asgi` - асинхронные представления под ASGIHandler.
+
+    python -m benchmarks.asgi --requests 500 --concurrency 1 8 32
+
+База данных SQLite хранится в файле, чтобы с ней одновременно
+работали потоки запросов.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks import setup, test_database
+
+MODES = ("wsgi", "asgi-sync", "asgi")
+# ограничения частоты остаются в обработке запроса, но не срабатывают
+THROTTLE_RATES = {
+    f"{scope}_{suffix}": "1000000/min"
+    for scope in ("phone_auth", "code_verify")
+    for suffix in ("ip", "phone")
+}
+
+phone_numbers = (f"+7950{number:07d}" for number in itertools.count())
+
+
+class NullSender:
+    """Отправитель, который ничего не отправляет."""
+
+    def send_many(self, messages: list) -> None:
+        pass
+
+
+def urlconf(phone_auth_view, code_verification_view):
+    """Модуль URL с эндпоинтами авторизации на указанных представлениях."""
+    from django.urls import path
+
+    return type(
+        "urls",
+        (),
+        {
+            "urlpatterns": [
+                path("auth/phone/", phone_auth_view.as_view()),
+                path("auth/verify/", code_verification_view.as_view()),
+            ]
+        },
+    )
+
+
+def code_from(body: bytes) -> str:
+    # код возвращается в ответе для тестирования: "Код 1234 отправлен..."
+    return json.loads(body)["message"].split()[1]
+
+
+def wsgi_post(handler, path: str, data: dict) -> tuple:
+    body = json.dumps(data).encode()
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": path,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": "localhost",
+        "wsgi.input": BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    status = []
+    chunks = handler(environ, lambda line, headers: status.append(line))
+    content = b"".join(chunks)
+    chunks.close()
+    return int(status[0].split()[0]), content
+
+
+async def asgi_post(application, path: str, data: dict) -> tuple:
+    body = json.dumps(data).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"body": b""}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # клиент не отключается, обработчик отменит ожидание сам
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await application(scope, receive, send)
+    return response["status"], response["body"]
+
+
+def wsgi_login(handler) -> float:
+    """Вход нового пользователя, возвращает время входа."""
+    phone_number = next(phone_numbers)
+    started = time.perf_counter()
+    status, body = wsgi_post(
+        handler, "/auth/phone/", {"phone_number": phone_number}
+    )
+    assert status == 200, body
+    code = code_from(body)
+    status, body = wsgi_post(
+        handler,
+        "/auth/verify/",
+        {"phone_number": phone_number, "confirmation_code": code},
+    )
+    assert status == 200, body
+    return time.perf_counter() - started
+
+
+async def asgi_login(application) -> float:
+    phone_number = next(phone_numbers)
+    started = time.perf_counter()
+    status, body = await asgi_post(
+        application, "/auth/phone/", {"phone_number": phone_number}
+    )
+    assert status == 200, body
+    code = code_from(body)
+    status, body = await asgi_post(
+        application,
+        "/auth/verify/",
+        {"phone_number": phone_number, "confirmation_code": code},
+    )
+    assert status == 200, body
+    return time.perf_counter() - started
+
+
+def run_wsgi(requests: int, concurrency: int) -> list:
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(
+            executor.map(lambda _: wsgi_login(handler), range(requests))
+        )
+
+
+def run_asgi(requests: int, concurrency: int) -> list:
+    from django.core.handlers.asgi import ASGIHandler
+
+    application = ASGIHandler()
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login():
+            async with semaphore:
+                return await asgi_login(application)
+
+        return await asyncio.gather(*(login() for _ in range(requests)))
+
+    return asyncio.run(run())
+
+
+def percentile(values: list, percent: int) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 32]
+    )
+    parser.add_argument(
+        "--modes", choices=MODES, nargs="+", default=list(MODES)
+    )
+    args = parser.parse_args()
+    setup()
+
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    from api.delivery import DeliveryPipeline
+    from api.throttling import AuthRateThrottle
+    from api.views import (
+        AsyncCodeVerificationView,
+        AsyncPhoneAuthView,
+        CodeVerificationView,
+        PhoneAuthView,
+    )
+
+    urlconfs = {
+        "wsgi": urlconf(PhoneAuthView, CodeVerificationView),
+        "asgi-sync": urlconf(PhoneAuthView, CodeVerificationView),
+        "asgi": urlconf(AsyncPhoneAuthView, AsyncCodeVerificationView),
+    }
+    runners = {"wsgi": run_wsgi, "asgi-sync": run_asgi, "asgi": run_asgi}
+    database = None
+    default = settings.DATABASES["default"]
+    if default["ENGINE"].endswith("sqlite3"):
+        database = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+        default.setdefault("OPTIONS", {}).update(
+            timeout=30, transaction_mode="IMMEDIATE"
+        )
+
+    with ExitStack() as stack:
+        stack.enter_context(test_database(database))
+        stack.enter_context(
+            mock.patch.object(
+                AuthRateThrottle, "THROTTLE_RATES", THROTTLE_RATES
+            )
+        )
+        stack.enter_context(
+            mock.patch(
+                "api.utils.get_delivery_pipeline",
+                return_value=DeliveryPipeline(NullSender()),
+            )
+        )
+        print(
+            f"{'режим':<10} {'клиенты':>8} {'входов/с':>9} "
+            f"{'p50':>8} {'p95':>8}"
+        )
+        for concurrency in args.concurrency:
+            for mode in args.modes:
+                with override_settings(ROOT_URLCONF=urlconfs[mode]):
+                    started = time.perf_counter()
+                    durations = runners[mode](args.requests, concurrency)
+                    elapsed = time.perf_counter() - started
+                print(
+                    f"{mode:<10} {concurrency:>8} "
+                    f"{args.requests / elapsed:>9.1f} "
+                    f"{percentile(durations, 50) * 1000:>6.1f}мс "
+                    f"{percentile(durations, 95) * 1000:>6.1f}мс"
+                )
+
+
+if __name__ == "__main__":
+    main()
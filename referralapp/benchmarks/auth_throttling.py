@@ -0,0 +1,77 @@
+"""
+Нагрузочный тест ограничения частоты запросов к авторизации.
+
+Эмулирует бота, который запрашивает коды для одного номера телефона
+и перебирает коды верификации, и сравнивает работу сервера
+с ограничениями и без них.
+
+    python -m benchmarks.auth_throttling --requests 1000
+"""
+
+import argparse
+import time
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+
+def attack(client, requests: int) -> tuple:
+    """Запросы бота: выдача кода и перебор кодов верификации."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+
+    statuses = {}
+    with CaptureQueriesContext(connection) as context:
+        started = time.perf_counter()
+        for number in range(requests):
+            if number % 2:
+                url = reverse("api:code_verify")
+                data = {
+                    "phone_number": "+79000000000",
+                    "confirmation_code": f"{number % 10000:04d}",
+                }
+            else:
+                url = reverse("api:phone_auth")
+                data = {"phone_number": "+79000000000"}
+            status = client.post(url, data).status_code
+            statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.perf_counter() - started
+    return elapsed, len(context.captured_queries), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+    setup()
+
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+
+    from api.views import CodeVerificationView, PhoneAuthView
+
+    views = (PhoneAuthView, CodeVerificationView)
+    throttles = {view: view.throttle_classes for view in views}
+    with test_database(), mock.patch(
+        "api.utils.get_delivery_pipeline"
+    ) as pipeline:
+        for title, enabled in (
+            ("Без ограничений", False),
+            ("С ограничениями", True),
+        ):
+            caches["throttle"].clear()
+            pipeline.reset_mock()
+            for view in views:
+                view.throttle_classes = throttles[view] if enabled else []
+            elapsed, queries, statuses = attack(APIClient(), args.requests)
+            print(
+                f"{title}: {args.requests} запросов за {elapsed:.2f} с, "
+                f"запросов к базе: {queries}, отправлено кодов: "
+                f"{pipeline.return_value.enqueue.call_count}, "
+                f"ответы: {statuses}"
+            )
+
+
+if __name__ == "__main__":
+    main()
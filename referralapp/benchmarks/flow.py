@@ -0,0 +1,398 @@
+"""
+Нагрузочный тест сценариев авторизации и рефералов.
+
+Заполняет базу `--users` пользователями с цепочками приглашений длиной
+`--chain-length`, затем `--clients` новых пользователей проходят
+сценарий: запрос кода, верификация, активация инвайт-кода, профиль,
+а также запросы чтения ко всем эндпоинтам /users/. Для каждого
+эндпоинта выводятся p50/p95/p99 времени ответа, количество SQL запросов
+на запрос и общая пропускная способность.
+
+Режим `client` выполняет запросы через тестовый клиент Django в одном
+потоке, режим `live` - через HTTP к локальному серверу из
+`--concurrency` потоков.
+
+    python -m benchmarks.flow --baseline benchmarks/baselines/flow.json
+    python -m benchmarks.flow --mode live --concurrency 16
+
+При сравнении с базовыми результатами регрессией считается рост
+количества SQL запросов или рост p95 больше чем на `--tolerance`;
+при регрессии бенчмарк завершается с кодом 1. Базовые результаты
+обновляются с `--save-baseline` после намеренных изменений.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+METRICS_MIDDLEWARE = "api.instrumentation.RequestMetricsMiddleware"
+# значения, сохраняемые для каждого эндпоинта
+PERCENTILES = (50, 95, 99)
+
+
+class CapturingSender:
+    """
+    Отправитель, сохраняющий коды верификации для клиентов теста.
+
+    Реализует интерфейс `api.delivery.BaseSender`.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.condition = threading.Condition()
+
+    def send_many(self, messages: list) -> None:
+        with self.condition:
+            for message in messages:
+                code = message.text.rsplit(" ", 1)[-1]
+                self.codes[message.phone_number] = code
+            self.condition.notify_all()
+
+    def wait(self, phone_number: str, timeout: float = 10) -> str:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: phone_number in self.codes, timeout
+            )
+            return self.codes.pop(phone_number)
+
+
+def seed(users: int, chain_length: int) -> list:
+    """
+    Пользователи, разбитые на цепочки приглашений.
+
+    Каждый пользователь, кроме первого в цепочке, активировал инвайт-код
+    предыдущего. Счетчики, дерево приглашений и таблица лидеров
+    обновляются так же, как при импорте.
+    """
+    from django.contrib.auth import get_user_model
+    from django.db import transaction
+
+    from users.models import Referral
+    from users.referrals import bulk_create_referrals
+
+    User = get_user_model()
+    with transaction.atomic():
+        created = User.objects.bulk_create_users(
+            User(phone_number=f"+7901{number:07d}") for number in range(users)
+        )
+        bulk_create_referrals(
+            Referral(
+                inviter=created[number - 1],
+                invitee=created[number],
+                activated_invite_code=created[number - 1].invite_code.code,
+            )
+            for number in range(users)
+            if number % chain_length
+        )
+    return created
+
+
+class TestClientTransport:
+    """Запросы через тестовый клиент Django."""
+
+    def __init__(self):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {}
+        if token:
+            headers["HTTP_AUTHORIZATION"] = f"Token {token}"
+        response = getattr(self.client, method.lower())(
+            path, data, format="json", **headers
+        )
+        return response.status_code, response.content
+
+
+class HttpTransport:
+    """Запросы по HTTP к локальному серверу."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Token {token}"
+        body = None
+        if data is not None and method != "GET":
+            body = json.dumps(data).encode()
+        elif data:
+            path = f"{path}?{urllib.parse.urlencode(data)}"
+        request = urllib.request.Request(
+            self.base_url + path, data=body, headers=headers, method=method
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+
+class Recorder:
+    """Время ответов по эндпоинтам."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, transport, method, path, data=None, token=None):
+        from django.urls import resolve
+
+        label = f"{method} {resolve(path).view_name}"
+        started = time.perf_counter()
+        status, content = transport.request(method, path, data, token)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[label].append(elapsed)
+            if status >= 400:
+                self.errors[(label, status)] += 1
+        return status, content
+
+
+def run_client(transport, recorder, sender, number, seeded) -> None:
+    """Сценарий одного нового пользователя."""
+    from django.urls import reverse
+
+    phone_number = f"+7902{number:07d}"
+    call = recorder.call
+    call(
+        transport,
+        "POST",
+        reverse("api:phone_auth"),
+        {"phone_number": phone_number},
+    )
+    code = sender.wait(phone_number)
+    _, content = call(
+        transport,
+        "POST",
+        reverse("api:code_verify"),
+        {"phone_number": phone_number, "confirmation_code": code},
+    )
+    token = json.loads(content)["token"]
+    inviter = random.choice(seeded)
+    call(
+        transport,
+        "POST",
+        reverse("api:users-activate-invite-code"),
+        {"invite_code": inviter.invite_code.code},
+        token,
+    )
+    call(transport, "GET", reverse("api:users-me"), token=token)
+
+    user = random.choice(seeded)
+    reads = (
+        (reverse("api:users-list"), None),
+        (reverse("api:users-detail", args=(user.id,)), None),
+        (reverse("api:users-invited", args=(inviter.id,)), None),
+        (reverse("api:users-downline", args=(seeded[0].id,)), None),
+        (reverse("api:users-upline", args=(user.id,)), None),
+        (reverse("api:users-descendants", args=(seeded[0].id,)), None),
+        (reverse("api:users-leaderboard"), {"period": "all"}),
+    )
+    for path, params in reads:
+        call(transport, "GET", path, params, token)
+
+
+def percentile(values: list, percent: int) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(recorder, elapsed: float) -> dict:
+    """Итоги: перцентили в миллисекундах и SQL запросы на запрос."""
+    from api.instrumentation import registry
+
+    queries = {}
+    for line in registry.render().splitlines():
+        for name in ("requests_total", "db_queries_total"):
+            prefix = f"referralapp_{name}{{"
+            if line.startswith(prefix):
+                labels, value = line[len(prefix) :].split("} ")
+                view, method = (
+                    part.split("=", 1)[1].strip('"')
+                    for part in labels.split('",')
+                )
+                key = f"{method} {view}"
+                queries.setdefault(key, {})[name] = float(value)
+    endpoints = {}
+    total = 0
+    for label, values in sorted(recorder.latencies.items()):
+        total += len(values)
+        counts = queries.get(label, {})
+        endpoints[label] = {
+            "requests": len(values),
+            **{
+                f"p{percent}": round(percentile(values, percent) * 1000, 2)
+                for percent in PERCENTILES
+            },
+            "queries": round(
+                counts.get("db_queries_total", 0)
+                / max(counts.get("requests_total", 1), 1),
+                2,
+            ),
+        }
+    return {
+        "requests": total,
+        "throughput": round(total / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Эндпоинты, результаты которых хуже базовых."""
+    regressions = []
+    for label, current in result["endpoints"].items():
+        expected = baseline["endpoints"].get(label)
+        if expected is None:
+            continue
+        if current["queries"] > expected["queries"]:
+            regressions.append(
+                f"{label}: SQL запросов {current['queries']} "
+                f"вместо {expected['queries']}"
+            )
+        if current["p95"] > expected["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{label}: p95 {current['p95']} мс "
+                f"вместо {expected['p95']} мс"
+            )
+    return regressions
+
+
+def report(result: dict) -> None:
+    print(
+        f"{'Эндпоинт':<44} {'запросов':>8} {'p50':>8} {'p95':>8} "
+        f"{'p99':>8} {'SQL':>6}"
+    )
+    for label, values in result["endpoints"].items():
+        print(
+            f"{label:<44} {values['requests']:>8} {values['p50']:>8} "
+            f"{values['p95']:>8} {values['p99']:>8} {values['queries']:>6}"
+        )
+    print(
+        f"Всего запросов: {result['requests']}, "
+        f"{result['throughput']} запросов/с"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--mode", choices=("client", "live"), default="client")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chain-length", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--baseline", help="Файл с базовыми результатами.")
+    parser.add_argument(
+        "--save-baseline", help="Сохранить результаты как базовые."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    setup()
+
+    from django.conf import settings
+    from django.test.testcases import LiveServerThread, _StaticFilesHandler
+    from django.test.utils import override_settings
+
+    from api.delivery import DeliveryPipeline
+    from api.instrumentation import registry
+    from api.views import CodeVerificationView, PhoneAuthView
+
+    sender = CapturingSender()
+    pipeline = DeliveryPipeline(sender, batch_timeout=0.001)
+    middleware = [METRICS_MIDDLEWARE] + [
+        item for item in settings.MIDDLEWARE if item != METRICS_MIDDLEWARE
+    ]
+    # несколько потоков сервера работают с одной базой SQLite только
+    # через файл, база в памяти доступна одному соединению. Транзакции
+    # сразу берут блокировку записи и ждут ее вместо ошибки
+    # "database is locked"
+    database = None
+    default = settings.DATABASES["default"]
+    if args.mode == "live" and default["ENGINE"].endswith("sqlite3"):
+        database = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+        default.setdefault("OPTIONS", {}).update(
+            timeout=30, transaction_mode="IMMEDIATE"
+        )
+
+    with ExitStack() as stack:
+        stack.enter_context(test_database(database))
+        stack.enter_context(override_settings(MIDDLEWARE=middleware))
+        # нагрузка идет с одного адреса, ограничения частоты отключаются
+        for view in (PhoneAuthView, CodeVerificationView):
+            stack.enter_context(
+                mock.patch.object(view, "throttle_classes", [])
+            )
+        stack.enter_context(
+            mock.patch(
+                "api.utils.get_delivery_pipeline", return_value=pipeline
+            )
+        )
+        seeded = seed(args.users, args.chain_length)
+        registry.clear()
+        recorder = Recorder()
+
+        if args.mode == "client":
+            transport = TestClientTransport()
+            started = time.perf_counter()
+            for number in range(args.clients):
+                run_client(transport, recorder, sender, number, seeded)
+        else:
+            server = LiveServerThread("localhost", _StaticFilesHandler)
+            server.daemon = True
+            server.start()
+            server.is_ready.wait()
+            if server.error:
+                raise server.error
+            transport = HttpTransport(f"http://localhost:{server.port}")
+            started = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                for future in [
+                    executor.submit(
+                        run_client, transport, recorder, sender, number, seeded
+                    )
+                    for number in range(args.clients)
+                ]:
+                    future.result()
+            server.terminate()
+        result = summarize(recorder, time.perf_counter() - started)
+
+    result["mode"] = args.mode
+    report(result)
+    for (label, status), count in sorted(recorder.errors.items()):
+        print(f"Ошибки {label}: {count} ответов {status}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
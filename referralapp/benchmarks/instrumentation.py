@@ -0,0 +1,59 @@
+"""
+Накладные расходы сбора показателей запросов.
+
+Сравнивает время обработки запросов к списку пользователей и профилю
+с включенной и выключенной RequestMetricsMiddleware.
+
+    python -m benchmarks.instrumentation --requests 2000
+"""
+
+import argparse
+
+from benchmarks import setup, test_database, timer
+
+MIDDLEWARE = "api.instrumentation.RequestMetricsMiddleware"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+    setup()
+
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.test.utils import override_settings
+    from django.urls import reverse
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    User = get_user_model()
+    middleware = [item for item in settings.MIDDLEWARE if item != MIDDLEWARE]
+
+    with test_database():
+        users = User.objects.bulk_create_users(
+            User(phone_number=f"+7900{number:07d}")
+            for number in range(args.users)
+        )
+        token = Token.objects.create(user=users[0])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        urls = [reverse("api:users-list"), reverse("api:users-me")]
+        for title, enabled in (
+            ("без показателей", False),
+            ("с показателями", True),
+        ):
+            with override_settings(
+                MIDDLEWARE=[MIDDLEWARE, *middleware] if enabled else middleware
+            ):
+                # прогрев: кеш аутентификации и скомпилированные запросы
+                for url in urls:
+                    client.get(url)
+                with timer(f"Запросы {title}", args.requests):
+                    for number in range(args.requests):
+                        client.get(urls[number % len(urls)])
+
+
+if __name__ == "__main__":
+    main()
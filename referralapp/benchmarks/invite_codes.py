@@ -0,0 +1,40 @@
+"""
+Бенчмарк выделения инвайт-кодов.
+
+    python -m benchmarks.invite_codes --count 1000000
+"""
+
+import argparse
+
+from benchmarks import setup, test_database, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--block-size", type=int, default=500)
+    args = parser.parse_args()
+    setup()
+
+    from users.allocator import InviteCodeAllocator
+
+    allocator = InviteCodeAllocator(block_size=args.block_size)
+    with timer("Перестановка без базы данных", args.count):
+        codes = {
+            allocator.permutation.encode(value) for value in range(args.count)
+        }
+    assert len(codes) == args.count, "Найдены совпадающие коды"
+
+    with test_database():
+        with timer("Выделение одним блоком", args.count):
+            codes = allocator.allocate_many(args.count)
+        assert len(set(codes)) == args.count, "Найдены совпадающие коды"
+
+        count = args.count // 10
+        with timer("Выделение по одному коду", count):
+            codes = [allocator.allocate() for _ in range(count)]
+        assert len(set(codes)) == count, "Найдены совпадающие коды"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Бенчмарк таблицы лидеров.
+
+Заполняет базу `--referrals` рефералами за последние `--days` дней
+со степенным распределением пригласивших и сравнивает запросы топа
+и места пользователя по таблице лидеров с группировкой рефералов.
+
+    python -m benchmarks.leaderboard --referrals 10000000
+"""
+
+import argparse
+import random
+from datetime import datetime, time, timedelta
+from io import StringIO
+
+from benchmarks import setup, test_database, timer
+
+# количество строк в одном INSERT при заполнении базы
+BATCH_SIZE = 10000
+
+
+def insert_rows(connection, model, columns: tuple, rows) -> None:
+    """Вставка строк пакетами без создания объектов моделей."""
+    quote = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {quote(model._meta.db_table)} "
+        f"({', '.join(quote(column) for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    with connection.cursor() as cursor:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        cursor.executemany(sql, batch)
+
+
+def fill(connection, inviters: int, referrals: int, days: int) -> list:
+    """
+    Заполнение базы пользователями и рефералами.
+
+    Пригласившие - первые `inviters` пользователей, у пользователей
+    с меньшим номером больше приглашенных. Каждый следующий пользователь
+    активирует один инвайт-код.
+    """
+    from django.contrib.auth import get_user_model
+    from django.db import transaction
+    from django.utils import timezone
+
+    from users.models import Referral
+
+    User = get_user_model()
+    # значения всех полей, кроме номера телефона, одинаковы у всех
+    # пользователей и берутся из одного объекта
+    template = User()
+    fields = [
+        field
+        for field in User._meta.local_concrete_fields
+        if field.name not in ("id", "phone_number")
+    ]
+    values = tuple(
+        field.get_db_prep_save(field.pre_save(template, True), connection)
+        for field in fields
+    )
+    now = timezone.now()
+    adapt = connection.ops.adapt_datetimefield_value
+    with transaction.atomic():
+        insert_rows(
+            connection,
+            User,
+            ("phone_number", *(field.column for field in fields)),
+            (
+                (f"+7{number:010d}", *values)
+                for number in range(inviters + referrals)
+            ),
+        )
+        ids = list(User.objects.order_by("id").values_list("id", flat=True))
+        insert_rows(
+            connection,
+            Referral,
+            (
+                "inviter_id",
+                "invitee_id",
+                "activated_invite_code",
+                "created_at",
+            ),
+            (
+                (
+                    ids[int(inviters * random.random() ** 4)],
+                    invitee,
+                    "",
+                    adapt(
+                        now - timedelta(seconds=random.random() * days * 86400)
+                    ),
+                )
+                for invitee in ids[inviters:]
+            ),
+        )
+    return ids[:inviters]
+
+
+def period_start(period: str):
+    from django.utils import timezone
+
+    from users.leaderboard import period_bucket
+
+    if period == "all":
+        return None
+    return timezone.make_aware(
+        datetime.combine(period_bucket(period), time.min)
+    )
+
+
+def grouped(period: str):
+    """Количество приглашенных группировкой рефералов за период."""
+    from django.db.models import Count
+
+    from users.models import Referral
+
+    referrals = Referral.objects.filter(inviter__isnull=False)
+    start = period_start(period)
+    if start is not None:
+        referrals = referrals.filter(created_at__gte=start)
+    return referrals.values("inviter_id").annotate(invited_count=Count("id"))
+
+
+def grouped_rank(period: str, user_id) -> int:
+    counts = grouped(period)
+    mine = counts.filter(inviter_id=user_id).values("invited_count")[:1]
+    return counts.filter(invited_count__gt=mine).count() + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--referrals", type=int, default=10_000_000)
+    parser.add_argument("--inviters", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.utils import timezone
+
+    from users import leaderboard
+    from users.leaderboard import PERIODS, record_referrals
+
+    with test_database() as connection:
+        with timer("Заполнение рефералов", args.referrals):
+            inviters = fill(
+                connection, args.inviters, args.referrals, args.days
+            )
+        with timer("Пересчет таблицы лидеров", args.referrals):
+            call_command("rebuild_leaderboard", stdout=StringIO())
+
+        User = get_user_model()
+        users = [
+            User(id=user_id)
+            for user_id in random.sample(inviters, args.samples)
+        ]
+        for period in PERIODS:
+            with timer(f"Топ {period}, группировка", args.samples):
+                for _ in range(args.samples):
+                    expected = list(
+                        grouped(period)
+                        .order_by("-invited_count", "inviter_id")
+                        .values_list("inviter_id", "invited_count")[
+                            : args.limit
+                        ]
+                    )
+            with timer(f"Топ {period}, таблица лидеров", args.samples):
+                for _ in range(args.samples):
+                    result = [
+                        (entry.user_id, entry.invited_count)
+                        for entry in leaderboard.top(period, args.limit)
+                    ]
+            assert result == expected, "Результаты запросов различаются"
+
+            with timer(f"Место {period}, группировка", args.samples):
+                expected = [grouped_rank(period, user.id) for user in users]
+            with timer(f"Место {period}, таблица лидеров", args.samples):
+                result = [
+                    getattr(leaderboard.rank(period, user), "rank", None)
+                    for user in users
+                ]
+            # пользователь без приглашенных за период не имеет места
+            assert all(
+                rank is None or rank == expected_rank
+                for rank, expected_rank in zip(result, expected)
+            ), "Результаты запросов различаются"
+
+        count = 1000
+        with timer("Учет одной активации", count):
+            for _ in range(count):
+                record_referrals([(random.choice(inviters), timezone.now())])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Бенчмарк запросов к дереву приглашений.
+
+Строит случайное дерево из `--nodes` пользователей и сравнивает запросы
+по таблице замыкания с рекурсивными CTE по таблице рефералов:
+количество приглашенных по уровням, цепочку пригласивших и первую
+страницу дерева приглашенных.
+
+    python -m benchmarks.referral_tree --nodes 1000000
+"""
+
+import argparse
+import random
+
+from benchmarks import setup, test_database, timer
+
+# количество строк в одном INSERT при заполнении базы
+BATCH_SIZE = 10000
+PAGE_SIZE = 50
+
+DOWNLINE_CTE = """
+    WITH RECURSIVE tree(id, depth) AS (
+        SELECT invitee_id, 1 FROM {referral} WHERE inviter_id = %s
+        UNION ALL
+        SELECT r.invitee_id, t.depth + 1
+        FROM {referral} r JOIN tree t ON r.inviter_id = t.id
+    )
+    SELECT depth, COUNT(*) FROM tree GROUP BY depth ORDER BY depth
+"""
+UPLINE_CTE = """
+    WITH RECURSIVE chain(id, depth) AS (
+        SELECT inviter_id, 1 FROM {referral}
+        WHERE invitee_id = %s AND inviter_id IS NOT NULL
+        UNION ALL
+        SELECT r.inviter_id, c.depth + 1
+        FROM {referral} r JOIN chain c ON r.invitee_id = c.id
+        WHERE r.inviter_id IS NOT NULL
+    )
+    SELECT c.id, u.phone_number, c.depth
+    FROM chain c JOIN {user} u ON u.id = c.id ORDER BY c.depth
+"""
+DESCENDANTS_CTE = """
+    WITH RECURSIVE tree(id, depth) AS (
+        SELECT invitee_id, 1 FROM {referral} WHERE inviter_id = %s
+        UNION ALL
+        SELECT r.invitee_id, t.depth + 1
+        FROM {referral} r JOIN tree t ON r.inviter_id = t.id
+    )
+    SELECT t.id, u.phone_number, t.depth
+    FROM tree t JOIN {user} u ON u.id = t.id ORDER BY t.id LIMIT %s
+"""
+
+
+def build_tree(nodes: int, roots: float) -> list:
+    """
+    Заполнение базы: пользователи, рефералы и таблица замыкания.
+
+    Пригласивший выбирается случайно среди уже созданных пользователей,
+    доля `roots` пользователей не активирует инвайт-код.
+    """
+    from django.contrib.auth import get_user_model
+    from django.db import connection, transaction
+
+    from users.models import Referral, ReferralPath
+
+    User = get_user_model()
+    parents = [None]
+    for number in range(1, nodes):
+        parent = None
+        if random.random() >= roots:
+            parent = random.randrange(number)
+        parents.append(parent)
+
+    with transaction.atomic():
+        users = User.objects.bulk_create_users(
+            (User(phone_number=f"+7{number:010d}") for number in range(nodes)),
+            batch_size=BATCH_SIZE,
+        )
+        ids = [user.id for user in users]
+        codes = [user.invite_code.code for user in users]
+        Referral.objects.bulk_create(
+            (
+                Referral(
+                    inviter_id=ids[parent],
+                    invitee_id=ids[number],
+                    activated_invite_code=codes[parent],
+                )
+                for number, parent in enumerate(parents)
+                if parent is not None
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        # строк таблицы замыкания в десятки раз больше, чем пользователей,
+        # поэтому они вставляются без создания объектов моделей
+        insert = (
+            f"INSERT INTO {ReferralPath._meta.db_table} "
+            "(ancestor_id, descendant_id, depth) VALUES (%s, %s, %s)"
+        )
+        with connection.cursor() as cursor:
+            paths = []
+            for number, parent in enumerate(parents):
+                depth = 1
+                while parent is not None:
+                    paths.append((ids[parent], ids[number], depth))
+                    parent, depth = parents[parent], depth + 1
+                if len(paths) >= BATCH_SIZE:
+                    cursor.executemany(insert, paths)
+                    paths = []
+            cursor.executemany(insert, paths)
+    return ids
+
+
+def fetch(cursor, sql: str, params) -> list:
+    cursor.execute(sql, params)
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def compare(title: str, cursor, closure, cte: str, params: list) -> None:
+    """
+    Замер запросов по таблице замыкания и рекурсивного CTE.
+
+    `closure` - функция, возвращающая queryset для вершины. Оба запроса
+    выполняются напрямую через курсор, чтобы время не включало
+    создание объектов ORM.
+    """
+    queries = [closure(*values).query.sql_with_params() for values in params]
+    with timer(f"{title}, таблица замыкания", len(params)):
+        expected = [fetch(cursor, sql, values) for sql, values in queries]
+    with timer(f"{title}, рекурсивный CTE", len(params)):
+        result = [fetch(cursor, cte, values) for values in params]
+    assert expected == result, "Результаты запросов различаются"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument(
+        "--roots",
+        type=float,
+        default=0.01,
+        help="Доля пользователей без пригласившего.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count
+
+    from users.models import Referral, ReferralPath
+
+    User = get_user_model()
+    tables = {
+        "referral": Referral._meta.db_table,
+        "user": User._meta.db_table,
+    }
+
+    with test_database() as connection:
+        with timer("Построение дерева", args.nodes):
+            ids = build_tree(args.nodes, args.roots)
+        print(f"Строк в таблице замыкания: {ReferralPath.objects.count()}")
+        # вершины верхних уровней имеют самые большие поддеревья
+        top = ids[: args.samples]
+        bottom = random.sample(ids, args.samples)
+
+        with connection.cursor() as cursor:
+            compare(
+                "Уровни",
+                cursor,
+                lambda user_id: ReferralPath.objects.filter(
+                    ancestor_id=user_id
+                )
+                .values_list("depth")
+                .annotate(count=Count("id"))
+                .order_by("depth"),
+                DOWNLINE_CTE.format(**tables),
+                [[user_id] for user_id in top],
+            )
+            compare(
+                "Цепочка",
+                cursor,
+                lambda user_id: ReferralPath.objects.filter(
+                    descendant_id=user_id
+                )
+                .order_by("depth")
+                .values_list("ancestor_id", "ancestor__phone_number", "depth"),
+                UPLINE_CTE.format(**tables),
+                [[user_id] for user_id in bottom],
+            )
+            compare(
+                "Страница дерева",
+                cursor,
+                lambda user_id, limit: ReferralPath.objects.filter(
+                    ancestor_id=user_id
+                )
+                .order_by("id")
+                .values_list(
+                    "descendant_id", "descendant__phone_number", "depth"
+                )[:limit],
+                DESCENDANTS_CTE.format(**tables),
+                [[user_id, PAGE_SIZE] for user_id in top],
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Бенчмарк сериализации списка пользователей.
+
+Сравнивает UserSerializer на объектах моделей с быстрым путем через
+values() на страницах из `--sizes` пользователей: загрузка страницы,
+сериализация и рендеринг JSON. Ответы обоих путей должны совпадать
+побайтно.
+
+    python -m benchmarks.user_serializer --sizes 1000 10000
+"""
+
+import argparse
+import random
+
+from benchmarks import setup, test_database, timer
+
+
+def fill(users: int) -> None:
+    """Пользователи, часть которых активировала инвайт-коды."""
+    from django.contrib.auth import get_user_model
+    from django.db import transaction
+
+    from users.models import Referral
+
+    User = get_user_model()
+    with transaction.atomic():
+        created = User.objects.bulk_create_users(
+            (
+                User(phone_number=f"+7900{number:07d}")
+                for number in range(users)
+            ),
+            batch_size=5000,
+        )
+        Referral.objects.bulk_create(
+            (
+                Referral(
+                    inviter=inviter,
+                    invitee=invitee,
+                    activated_invite_code=inviter.invite_code.code,
+                )
+                for invitee, inviter in zip(
+                    created[1:],
+                    (
+                        created[random.randrange(number)]
+                        for number in range(1, users)
+                    ),
+                )
+            ),
+            batch_size=5000,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    setup()
+
+    from rest_framework.renderers import JSONRenderer
+
+    from api.serializers import UserSerializer
+    from api.views import INVITED_PREVIEW_SIZE, UserViewSet
+
+    renderer = JSONRenderer()
+    with test_database():
+        fill(max(args.sizes))
+        queryset = UserViewSet.queryset.order_by("id")
+        for size in args.sizes:
+            count = size * args.repeat
+            with timer(f"UserSerializer, {size} на странице", count):
+                for _ in range(args.repeat):
+                    expected = renderer.render(
+                        UserSerializer(queryset[:size], many=True).data
+                    )
+            with timer(f"values(), {size} на странице", count):
+                for _ in range(args.repeat):
+                    result = renderer.render(
+                        UserSerializer.from_values(
+                            UserSerializer.values(queryset)[:size],
+                            INVITED_PREVIEW_SIZE,
+                        )
+                    )
+            assert result == expected, "Ответы различаются"
+
+
+if __name__ == "__main__":
+    main()
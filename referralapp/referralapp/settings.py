@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -61,6 +62,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "referralapp.wsgi.application"
 
+# тесты работают с кешами в памяти, а не с общим кешем приложения
+TEST_RUNNER = "referralapp.test_runner.TestRunner"
+
 
 # Database
 # Если переменная окружения равно postgres,
@@ -84,9 +88,34 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # тестовая база в файле, а не в памяти: тесты параллельных
+            # запросов открывают несколько подключений к одной базе
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
         }
     }
 
+# Реплики только для чтения: адреса серверов PostgreSQL или файлы SQLite
+# через пробел. Чтение распределяется по репликам, запись выполняется
+# в основной базе. Клиент, записавший в основную базу, читает с нее
+# REPLICA_STICKY_SECONDS секунд, пока реплики догоняют основную базу.
+for number, location in enumerate(os.getenv("DB_REPLICAS", "").split()):
+    replica = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+    if os.getenv("DATABASE") == "postgres":
+        replica["HOST"] = location
+    else:
+        replica["NAME"] = location
+    DATABASES[f"replica_{number}"] = replica
+
+DATABASE_REPLICATION = {
+    "REPLICAS": [alias for alias in DATABASES if alias != "default"],
+    # время чтения с основной базы после записи, в секундах
+    "STICKY_SECONDS": int(os.getenv("REPLICA_STICKY_SECONDS", 10)),
+    "CACHE": "default",  # кеш из CACHES, общий для всех процессов
+}
+if DATABASE_REPLICATION["REPLICAS"]:
+    DATABASE_ROUTERS = ["api.replication.ReplicaRouter"]
+    MIDDLEWARE.insert(0, "api.replication.PrimaryStickinessMiddleware")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -133,19 +162,176 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.User"
 
+# Кеши приложения. "default" общий для всех процессов: профили с их
+# версиями, по которым проверяется и кеш аутентификации, и закрепление
+# клиентов за основной базой. "throttle" хранит историю запросов для
+# ограничения частоты отдельно, чтобы другие записи не вытесняли ее.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        },
+        "throttle": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+            "KEY_PREFIX": "throttle",
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv(
+                "CACHE_LOCATION",
+                os.path.join(tempfile.gettempdir(), "referralapp_cache"),
+            ),
+            "OPTIONS": {
+                # файловый кеш просматривает каталог при каждой записи,
+                # поэтому число записей ограничено небольшим. При
+                # переполнении удаляется треть записей, потерянные записи
+                # только вызывают повторное чтение из базы. В продакшене
+                # используйте Redis
+                "MAX_ENTRIES": 300,
+                "CULL_FREQUENCY": 3,
+            },
+        },
+        # без Redis история запросов хранится в памяти процесса:
+        # проверка не обращается к диску, но ограничения действуют
+        # в каждом процессе отдельно. При вытеснении удаляется десятая
+        # часть записей, к которым дольше всего не обращались
+        "throttle": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "throttle",
+            "OPTIONS": {"MAX_ENTRIES": 100000, "CULL_FREQUENCY": 10},
+        },
+    }
+
+# Ключ перестановки для выделения инвайт-кодов.
+# После выдачи первых кодов менять не рекомендуется.
+INVITE_CODE_SECRET = os.getenv("INVITE_CODE_SECRET", SECRET_KEY)
+
 # Ключ кеша для кода верификации
 CACHE_KEY_OF_CONFIRM_CODE = "confirm_code"
 
+# Хранилище кодов верификации, общее для всех процессов приложения.
+# По умолчанию коды хранятся в таблице базы данных,
+# для Redis укажите api.code_stores.RedisCodeStore и REDIS_URL.
+VERIFICATION_CODE_STORE = {
+    "BACKEND": os.getenv(
+        "VERIFICATION_CODE_STORE", "api.code_stores.DatabaseCodeStore"
+    ),
+    "OPTIONS": {
+        "ttl": 300,  # время действия кода в секундах
+        "max_attempts": 5,  # количество попыток ввода кода
+    },
+}
+if os.getenv("REDIS_URL"):
+    VERIFICATION_CODE_STORE["OPTIONS"]["url"] = os.getenv("REDIS_URL")
+
+# Доставка кодов верификации.
+# По умолчанию отправка эмулируется записью в файл auth_codes/codes.log,
+# при указании SMS_GATEWAY_URL коды отправляются через СМС-шлюз.
+CODE_DELIVERY = {
+    "SENDER": "api.delivery.FileSender",
+    "SENDER_OPTIONS": {"path": BASE_DIR / "auth_codes" / "codes.log"},
+    "OPTIONS": {
+        "workers": 2,  # количество потоков отправки
+        "batch_size": 100,  # максимальный размер пакета сообщений
+        "max_retries": 3,  # количество повторных попыток отправки
+    },
+}
+if os.getenv("SMS_GATEWAY_URL"):
+    CODE_DELIVERY["SENDER"] = "api.delivery.SmsGatewaySender"
+    CODE_DELIVERY["SENDER_OPTIONS"] = {
+        "url": os.getenv("SMS_GATEWAY_URL"),
+        "token": os.getenv("SMS_GATEWAY_TOKEN", ""),
+    }
+
+# События для внешних потребителей (transactional outbox).
+# Команда relay_outbox публикует их в файл outbox/events.ndjson,
+# при указании OUTBOX_WEBHOOK_URL - POST запросами на этот адрес.
+OUTBOX = {
+    "SINK": "api.outbox.FileSink",
+    "SINK_OPTIONS": {"path": BASE_DIR / "outbox" / "events.ndjson"},
+    "BATCH_SIZE": 500,  # количество событий в одном пакете
+    "POLL_INTERVAL": 1,  # пауза при пустой очереди в секундах
+    "RETRY_DELAY": 5,  # пауза после ошибки публикации в секундах
+    "RETENTION_DAYS": 7,  # срок хранения опубликованных событий
+    # возраст события в секундах, после которого оно публикуется:
+    # больше времени от записи события до фиксации его транзакции
+    "VISIBILITY_DELAY": 5,
+    # срок занятия пакета в секундах, больше времени его доставки
+    "CLAIM_TIMEOUT": 60,
+}
+if os.getenv("OUTBOX_WEBHOOK_URL"):
+    OUTBOX["SINK"] = "api.outbox.WebhookSink"
+    OUTBOX["SINK_OPTIONS"] = {
+        "url": os.getenv("OUTBOX_WEBHOOK_URL"),
+        "token": os.getenv("OUTBOX_WEBHOOK_TOKEN", ""),
+    }
+
+# Асинхронные представления авторизации (/auth/phone/ и /auth/verify/).
+# Включаются при запуске под ASGI сервером: referralapp/asgi.py
+# устанавливает ASYNC_AUTH_VIEWS, если переменная не задана явно.
+# Под WSGI асинхронные представления выполнялись бы в новом цикле
+# событий на каждый запрос.
+ASYNC_AUTH_VIEWS = os.getenv("ASYNC_AUTH_VIEWS", "") not in ("", "0")
+
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticatedOrReadOnly",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # количество прокси перед приложением: адрес клиента для ограничений
+    # по IP берется из X-Forwarded-For только с учетом этих прокси,
+    # при 0 - из REMOTE_ADDR. Без значения DRF доверяет заголовку
+    # клиента, и ограничение по IP обходится его подменой.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", 0)),
+    # ограничения для эндпоинтов авторизации: по номеру телефона и IP
+    "DEFAULT_THROTTLE_RATES": {
+        "phone_auth_phone": "3/min",
+        "phone_auth_ip": "20/min",
+        "code_verify_phone": "10/min",
+        "code_verify_ip": "30/min",
+    },
 }
 
+# Кеш пользователей для аутентификации по токену в памяти процесса.
+# Записи проверяются по версиям профилей в общем кеше PROFILE_CACHE,
+# поэтому изменения в других процессах видны сразу.
+TOKEN_AUTH_CACHE = {
+    "MAX_SIZE": 10000,  # количество токенов в кеше
+    "TTL": 30,  # время жизни записи в секундах
+}
+
+# Кеш профилей пользователей (/users/{id}/ и /users/me/) в общем кеше.
+# Записи заменяются при изменении пользователя, инвайт-кода и рефералов.
+PROFILE_CACHE = {
+    "ALIAS": "default",  # кеш из CACHES
+    "TIMEOUT": 300,  # время жизни записи в секундах
+}
+
+# Показатели запросов: количество и время SQL запросов, повторные
+# запросы, время сериализации и размер ответа. Включаются переменной
+# окружения REQUEST_METRICS и отдаются по адресу /metrics/ персоналу
+# или по токену METRICS_TOKEN в заголовке Authorization: Bearer.
+# Доступ по адресу клиента не дается: за обратным прокси все запросы
+# приходят с его адреса.
+REQUEST_METRICS = {
+    "ENABLED": bool(os.getenv("REQUEST_METRICS", False)),
+    # количество выполнений одного запроса, считающееся проблемой N+1
+    "DUPLICATE_QUERY_THRESHOLD": 3,
+    "SERVER_TIMING": True,  # заголовок Server-Timing в ответах
+    # общий токен для сборщика показателей, пустой отключает доступ
+    "TOKEN": os.getenv("METRICS_TOKEN", ""),
+}
+if REQUEST_METRICS["ENABLED"]:
+    MIDDLEWARE.insert(0, "api.instrumentation.RequestMetricsMiddleware")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "ReferralProject",  # название проекта
     "VERSION": "0.0.1",  # версия проекта
@@ -155,3 +341,10 @@ SPECTACULAR_SETTINGS = {
     },
     "COMPONENT_SPLIT_REQUEST": True,
 }
+
+# Схема OpenAPI, сгенерированная командой build_schema при сборке.
+# /schema/ отдает файл из каталога, схема генерируется заново,
+# только если изменился код или настройки, от которых она зависит.
+OPENAPI_SCHEMA = {
+    "DIR": os.getenv("OPENAPI_SCHEMA_DIR", BASE_DIR / "openapi"),
+}
@@ -1,11 +1,8 @@
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import TemplateView
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularRedocView,
-    SpectacularSwaggerView,
-)
+
+from api.views import MetricsView, RedocView, SchemaView, SwaggerView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -15,16 +12,12 @@ urlpatterns = [
         TemplateView.as_view(template_name="redoc.html"),
         name="api-docs",
     ),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
 
 urlpatterns += [
-    path("schema/", SpectacularAPIView.as_view(), name="schema"),
-    path(
-        "swagger/",
-        SpectacularSwaggerView.as_view(url_name="schema"),
-        name="swagger-ui",
-    ),
-    path(
-        "redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"
-    ),
+    path("schema/", SchemaView.as_view(), name="schema"),
+    path("schema/<str:version>/", SchemaView.as_view(), name="schema-version"),
+    path("swagger/", SwaggerView.as_view(), name="swagger-ui"),
+    path("redoc/", RedocView.as_view(), name="redoc"),
 ]
@@ -0,0 +1,181 @@
+import hashlib
+import threading
+from collections import deque
+from string import ascii_lowercase, ascii_uppercase, digits
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+# алфавит инвайт-кода: 62 символа
+ALPHABET = digits + ascii_uppercase + ascii_lowercase
+CODE_LENGTH = 6
+# половина кода (3 символа) и все пространство кодов 62^6
+HALF_SIZE = len(ALPHABET) ** (CODE_LENGTH // 2)
+DOMAIN_SIZE = HALF_SIZE * HALF_SIZE
+# первичный ключ единственной строки счетчика
+SEQUENCE_ID = 1
+# максимальное количество параметров в запросе проверки кодов
+CHECK_BATCH_SIZE = 500
+
+
+class InviteCodePermutation:
+    """
+    Ключевая перестановка чисел [0, 62^6) на основе сети Фейстеля.
+
+    Число делится на две половины из диапазона [0, 62^3), раунды
+    складывают половины по модулю с результатом keyed BLAKE2b, поэтому
+    преобразование взаимно однозначно и без ключа не предсказуемо.
+    """
+
+    def __init__(self, key: bytes, rounds: int = 4):
+        self.rounds = rounds
+        # состояние хеша с уже обработанным ключом копируется в каждом раунде
+        self._hash = hashlib.blake2b(key=key, digest_size=8)
+
+    def _round(self, number: int, value: int) -> int:
+        round_hash = self._hash.copy()
+        round_hash.update(value.to_bytes(3, "big") + bytes((number,)))
+        return int.from_bytes(round_hash.digest(), "big") % HALF_SIZE
+
+    def permute(self, value: int) -> int:
+        left, right = divmod(value, HALF_SIZE)
+        for number in range(self.rounds):
+            shifted = (left + self._round(number, right)) % HALF_SIZE
+            left, right = right, shifted
+        return left * HALF_SIZE + right
+
+    def restore(self, value: int) -> int:
+        left, right = divmod(value, HALF_SIZE)
+        for number in reversed(range(self.rounds)):
+            restored = (right - self._round(number, left)) % HALF_SIZE
+            left, right = restored, left
+        return left * HALF_SIZE + right
+
+    def encode(self, value: int) -> str:
+        """Преобразование порядкового номера в инвайт-код."""
+        if not 0 <= value < DOMAIN_SIZE:
+            raise ValueError("Пространство инвайт-кодов исчерпано.")
+        number = self.permute(value)
+        chars = []
+        for _ in range(CODE_LENGTH):
+            number, index = divmod(number, len(ALPHABET))
+            chars.append(ALPHABET[index])
+        return "".join(reversed(chars))
+
+    def decode(self, code: str) -> int:
+        """Получение порядкового номера по инвайт-коду."""
+        number = 0
+        for char in code:
+            number = number * len(ALPHABET) + ALPHABET.index(char)
+        return self.restore(number)
+
+
+class _Block:
+    """Зарезервированный в базе диапазон инвайт-кодов."""
+
+    def __init__(self, codes):
+        self.codes = deque(codes)
+        self.confirmed = False
+
+    def confirm(self):
+        self.confirmed = True
+
+
+class InviteCodeAllocator:
+    """
+    Выделение уникальных инвайт-кодов.
+
+    Порядковые номера резервируются в базе блоками одним атомарным
+    UPDATE счетчика и преобразуются в коды ключевой перестановкой,
+    поэтому разные номера всегда дают разные коды. Коды, уже занятые
+    в таблице (например, сгенерированные случайно до появления
+    аллокатора), отбрасываются при резервировании блока.
+
+    Блок, зарезервированный внутри транзакции, используется только пока
+    она (или ее точка сохранения) не откатилась: после отката счетчик
+    возвращается к прежнему значению и номера блока будут выданы
+    другому процессу.
+    """
+
+    def __init__(self, block_size: int = CHECK_BATCH_SIZE):
+        self.block_size = block_size
+        self._local = threading.local()
+        self._permutation = None
+
+    @property
+    def permutation(self) -> InviteCodePermutation:
+        if self._permutation is None:
+            key = hashlib.blake2b(
+                settings.INVITE_CODE_SECRET.encode(),
+                digest_size=32,
+                person=b"invite-code",
+            ).digest()
+            self._permutation = InviteCodePermutation(key)
+        return self._permutation
+
+    def _reserve(self, size: int) -> list:
+        """Резервирование `size` порядковых номеров и проверка кодов."""
+        from users.models import InviteCode, InviteCodeSequence
+
+        with transaction.atomic():
+            InviteCodeSequence.objects.get_or_create(pk=SEQUENCE_ID)
+            InviteCodeSequence.objects.filter(pk=SEQUENCE_ID).update(
+                last_value=F("last_value") + size
+            )
+            stop = InviteCodeSequence.objects.values_list(
+                "last_value", flat=True
+            ).get(pk=SEQUENCE_ID)
+        encode = self.permutation.encode
+        codes = [encode(value) for value in range(stop - size, stop)]
+        taken = set()
+        for start in range(0, len(codes), CHECK_BATCH_SIZE):
+            taken.update(
+                InviteCode.objects.filter(
+                    code__in=codes[start : start + CHECK_BATCH_SIZE]
+                ).values_list("code", flat=True)
+            )
+        return [code for code in codes if code not in taken]
+
+    def _refill(self, size: int) -> _Block:
+        block = _Block(self._reserve(size))
+        transaction.on_commit(block.confirm)
+        self._local.block = block
+        return block
+
+    def _current_block(self):
+        block = getattr(self._local, "block", None)
+        if block is None or not block.codes:
+            return None
+        if block.confirmed:
+            return block
+        # при откате транзакции или точки сохранения Django отбрасывает
+        # зарегистрированные в них on_commit, поэтому блок используется,
+        # только пока его подтверждение ожидает фиксации
+        pending = transaction.get_connection().run_on_commit
+        if any(func == block.confirm for _, func, _ in pending):
+            return block
+        return None
+
+    def allocate(self) -> str:
+        """Выделение одного инвайт-кода."""
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list:
+        """Выделение `count` инвайт-кодов."""
+        codes = []
+        while len(codes) < count:
+            block = self._current_block() or self._refill(
+                max(self.block_size, count - len(codes))
+            )
+            while block.codes and len(codes) < count:
+                codes.append(block.codes.popleft())
+        return codes
+
+
+allocator = InviteCodeAllocator()
+
+
+def allocate_invite_code() -> str:
+    """Выделение уникального инвайт-кода."""
+    return allocator.allocate()
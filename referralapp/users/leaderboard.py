@@ -0,0 +1,130 @@
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db.models import Count, DateField, F, Q, Value
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+
+from users.models import LeaderboardEntry, Referral
+
+PERIODS = (LeaderboardEntry.DAY, LeaderboardEntry.WEEK, LeaderboardEntry.ALL)
+# начало периода для строк "за все время"
+ALL_TIME_BUCKET = date(1970, 1, 1)
+
+
+def period_bucket(period: str, moment=None) -> date:
+    """Начало периода, в который попадает момент времени."""
+    if period == LeaderboardEntry.ALL:
+        return ALL_TIME_BUCKET
+    day = timezone.localdate(moment)
+    if period == LeaderboardEntry.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def record_referrals(referrals) -> None:
+    """
+    Учет новых рефералов в таблице лидеров.
+
+    `referrals` - пары (inviter_id, created_at). Счетчики всех периодов
+    для всего пакета обновляются одним запросом.
+    """
+    counts = Counter()
+    for inviter_id, created_at in referrals:
+        if inviter_id is None:
+            continue
+        for period in PERIODS:
+            counts[
+                (period, period_bucket(period, created_at), inviter_id)
+            ] += 1
+    LeaderboardEntry.objects.increase(counts)
+
+
+def discard_referral(inviter_id, created_at) -> None:
+    """Уменьшение счетчиков при удалении реферала."""
+    buckets = Q()
+    for period in PERIODS:
+        buckets |= Q(period=period, bucket=period_bucket(period, created_at))
+    LeaderboardEntry.objects.filter(
+        buckets, user_id=inviter_id, invited_count__gt=0
+    ).update(invited_count=F("invited_count") - 1)
+
+
+def top(period: str, limit: int) -> list:
+    """
+    Пользователи с наибольшим количеством приглашенных за текущий период.
+
+    Каждой строке добавляется атрибут `rank`, одинаковый
+    для пользователей с равным количеством приглашенных.
+    """
+    entries = list(
+        LeaderboardEntry.objects.filter(
+            period=period,
+            bucket=period_bucket(period),
+            invited_count__gt=0,
+        )
+        .select_related("user")
+        .only("user__phone_number", "invited_count")
+        .order_by("-invited_count", "user_id")[:limit]
+    )
+    for position, entry in enumerate(entries, start=1):
+        previous = entries[position - 2] if position > 1 else None
+        if previous and previous.invited_count == entry.invited_count:
+            entry.rank = previous.rank
+        else:
+            entry.rank = position
+    return entries
+
+
+def rank(period: str, user):
+    """
+    Строка пользователя за текущий период с атрибутом `rank`.
+
+    Место равно количеству пользователей с большим числом приглашенных
+    плюс один и считается по индексу таблицы лидеров. Если за период
+    пользователь никого не пригласил, возвращается None.
+    """
+    bucket = period_bucket(period)
+    entry = (
+        LeaderboardEntry.objects.filter(
+            period=period, bucket=bucket, user=user, invited_count__gt=0
+        )
+        .only("invited_count")
+        .first()
+    )
+    if entry is None:
+        return None
+    entry.user = user
+    entry.rank = (
+        LeaderboardEntry.objects.filter(
+            period=period,
+            bucket=bucket,
+            invited_count__gt=entry.invited_count,
+        ).count()
+        + 1
+    )
+    return entry
+
+
+def aggregate_referrals(period: str):
+    """
+    Количество приглашенных по пользователям и началам периодов.
+
+    Возвращает кортежи (bucket, inviter_id, invited_count), посчитанные
+    группировкой всей таблицы рефералов. Используется только для
+    пересчета таблицы лидеров.
+    """
+    if period == LeaderboardEntry.ALL:
+        bucket = Value(ALL_TIME_BUCKET, output_field=DateField())
+    elif period == LeaderboardEntry.WEEK:
+        bucket = TruncWeek("created_at", output_field=DateField())
+    else:
+        bucket = TruncDate("created_at")
+    return (
+        Referral.objects.filter(inviter__isnull=False)
+        .annotate(bucket=bucket)
+        .order_by()
+        .values("bucket", "inviter_id")
+        .annotate(invited_count=Count("id"))
+        .values_list("bucket", "inviter_id", "invited_count")
+    )
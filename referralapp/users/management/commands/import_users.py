@@ -0,0 +1,175 @@
+import csv
+import json
+import os
+import time
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.models import InviteCode, Referral
+from users.referrals import bulk_create_referrals
+from users.signals import referrals_created
+from users.validators import validate_phone_number
+
+User = get_user_model()
+
+# поля пользователя, которые можно передать в файле
+USER_FIELDS = ("phone_number", "email", "first_name", "last_name")
+
+
+class Command(BaseCommand):
+    help = (
+        "Импорт пользователей из CSV или JSONL файла. Каждая строка "
+        "содержит поля phone_number, email, first_name, last_name и "
+        "необязательный invite_code пригласившего пользователя."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу импорта.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            help="Формат файла. По умолчанию определяется по расширению.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Количество строк, записываемых в одной транзакции.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help=(
+                "Файл с количеством обработанных строк для продолжения "
+                "импорта после сбоя. По умолчанию <path>.checkpoint."
+            ),
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Начать импорт сначала, игнорируя сохраненную позицию.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or os.path.splitext(path)[1][1:]
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Не удалось определить формат файла.")
+        batch_size = options["batch_size"]
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        position = 0
+        if not options["restart"]:
+            position = self.read_checkpoint(checkpoint)
+        if position:
+            self.stdout.write(f"Продолжение импорта с позиции {position}.")
+
+        stats = Counter()
+        started = time.perf_counter()
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = islice(self.read_rows(file, file_format), position, None)
+            while batch := list(islice(rows, batch_size)):
+                with transaction.atomic():
+                    self.import_batch(batch, position, stats)
+                position += len(batch)
+                stats["rows"] += len(batch)
+                self.write_checkpoint(checkpoint, position)
+                self.report(position, stats, started)
+        self.stdout.write(self.style.SUCCESS("Импорт завершен."))
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def read_rows(self, file, file_format):
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+    def read_checkpoint(self, checkpoint) -> int:
+        if not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as file:
+            return int(file.read().strip() or 0)
+
+    def write_checkpoint(self, checkpoint, position) -> None:
+        # запись через временный файл, чтобы позиция не потерялась при сбое
+        temporary = f"{checkpoint}.tmp"
+        with open(temporary, "w") as file:
+            file.write(str(position))
+        os.replace(temporary, checkpoint)
+
+    def import_batch(self, batch, position, stats) -> None:
+        """Запись пакета строк: пользователи, инвайт-коды, рефералы."""
+        rows = {}
+        for number, row in enumerate(batch, start=position + 1):
+            phone_number = (row.get("phone_number") or "").strip()
+            try:
+                validate_phone_number(phone_number)
+            except ValidationError as error:
+                stats["invalid"] += 1
+                self.stderr.write(f"Строка {number}: {error.messages[0]}")
+                continue
+            if phone_number in rows:
+                stats["skipped"] += 1
+                continue
+            rows[phone_number] = row
+        existing = set(
+            User.objects.filter(phone_number__in=rows).values_list(
+                "phone_number", flat=True
+            )
+        )
+        stats["skipped"] += len(existing)
+        users = User.objects.bulk_create_users(
+            User(
+                **{
+                    field: (row.get(field) or "").strip()
+                    for field in USER_FIELDS
+                }
+            )
+            for phone_number, row in rows.items()
+            if phone_number not in existing
+        )
+        stats["created"] += len(users)
+        self.create_referrals(users, rows, stats)
+
+    def create_referrals(self, users, rows, stats) -> None:
+        invite_codes = {
+            user: (rows[user.phone_number].get("invite_code") or "").strip()
+            for user in users
+        }
+        inviters = dict(
+            InviteCode.objects.filter(
+                code__in={code for code in invite_codes.values() if code}
+            ).values_list("code", "user_id")
+        )
+        referrals = []
+        for user, code in invite_codes.items():
+            if not code:
+                continue
+            if code not in inviters:
+                stats["unknown_invite_codes"] += 1
+                continue
+            referrals.append(
+                Referral(
+                    inviter_id=inviters[code],
+                    invitee=user,
+                    activated_invite_code=code,
+                )
+            )
+        referrals = bulk_create_referrals(referrals)
+        referrals_created.send(sender=Referral, referrals=referrals)
+        stats["referrals"] += len(referrals)
+
+    def report(self, position, stats, started) -> None:
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Обработано строк: {position}, создано пользователей: "
+            f"{stats['created']}, рефералов: {stats['referrals']}, "
+            f"пропущено: {stats['skipped']}, ошибок: {stats['invalid']}, "
+            f"{stats['rows'] / elapsed:,.0f} строк/с"
+        )
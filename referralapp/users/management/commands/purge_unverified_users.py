@@ -0,0 +1,76 @@
+from datetime import datetime, time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаление пользователей, которые ни разу не прошли верификацию: "
+        "без токена, без входов, без активированного инвайт-кода "
+        "и без приглашенных пользователей. Такие пользователи создавались "
+        "при неудачной проверке кода верификации."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--joined-before",
+            required=True,
+            help=(
+                "Дата в формате ГГГГ-ММ-ДД. Удаляются только пользователи, "
+                "зарегистрированные до этой даты."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество пользователей, удаляемых в одной транзакции.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только подсчитать пользователей, не удаляя их.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            joined_before = datetime.strptime(
+                options["joined_before"], "%Y-%m-%d"
+            )
+        except ValueError:
+            raise CommandError("Укажите дату в формате ГГГГ-ММ-ДД.")
+        queryset = User.objects.filter(
+            date_joined__lt=timezone.make_aware(
+                datetime.combine(joined_before, time.min)
+            ),
+            last_login__isnull=True,
+            is_staff=False,
+            is_superuser=False,
+            auth_token__isnull=True,
+            referral_info__isnull=True,
+            invited_users__isnull=True,
+        ).order_by("pk")
+        if options["dry_run"]:
+            self.stdout.write(f"Будет удалено: {queryset.count()}")
+            return
+
+        deleted = 0
+        last_pk = 0
+        while ids := list(
+            queryset.filter(pk__gt=last_pk).values_list("pk", flat=True)[
+                : options["batch_size"]
+            ]
+        ):
+            with transaction.atomic():
+                # условия проверяются повторно на случай, если пользователь
+                # прошел верификацию во время удаления
+                _, deleted_by_model = queryset.filter(pk__in=ids).delete()
+            deleted += deleted_by_model.get(User._meta.label, 0)
+            last_pk = ids[-1]
+            self.stdout.write(f"Удалено пользователей: {deleted}")
+        self.stdout.write(self.style.SUCCESS("Удаление завершено."))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from users.leaderboard import PERIODS, aggregate_referrals
+from users.models import LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчет таблицы лидеров по всем рефералам. Нужен после "
+        "изменения рефералов в обход приложения или при расхождении "
+        "счетчиков; в обычной работе таблица обновляется при активации "
+        "инвайт-кодов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--period",
+            action="append",
+            choices=PERIODS,
+            help="Пересчитать только указанный период. Можно повторять.",
+        )
+
+    def handle(self, *args, **options):
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(LeaderboardEntry._meta.get_field(name).column)
+            for name in ("bucket", "user", "invited_count", "period")
+        )
+        for period in options["period"] or PERIODS:
+            started = time.perf_counter()
+            # группировка выполняется в базе данных одним INSERT ... SELECT,
+            # без передачи строк в приложение
+            select, params = aggregate_referrals(
+                period
+            ).query.sql_with_params()
+            sql = (
+                f"INSERT INTO {quote(LeaderboardEntry._meta.db_table)} "
+                f"({columns}) SELECT grouped.bucket, grouped.inviter_id, "
+                f"grouped.invited_count, %s FROM ({select}) grouped"
+            )
+            # пересчет периода выполняется в одной транзакции, поэтому
+            # до его завершения читается прежняя таблица
+            with transaction.atomic(), connection.cursor() as cursor:
+                LeaderboardEntry.objects.filter(period=period).delete()
+                cursor.execute(sql, (period, *params))
+                created = cursor.rowcount
+            self.stdout.write(
+                f"Период {period}: {created} строк за "
+                f"{time.perf_counter() - started:.2f} с"
+            )
+        self.stdout.write(self.style.SUCCESS("Таблица лидеров пересчитана."))
@@ -0,0 +1,335 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from users.allocator import allocator
+from users.leaderboard import ALL_TIME_BUCKET
+from users.models import (
+    InviteCode,
+    LeaderboardEntry,
+    Referral,
+    ReferralPath,
+)
+
+User = get_user_model()
+
+# индекс таблицы замыкания, который пересоздается после заполнения
+PATH_INDEX = "referral_path_ancestor_depth"
+
+# экранирование значений в текстовом формате COPY
+COPY_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+)
+
+
+def generate_parents(
+    users: int, roots: float, chain: float, fanout: str
+) -> list:
+    """
+    Номер пригласившего для каждого пользователя или None.
+
+    Доля `roots` пользователей не активирует инвайт-код, доля `chain`
+    приглашается предыдущим пользователем, что дает длинные цепочки.
+    Остальные приглашаются одним из ранее созданных пользователей:
+    при `fanout="preferential"` с вероятностью, пропорциональной
+    количеству его приглашенных плюс один, поэтому количество
+    приглашенных распределено по степенному закону; при `uniform` -
+    равновероятно. Пригласивший всегда создан раньше приглашенного,
+    поэтому самоприглашений и циклов нет.
+    """
+    parents = [None]
+    # каждый пользователь встречается в списке один раз и еще по разу
+    # на каждого приглашенного
+    targets = [0]
+    for number in range(1, users):
+        value = random.random()
+        if value < roots:
+            parent = None
+        elif value < roots + chain:
+            parent = number - 1
+        elif fanout == "preferential":
+            parent = random.choice(targets)
+        else:
+            parent = random.randrange(number)
+        parents.append(parent)
+        targets.append(number)
+        if parent is not None:
+            targets.append(parent)
+    return parents
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерация синтетического графа приглашений для нагрузочного "
+        "тестирования: пользователи, инвайт-коды, рефералы, дерево "
+        "приглашений и таблица лидеров. Строки записываются пакетами "
+        "(COPY в PostgreSQL) без создания объектов моделей и сигналов. "
+        "Id пользователей назначаются командой, поэтому во время генерации "
+        "база не должна принимать новых пользователей."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=100_000,
+            help="Количество создаваемых пользователей.",
+        )
+        parser.add_argument(
+            "--roots",
+            type=float,
+            default=0.01,
+            help="Доля пользователей без пригласившего.",
+        )
+        parser.add_argument(
+            "--chain",
+            type=float,
+            default=0.3,
+            help="Доля пользователей, приглашенных предыдущим пользователем.",
+        )
+        parser.add_argument(
+            "--fanout",
+            choices=("preferential", "uniform"),
+            default="preferential",
+            help="Распределение приглашенных по пригласившим.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Период регистрации пользователей до текущего момента.",
+        )
+        parser.add_argument(
+            "--phone-start",
+            type=int,
+            default=70_000_000_000,
+            help="Номер телефона первого пользователя без '+'.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Количество строк в одном запросе записи.",
+        )
+        parser.add_argument("--seed", type=int, help="Начальное значение.")
+
+    def handle(self, *args, **options):
+        users = options["users"]
+        if users < 1:
+            raise CommandError(
+                "Количество пользователей должно быть больше 0."
+            )
+        if options["roots"] + options["chain"] > 1:
+            raise CommandError("Сумма --roots и --chain не может превышать 1.")
+        self.batch_size = options["batch_size"]
+        phones = [
+            f"+{number}"
+            for number in range(
+                options["phone_start"], options["phone_start"] + users
+            )
+        ]
+        if User.objects.filter(
+            phone_number__range=(phones[0], phones[-1])
+        ).exists():
+            raise CommandError(
+                "Номера телефонов уже заняты, укажите другой --phone-start."
+            )
+
+        random.seed(options["seed"])
+        started = time.perf_counter()
+        parents = generate_parents(
+            users, options["roots"], options["chain"], options["fanout"]
+        )
+        codes = allocator.allocate_many(users)
+        self.stdout.write(
+            f"Граф сгенерирован за {time.perf_counter() - started:.2f} с"
+        )
+
+        quote = connection.ops.quote_name
+        written = Counter()
+        # связи строк верны по построению, поэтому проверка внешних ключей
+        # на каждой строке отключается, как при загрузке фикстур
+        with connection.constraint_checks_disabled(), transaction.atomic():
+            if connection.vendor == "sqlite":
+                # индексы растут в одной транзакции, страницы держатся
+                # в памяти, а не вытесняются во временный файл
+                with connection.cursor() as cursor:
+                    cursor.execute("PRAGMA cache_size = -262144")
+            first_id = (
+                User.objects.aggregate(last=Max("id"))["last"] or 0
+            ) + 1
+            ids = range(first_id, first_id + users)
+            # пользователи регистрируются равномерно за период, реферал
+            # создается в момент регистрации приглашенного
+            now = timezone.now()
+            step = timedelta(days=options["days"]) / users
+            joined = [now - step * (users - number) for number in range(users)]
+            adapt = connection.ops.adapt_datetimefield_value
+            joined_values = [adapt(moment) for moment in joined]
+            written[User] = self.write_users(ids, phones, joined_values)
+            invited_counts = Counter(
+                parent for parent in parents if parent is not None
+            )
+            written[InviteCode] = self.write(
+                InviteCode,
+                ("user_id", "code", "invited_count"),
+                (
+                    (ids[number], codes[number], invited_counts[number])
+                    for number in range(users)
+                ),
+            )
+            written[Referral] = self.write(
+                Referral,
+                (
+                    "inviter_id",
+                    "invitee_id",
+                    "activated_invite_code",
+                    "created_at",
+                ),
+                (
+                    (ids[parent], ids[number], codes[parent], moment)
+                    for number, (parent, moment) in enumerate(
+                        zip(parents, joined_values)
+                    )
+                    if parent is not None
+                ),
+            )
+            # строк таблицы замыкания в разы больше, чем пользователей.
+            # Индекс по предку строится после вставки одним проходом
+            # по отсортированным строкам, а не обновляется на каждой строке
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP INDEX {quote(PATH_INDEX)}")
+            written[ReferralPath] = self.write(
+                ReferralPath,
+                ("ancestor_id", "descendant_id", "depth"),
+                self.paths(ids, parents),
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE INDEX {quote(PATH_INDEX)} ON "
+                    f"{quote(ReferralPath._meta.db_table)} "
+                    f"({quote('ancestor_id')}, {quote('depth')})"
+                )
+            # пользователи записаны с явными id, последовательность
+            # первичного ключа продолжается после них
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [User]
+                ):
+                    cursor.execute(sql)
+            # даты рефералов известны, поэтому таблица лидеров считается
+            # в памяти, без пересчета по всей таблице рефералов
+            written[LeaderboardEntry] = self.write(
+                LeaderboardEntry,
+                ("period", "bucket", "user_id", "invited_count"),
+                self.leaderboard(ids, parents, joined),
+            )
+
+        elapsed = time.perf_counter() - started
+        for model, count in written.items():
+            self.stdout.write(f"{model._meta.db_table}: {count} строк")
+        total = sum(written.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Записано {total} строк за {elapsed:.2f} с "
+                f"({total / elapsed:,.0f} строк/с)."
+            )
+        )
+
+    def write_users(self, ids, phones: list, joined: list) -> int:
+        # значения остальных полей одинаковы у всех пользователей
+        # и берутся из одного объекта
+        template = User()
+        fields = [
+            field
+            for field in User._meta.local_concrete_fields
+            if field.name not in ("id", "phone_number", "date_joined")
+        ]
+        values = tuple(
+            field.get_db_prep_save(field.pre_save(template, True), connection)
+            for field in fields
+        )
+        return self.write(
+            User,
+            ("id", "phone_number", "date_joined")
+            + tuple(field.column for field in fields),
+            (
+                (user_id, phone, moment, *values)
+                for user_id, phone, moment in zip(ids, phones, joined)
+            ),
+        )
+
+    def leaderboard(self, ids, parents: list, joined: list):
+        """Строки таблицы лидеров по рефералам всех периодов."""
+        counts = Counter()
+        for parent, moment in zip(parents, joined):
+            if parent is None:
+                continue
+            day = timezone.localdate(moment)
+            week = day - timedelta(days=day.weekday())
+            counts[(LeaderboardEntry.DAY, day, parent)] += 1
+            counts[(LeaderboardEntry.WEEK, week, parent)] += 1
+            counts[(LeaderboardEntry.ALL, ALL_TIME_BUCKET, parent)] += 1
+        adapt = connection.ops.adapt_datefield_value
+        for (period, bucket, parent), count in counts.items():
+            yield period, adapt(bucket), ids[parent], count
+
+    def paths(self, ids, parents: list):
+        """Строки таблицы замыкания: все предки каждого пользователя."""
+        for number, parent in enumerate(parents):
+            depth = 1
+            while parent is not None:
+                yield ids[parent], ids[number], depth
+                parent, depth = parents[parent], depth + 1
+
+    def write(self, model, columns: tuple, rows) -> int:
+        """Запись строк пакетами, возвращает количество строк."""
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        column_list = ", ".join(quote(column) for column in columns)
+        if connection.vendor == "postgresql":
+            sql = f"COPY {table} ({column_list}) FROM STDIN"
+        else:
+            sql = (
+                f"INSERT INTO {table} ({column_list}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))})"
+            )
+        rows = iter(rows)
+        count = 0
+        with connection.cursor() as cursor:
+            while batch := list(islice(rows, self.batch_size)):
+                if connection.vendor == "postgresql":
+                    self.copy(cursor, sql, batch)
+                else:
+                    cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+    def copy(self, cursor, sql: str, batch: list) -> None:
+        """Запись пакета командой COPY в текстовом формате."""
+        data = StringIO(
+            "".join(
+                "\t".join(
+                    (
+                        "\\N"
+                        if value is None
+                        else str(value).translate(COPY_ESCAPES)
+                    )
+                    for value in row
+                )
+                + "\n"
+                for row in batch
+            )
+        )
+        # COPY выполняется через курсор драйвера psycopg
+        cursor.cursor.copy_expert(sql, data)
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_invited_count(apps, schema_editor):
+    """Заполнение счетчика приглашенных по существующим рефералам."""
+    InviteCode = apps.get_model('users', 'InviteCode')
+    Referral = apps.get_model('users', 'Referral')
+    invited = (
+        Referral.objects.filter(inviter_id=OuterRef('user_id'))
+        .order_by()
+        .values('inviter_id')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    InviteCode.objects.update(invited_count=Coalesce(Subquery(invited), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invitecode',
+            name='invited_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество приглашенных пользователей'),
+        ),
+        migrations.RunPython(fill_invited_count, migrations.RunPython.noop),
+    ]
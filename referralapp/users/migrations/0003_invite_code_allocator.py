@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:40
+
+import users.allocator
+import users.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_invitecode_invited_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value', models.BigIntegerField(default=0, verbose_name='последний выделенный номер')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='invitecode',
+            name='code',
+            field=models.CharField(blank=True, default=users.allocator.allocate_invite_code, max_length=6, unique=True, validators=[users.validators.validate_invite_code], verbose_name='пригласительный код'),
+        ),
+    ]
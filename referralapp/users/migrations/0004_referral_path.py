@@ -0,0 +1,94 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_referral_paths(apps, schema_editor):
+    """
+    Заполнение таблицы замыкания по существующим рефералам.
+
+    Для каждого приглашенного пользователя цепочка пригласивших
+    проходится в памяти по словарю invitee -> inviter.
+    """
+    Referral = apps.get_model("users", "Referral")
+    ReferralPath = apps.get_model("users", "ReferralPath")
+    inviters = dict(
+        Referral.objects.filter(inviter__isnull=False)
+        .values_list("invitee_id", "inviter_id")
+        .iterator(chunk_size=10000)
+    )
+    paths = []
+    for invitee in inviters:
+        ancestor, depth, visited = inviters[invitee], 1, {invitee}
+        # повторно встреченный пользователь означает цикл в данных
+        while ancestor is not None and ancestor not in visited:
+            paths.append(
+                ReferralPath(
+                    ancestor_id=ancestor, descendant_id=invitee, depth=depth
+                )
+            )
+            visited.add(ancestor)
+            ancestor, depth = inviters.get(ancestor), depth + 1
+        if len(paths) >= 10000:
+            ReferralPath.objects.bulk_create(paths)
+            paths = []
+    ReferralPath.objects.bulk_create(paths)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_invite_code_allocator"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReferralPath",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveIntegerField(verbose_name="глубина")),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_paths",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="предок",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_paths",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="потомок",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["ancestor", "depth"],
+                        name="referral_path_ancestor_depth",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("descendant", "ancestor"), name="unique_referral_path"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_referral_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:55
+
+import datetime
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, Value
+from django.db.models.functions import TruncDate, TruncWeek
+
+
+def fill_leaderboard(apps, schema_editor):
+    """Заполнение таблицы лидеров по существующим рефералам."""
+    Referral = apps.get_model("users", "Referral")
+    LeaderboardEntry = apps.get_model("users", "LeaderboardEntry")
+    buckets = {
+        "day": TruncDate("created_at"),
+        "week": TruncWeek("created_at", output_field=DateField()),
+        "all": Value(datetime.date(1970, 1, 1), output_field=DateField()),
+    }
+    for period, bucket in buckets.items():
+        rows = (
+            Referral.objects.filter(inviter__isnull=False)
+            .annotate(bucket=bucket)
+            .order_by()
+            .values("bucket", "inviter_id")
+            .annotate(invited_count=Count("id"))
+            .values_list("bucket", "inviter_id", "invited_count")
+        )
+        LeaderboardEntry.objects.bulk_create(
+            (
+                LeaderboardEntry(
+                    period=period,
+                    bucket=bucket,
+                    user_id=user_id,
+                    invited_count=count,
+                )
+                for bucket, user_id, count in rows.iterator()
+            ),
+            batch_size=10000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_referral_path"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[
+                            ("day", "день"),
+                            ("week", "неделя"),
+                            ("all", "все время"),
+                        ],
+                        max_length=4,
+                        verbose_name="период",
+                    ),
+                ),
+                ("bucket", models.DateField(verbose_name="начало периода")),
+                (
+                    "invited_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="количество приглашенных пользователей"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="leaderboard_entries",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["period", "bucket", "-invited_count"],
+                        name="leaderboard_top",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("period", "bucket", "user"),
+                        name="unique_leaderboard_entry",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_leaderboard, migrations.RunPython.noop),
+    ]
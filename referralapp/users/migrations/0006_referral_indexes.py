@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_leaderboard"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(
+                fields=["inviter", "-created_at"], name="referral_inviter_created"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(fields=["created_at"], name="referral_created"),
+        ),
+        migrations.AlterField(
+            model_name="referral",
+            name="inviter",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="invited_users",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="пригласивший пользователь",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="referralpath",
+            name="ancestor",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="descendant_paths",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="предок",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="referralpath",
+            name="descendant",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ancestor_paths",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="потомок",
+            ),
+        ),
+    ]
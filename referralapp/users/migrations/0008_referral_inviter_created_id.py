@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_outbox_event"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="referral",
+            name="referral_inviter_created",
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(
+                fields=["inviter", "-created_at", "-id"],
+                name="referral_inviter_created",
+            ),
+        ),
+    ]
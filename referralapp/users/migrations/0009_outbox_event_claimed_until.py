@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0008_referral_inviter_created_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxevent",
+            name="claimed_until",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="занято публикацией до"
+            ),
+        ),
+    ]
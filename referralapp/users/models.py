@@ -1,8 +1,9 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
 
-from users.utils import generate_invite_code
+from users.allocator import allocate_invite_code, allocator
 from users.validators import validate_invite_code, validate_phone_number
 
 
@@ -18,6 +19,29 @@ class UserManager(BaseUserManager):
         user = self.model(phone_number=phone_number, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
+        return user
+
+    def bulk_create_users(self, users, batch_size=None):
+        """
+        Массовое создание пользователей вместе с инвайт-кодами.
+
+        Пользователи, их инвайт-коды и события регистрации записываются
+        в одной транзакции пакетными запросами, сигналы сохранения
+        не отправляются.
+        """
+        users = list(users)
+        codes = allocator.allocate_many(len(users))
+        with transaction.atomic(using=self.db):
+            users = self.bulk_create(users, batch_size=batch_size)
+            InviteCode.objects.using(self.db).bulk_create(
+                [
+                    InviteCode(user=user, code=code)
+                    for user, code in zip(users, codes)
+                ],
+                batch_size=batch_size,
+            )
+            OutboxEvent.objects.db_manager(self.db).record_users(users)
+        return users
 
     def create_superuser(self, phone_number, password, **extra_fields):
         extra_fields.setdefault("is_staff", True)
@@ -49,6 +73,60 @@ class User(AbstractUser):
     def __str__(self):
         return self.phone_number
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # номер телефона из базы, по которому видно его изменение
+        user.saved_phone_number = user.__dict__.get("phone_number")
+        return user
+
+    @property
+    def phone_number_changed(self) -> bool:
+        """Изменен ли номер телефона после загрузки или сохранения."""
+        return self.phone_number != getattr(self, "saved_phone_number", None)
+
+    def save(self, *args, **kwargs):
+        """
+        Создание инвайт-кода и события регистрации в одной транзакции
+        с новым пользователем.
+        """
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None or "phone_number" in update_fields:
+                self.saved_phone_number = self.phone_number
+            return
+        # код выделяется до начала транзакции, чтобы резервирование блока
+        # кодов фиксировалось сразу и не удерживало блокировку счетчика
+        code = allocate_invite_code()
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            InviteCode.objects.using(self._state.db).create(
+                user=self, code=code
+            )
+            OutboxEvent.objects.db_manager(self._state.db).record_users([self])
+        self.saved_phone_number = self.phone_number
+
+
+class InviteCodeManager(models.Manager):
+    """Менеджер инвайт-кодов."""
+
+    def increase_invited_count(self, counts: dict) -> None:
+        """
+        Увеличение счетчиков приглашенных.
+
+        `counts` сопоставляет id пригласившего пользователя с количеством
+        новых приглашенных. Пользователи с одинаковым приростом
+        обновляются одним запросом.
+        """
+        users_by_count = {}
+        for user_id, count in counts.items():
+            users_by_count.setdefault(count, []).append(user_id)
+        for count, user_ids in users_by_count.items():
+            self.filter(user_id__in=user_ids).update(
+                invited_count=models.F("invited_count") + count
+            )
+
 
 class InviteCode(models.Model):
     """Инвайт код."""
@@ -62,14 +140,30 @@ class InviteCode(models.Model):
         max_length=6,
         unique=True,
         verbose_name="пригласительный код",
-        default=generate_invite_code,
+        default=allocate_invite_code,
         validators=[validate_invite_code],
     )
+    invited_count = models.PositiveIntegerField(
+        default=0, verbose_name="количество приглашенных пользователей"
+    )
+
+    objects = InviteCodeManager()
 
     def __str__(self):
         return f"Пользователь {self.user} | Инвайт-код: {self.code}"
 
 
+class InviteCodeSequence(models.Model):
+    """Счетчик порядковых номеров для выделения инвайт-кодов."""
+
+    last_value = models.BigIntegerField(
+        default=0, verbose_name="последний выделенный номер"
+    )
+
+    def __str__(self):
+        return f"Выделено номеров: {self.last_value}"
+
+
 class Referral(models.Model):
     """Реферальная система."""
 
@@ -79,6 +173,8 @@ class Referral(models.Model):
         related_name="invited_users",
         blank=True,
         null=True,
+        # поиск по пригласившему использует индекс referral_inviter_created
+        db_index=False,
         verbose_name="пригласивший пользователь",
     )
     invitee = models.OneToOneField(
@@ -97,16 +193,252 @@ class Referral(models.Model):
         auto_now_add=True, verbose_name="Дата активации"
     )
 
+    class Meta:
+        indexes = [
+            # приглашенные пользователя, начиная с последних
+            models.Index(
+                fields=("inviter", "-created_at", "-id"),
+                name="referral_inviter_created",
+            ),
+            # активации за период
+            models.Index(fields=("created_at",), name="referral_created"),
+        ]
+
     def __str__(self):
         return f"{self.inviter} пригласил {self.invitee}"
 
     def save(self, *args, **kwargs):
         """
         Проверка на самоприглашение и сохранение инвайт-кода приглашающего.
+
+        Если инвайт-код уже передан, приглашающий не загружается.
         """
-        if self.invitee == self.inviter:
+        if self.invitee_id == self.inviter_id:
             raise ValidationError(
                 "Пользователь не может пригласить самого себя."
             )
-        self.activated_invite_code = self.inviter.invite_code.code
+        if not self.activated_invite_code:
+            self.activated_invite_code = self.inviter.invite_code.code
         super().save(*args, **kwargs)
+
+
+class ReferralPath(models.Model):
+    """
+    Путь в дереве приглашений (таблица замыкания).
+
+    Для каждого пользователя хранятся все его предки с расстоянием
+    до них: depth=1 для пригласившего, depth=2 для пригласившего его
+    пользователя и т.д. Строки поддерживаются при создании и удалении
+    рефералов и позволяют получить всю цепочку одним запросом.
+    """
+
+    ancestor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="descendant_paths",
+        # поиск по предку использует индекс referral_path_ancestor_depth
+        db_index=False,
+        verbose_name="предок",
+    )
+    descendant = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="ancestor_paths",
+        # поиск по потомку использует ограничение unique_referral_path
+        db_index=False,
+        verbose_name="потомок",
+    )
+    depth = models.PositiveIntegerField(verbose_name="глубина")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("descendant", "ancestor"),
+                name="unique_referral_path",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=("ancestor", "depth"),
+                name="referral_path_ancestor_depth",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor} -> {self.descendant} ({self.depth})"
+
+
+class LeaderboardEntryManager(models.Manager):
+    """Менеджер таблицы лидеров."""
+
+    def increase(self, counts: dict) -> None:
+        """
+        Увеличение счетчиков приглашенных за периоды.
+
+        `counts` сопоставляет ключ (period, bucket, user_id) с приростом.
+        Отсутствующие строки создаются, существующие увеличиваются одним
+        запросом INSERT ... ON CONFLICT DO UPDATE, который поддерживают
+        PostgreSQL и SQLite. `bulk_create(update_conflicts=True)` здесь
+        не подходит: он заменяет значение, а не прибавляет к нему.
+        """
+        if not counts:
+            return
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} "
+            f"({quote('period')}, {quote('bucket')}, {quote('user_id')}, "
+            f"{quote('invited_count')}) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT ({quote('period')}, {quote('bucket')}, "
+            f"{quote('user_id')}) DO UPDATE SET {quote('invited_count')} = "
+            f"{table}.{quote('invited_count')} + "
+            f"EXCLUDED.{quote('invited_count')}"
+        )
+        # строки обновляются в одном порядке во всех транзакциях,
+        # чтобы параллельные пакеты не блокировали друг друга
+        rows = [
+            (
+                period,
+                connection.ops.adapt_datefield_value(bucket),
+                user_id,
+                count,
+            )
+            for (period, bucket, user_id), count in sorted(counts.items())
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Количество приглашенных пользователем за период.
+
+    Для каждого периода (день, неделя, все время) хранится строка
+    на пользователя и начало периода `bucket`. Строки обновляются
+    при активации инвайт-кодов, поэтому топ и место пользователя
+    читаются по индексу без группировки рефералов.
+    """
+
+    DAY = "day"
+    WEEK = "week"
+    ALL = "all"
+    PERIOD_CHOICES = (
+        (DAY, "день"),
+        (WEEK, "неделя"),
+        (ALL, "все время"),
+    )
+
+    period = models.CharField("период", max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateField("начало периода")
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="leaderboard_entries",
+        verbose_name="пользователь",
+    )
+    invited_count = models.PositiveIntegerField(
+        default=0, verbose_name="количество приглашенных пользователей"
+    )
+
+    objects = LeaderboardEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("period", "bucket", "user"),
+                name="unique_leaderboard_entry",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=("period", "bucket", "-invited_count"),
+                name="leaderboard_top",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.period} {self.bucket}: {self.invited_count}"
+
+
+class OutboxEventManager(models.Manager):
+    """Менеджер событий для внешних потребителей."""
+
+    def record(self, event_type: str, payloads) -> None:
+        """Запись событий одного типа одним запросом."""
+        self.bulk_create(
+            OutboxEvent(type=event_type, payload=payload)
+            for payload in payloads
+        )
+
+    def record_users(self, users) -> None:
+        self.record(
+            OutboxEvent.USER_CREATED,
+            (
+                {"user_id": user.pk, "date_joined": user.date_joined}
+                for user in users
+            ),
+        )
+
+    def record_referrals(self, referrals) -> None:
+        self.record(
+            OutboxEvent.REFERRAL_CREATED,
+            (
+                {
+                    "referral_id": referral.pk,
+                    "inviter_id": referral.inviter_id,
+                    "invitee_id": referral.invitee_id,
+                    "invite_code": referral.activated_invite_code,
+                    "created_at": referral.created_at,
+                }
+                for referral in referrals
+            ),
+        )
+
+    def unpublished(self):
+        return self.filter(published_at__isnull=True)
+
+
+class OutboxEvent(models.Model):
+    """
+    Событие для внешних потребителей (transactional outbox).
+
+    Событие записывается в той же транзакции, что и изменение, поэтому
+    оно есть тогда и только тогда, когда изменение зафиксировано.
+    Команда relay_outbox публикует события в порядке id и отмечает
+    опубликованные.
+    """
+
+    USER_CREATED = "user.created"
+    USER_DELETED = "user.deleted"
+    REFERRAL_CREATED = "referral.created"
+    TYPE_CHOICES = (
+        (USER_CREATED, "пользователь зарегистрирован"),
+        (USER_DELETED, "пользователь удален"),
+        (REFERRAL_CREATED, "инвайт-код активирован"),
+    )
+
+    type = models.CharField("тип", max_length=32, choices=TYPE_CHOICES)
+    payload = models.JSONField("данные", encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField("дата создания", auto_now_add=True)
+    published_at = models.DateTimeField(
+        "дата публикации", blank=True, null=True
+    )
+    claimed_until = models.DateTimeField(
+        "занято публикацией до", blank=True, null=True
+    )
+
+    objects = OutboxEventManager()
+
+    class Meta:
+        indexes = [
+            # очередь публикации: неопубликованные события по порядку
+            models.Index(
+                fields=("id",),
+                condition=models.Q(published_at__isnull=True),
+                name="outbox_unpublished",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.type}"
@@ -0,0 +1,291 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q, Subquery
+
+from users.leaderboard import record_referrals
+from users.models import InviteCode, OutboxEvent, Referral, ReferralPath
+
+User = get_user_model()
+
+# количество строк таблицы замыкания в одном INSERT
+PATH_BATCH_SIZE = 1000
+
+
+class ReferralCycleError(ValueError):
+    """Пригласивший пользователь является потомком приглашенного."""
+
+
+def create_referral(inviter_id, invitee, invite_code: str) -> Referral:
+    """
+    Активация инвайт-кода: создание реферала, обновление счетчика,
+    дерева приглашений и таблицы лидеров, событие для внешних
+    потребителей.
+
+    Повторная активация не проверяется отдельным запросом: ее отклоняет
+    уникальное ограничение на приглашенного пользователя, поэтому
+    при параллельных запросах реферал создает только один из них,
+    а остальные получают IntegrityError.
+
+    Цикл в дереве приглашений проверяется после блокировки корня
+    дерева пригласившего и приглашенного (см. lock_referral_trees()),
+    при цикле транзакция откатывается с ReferralCycleError. Реферал
+    записывается до проверки: в SQLite первая запись берет блокировку
+    базы, и транзакции активации выполняются по очереди.
+    """
+    with transaction.atomic():
+        referral = Referral.objects.create(
+            inviter_id=inviter_id,
+            invitee=invitee,
+            activated_invite_code=invite_code,
+        )
+        if lock_referral_trees(inviter_id, invitee.id) == invitee.id:
+            raise ReferralCycleError(inviter_id, invitee.id)
+        InviteCode.objects.increase_invited_count({inviter_id: 1})
+        add_referral_paths([(inviter_id, invitee.id)])
+        record_referrals([(inviter_id, referral.created_at)])
+        OutboxEvent.objects.record_referrals([referral])
+    return referral
+
+
+def activate_invite_codes(activations) -> list:
+    """
+    Пакетная активация инвайт-кодов.
+
+    `activations` - пары (invitee_id, invite_code). Возвращает список
+    той же длины с созданным рефералом или текстом ошибки для каждой
+    пары. Проверки выполняются над множествами, загруженными для всего
+    пакета, а рефералы и их счетчики, пути и таблица лидеров
+    записываются пакетно в одной транзакции, поэтому количество
+    запросов не зависит от размера пакета.
+
+    Уникальное ограничение на приглашенного по-прежнему отклоняет
+    активации из параллельных запросов: тогда весь пакет откатывается
+    с IntegrityError.
+    """
+    activations = list(activations)
+    invitee_ids = {invitee_id for invitee_id, _ in activations}
+    with transaction.atomic():
+        inviters = dict(
+            InviteCode.objects.filter(
+                code__in={code for _, code in activations}
+            ).values_list("code", "user_id")
+        )
+        existing = set(
+            User.objects.filter(pk__in=invitee_ids).values_list(
+                "pk", flat=True
+            )
+        )
+        activated = set(
+            Referral.objects.filter(invitee_id__in=invitee_ids).values_list(
+                "invitee_id", flat=True
+            )
+        )
+        roots = tree_roots(set(inviters.values()))
+        # рефералы пакета: приглашенный -> пригласивший
+        parents = {}
+        results = []
+        for invitee_id, code in activations:
+            inviter_id = inviters.get(code)
+            if invitee_id not in existing:
+                error = "Пользователь не найден."
+            elif inviter_id is None:
+                error = "Указанный инвайт-код не существует."
+            elif inviter_id == invitee_id:
+                error = "Пользователь не может пригласить самого себя."
+            elif invitee_id in activated or invitee_id in parents:
+                error = "Инвайт код уже активирован."
+            elif _root(inviter_id, roots, parents) == invitee_id:
+                error = (
+                    "Пригласивший пользователь приглашен этим пользователем."
+                )
+            else:
+                parents[invitee_id] = inviter_id
+                results.append(
+                    Referral(
+                        inviter_id=inviter_id,
+                        invitee_id=invitee_id,
+                        activated_invite_code=code,
+                    )
+                )
+                continue
+            results.append(error)
+        bulk_create_referrals(
+            result for result in results if isinstance(result, Referral)
+        )
+    return results
+
+
+def bulk_create_referrals(referrals) -> list:
+    """
+    Пакетное создание проверенных рефералов: счетчики приглашений,
+    дерево приглашений, таблица лидеров и события для внешних
+    потребителей обновляются так же, как в create_referral().
+
+    Сигнал referrals_created отправляет вызывающий код.
+    """
+    with transaction.atomic():
+        referrals = Referral.objects.bulk_create(referrals)
+        InviteCode.objects.increase_invited_count(
+            Counter(referral.inviter_id for referral in referrals)
+        )
+        add_referral_paths(
+            (referral.inviter_id, referral.invitee_id)
+            for referral in referrals
+        )
+        record_referrals(
+            (referral.inviter_id, referral.created_at)
+            for referral in referrals
+        )
+        OutboxEvent.objects.record_referrals(referrals)
+    return referrals
+
+
+def tree_roots(user_ids) -> dict:
+    """
+    Корни деревьев приглашений: самый дальний предок каждого
+    пользователя. Пользователи без предков в результат не входят.
+    """
+    # при сортировке по глубине в словаре остается самый дальний предок
+    return dict(
+        ReferralPath.objects.filter(descendant_id__in=user_ids)
+        .order_by("depth")
+        .values_list("descendant_id", "ancestor_id")
+    )
+
+
+def _root(user_id, roots, parents):
+    """
+    Корень дерева пользователя с учетом рефералов пакета `parents`.
+
+    Приглашенные пакета до активации не имели пригласивших, то есть
+    были корнями, поэтому подъем идет от корня к корню.
+    """
+    root = roots.get(user_id, user_id)
+    while root in parents:
+        root = roots.get(parents[root], parents[root])
+    return root
+
+
+def lock_referral_trees(inviter_id, invitee_id) -> int:
+    """
+    Блокировка строк пригласившего, приглашенного и корня дерева
+    пригласившего до конца транзакции, возвращает корень дерева
+    пригласившего.
+
+    Приглашенный без пригласившего сам является корнем, и новый
+    реферал создает цикл, только если он же корень дерева
+    пригласившего. Параллельные активации, которые вместе замкнули бы
+    цикл (A приглашает B и B приглашает A или длиннее), блокируют
+    общий корень и выполняются по очереди, поэтому вторая видит путь,
+    добавленный первой. Корень перечитывается после блокировки: пока
+    ожидалась блокировка, его могли пригласить.
+    """
+    root = (
+        ReferralPath.objects.filter(descendant_id=inviter_id)
+        .order_by("-depth")
+        .values("ancestor_id")[:1]
+    )
+    user_ids = Q(pk__in=(inviter_id, invitee_id)) | Q(pk=Subquery(root))
+    locked = set()
+    while True:
+        # строки блокируются в порядке pk, чтобы избежать взаимных
+        # блокировок; NO KEY UPDATE не ждет ссылок из новых рефералов
+        locked.update(
+            User.objects.select_for_update(no_key=True)
+            .filter(user_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        root = tree_roots({inviter_id}).get(inviter_id, inviter_id)
+        if root in locked:
+            return root
+        user_ids = Q(pk=root)
+
+
+def add_referral_paths(edges) -> None:
+    """
+    Добавление в таблицу замыкания путей для новых рефералов.
+
+    `edges` - пары (inviter_id, invitee_id). Каждое ребро соединяет
+    пригласившего и всех его предков с приглашенным и всеми его
+    потомками. Предки и потомки всех пользователей пакета загружаются
+    двумя запросами и дополняются в памяти по мере обработки ребер,
+    поэтому ребра внутри одного пакета могут идти в любом порядке.
+    """
+    edges = [(inviter, invitee) for inviter, invitee in edges if inviter]
+    if not edges:
+        return
+    nodes = {node for edge in edges for node in edge}
+    ancestors = {node: {} for node in nodes}
+    descendants = {node: {} for node in nodes}
+    for ancestor, descendant, depth in ReferralPath.objects.filter(
+        descendant_id__in=nodes
+    ).values_list("ancestor_id", "descendant_id", "depth"):
+        ancestors[descendant][ancestor] = depth
+    for ancestor, descendant, depth in ReferralPath.objects.filter(
+        ancestor_id__in=nodes
+    ).values_list("ancestor_id", "descendant_id", "depth"):
+        descendants[ancestor][descendant] = depth
+    paths = []
+    for inviter, invitee in edges:
+        upline = {inviter: 0, **ancestors[inviter]}
+        downline = {invitee: 0, **descendants[invitee]}
+        for ancestor, up_depth in upline.items():
+            for descendant, down_depth in downline.items():
+                depth = up_depth + down_depth + 1
+                paths.append(
+                    ReferralPath(
+                        ancestor_id=ancestor,
+                        descendant_id=descendant,
+                        depth=depth,
+                    )
+                )
+                if descendant in nodes:
+                    ancestors[descendant][ancestor] = depth
+                if ancestor in nodes:
+                    descendants[ancestor][descendant] = depth
+    ReferralPath.objects.bulk_create(paths, batch_size=PATH_BATCH_SIZE)
+
+
+def remove_referral_paths(inviter_id, invitee_id) -> None:
+    """
+    Удаление путей, проходящих через ребро inviter -> invitee.
+
+    Предки пригласившего и потомки приглашенного выбираются
+    подзапросами, поэтому удаление выполняется одним запросом
+    независимо от размера поддерева.
+    """
+    ReferralPath.objects.filter(
+        Q(ancestor_id=inviter_id)
+        | Q(
+            ancestor_id__in=ReferralPath.objects.filter(
+                descendant_id=inviter_id
+            ).values("ancestor_id")
+        ),
+        Q(descendant_id=invitee_id)
+        | Q(
+            descendant_id__in=ReferralPath.objects.filter(
+                ancestor_id=invitee_id
+            ).values("descendant_id")
+        ),
+    ).delete()
+
+
+def remove_paths_through(user_id) -> None:
+    """
+    Удаление путей, проходящих через пользователя.
+
+    Вызывается перед удалением пользователя: пути, которые начинаются
+    или заканчиваются на нем, удаляются каскадно, а пути между его
+    предками и потомками нужно удалить отдельно.
+    """
+    ReferralPath.objects.filter(
+        ancestor_id__in=ReferralPath.objects.filter(
+            descendant_id=user_id
+        ).values("ancestor_id"),
+        descendant_id__in=ReferralPath.objects.filter(
+            ancestor_id=user_id
+        ).values("descendant_id"),
+    ).delete()
@@ -1,20 +1,54 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import Signal, receiver
 
-from .models import InviteCode
+from .leaderboard import discard_referral
+from .models import InviteCode, OutboxEvent, Referral
+from .referrals import remove_paths_through, remove_referral_paths
 
 User = get_user_model()
 
+# отправляется после массового создания рефералов без Referral.save,
+# аргумент `referrals` - список созданных рефералов
+referrals_created = Signal()
 
-@receiver(post_save, sender=User)
-def create_invite_code(sender, instance, created, **kwargs):
-    """Создание баланса."""
-    if created:
-        InviteCode.objects.create(user=instance)
 
+@receiver(post_delete, sender=Referral)
+def decrease_invited_count(sender, instance, **kwargs):
+    """Уменьшение счетчика приглашенных при удалении реферала."""
+    if instance.inviter_id:
+        InviteCode.objects.filter(user_id=instance.inviter_id).update(
+            invited_count=F("invited_count") - 1
+        )
 
-@receiver(post_save, sender=User)
-def save_invite_code(sender, instance, **kwargs):
-    """Сохранение баланса."""
-    instance.invite_code.save()
+
+@receiver(post_delete, sender=Referral)
+def decrease_leaderboard(sender, instance, **kwargs):
+    """Уменьшение счетчиков таблицы лидеров при удалении реферала."""
+    if instance.inviter_id:
+        discard_referral(instance.inviter_id, instance.created_at)
+
+
+@receiver(post_delete, sender=Referral)
+def delete_referral_paths(sender, instance, **kwargs):
+    """Удаление путей дерева приглашений, проходящих через реферал."""
+    if instance.inviter_id:
+        remove_referral_paths(instance.inviter_id, instance.invitee_id)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_paths(sender, instance, **kwargs):
+    """Удаление путей дерева приглашений через удаляемого пользователя."""
+    remove_paths_through(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def record_user_deletion(sender, instance, **kwargs):
+    """
+    Событие удаления пользователя. Удаление выполняется в транзакции,
+    поэтому событие фиксируется вместе с ним.
+    """
+    OutboxEvent.objects.record(
+        OutboxEvent.USER_DELETED, [{"user_id": instance.pk}]
+    )
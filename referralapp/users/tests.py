@@ -1,3 +1,2128 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import (
+    IntegrityError,
+    connection,
+    connections,
+    router,
+    transaction,
+)
+from django.db.models import Count
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from drf_spectacular.views import SpectacularAPIView
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.authentication import TokenSnapshotCache, token_cache
+from api.code_stores import DatabaseCodeStore, get_code_store
+from api.delivery import BaseSender, DeliveryPipeline
+from api.instrumentation import RequestMetrics, registry
+from api.models import VerificationCode
+from api.outbox import BaseSink, FileSink, OutboxRelay, WebhookSink
+from api.profile_cache import profile_cache
+from api.schema import (
+    generate_schema,
+    get_schema_artifact,
+    source_fingerprint,
+)
+from api.serializers import UserSerializer
+from api.throttling import ClientIPRateThrottle
+from api.views import (
+    AsyncCodeVerificationView,
+    AsyncPhoneAuthView,
+    UserViewSet,
+)
+from users.allocator import InviteCodeAllocator, InviteCodePermutation
+from users.leaderboard import period_bucket
+from users.models import (
+    InviteCode,
+    InviteCodeSequence,
+    LeaderboardEntry,
+    OutboxEvent,
+    Referral,
+    ReferralPath,
+)
+from users.referrals import (
+    ReferralCycleError,
+    create_referral,
+    lock_referral_trees,
+)
+from users.validators import validate_invite_code
+
+User = get_user_model()
+
+
+def clear_caches() -> None:
+    """Очистка всех кешей из CACHES."""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def create_users(count: int, start: int = 0) -> list:
+    """Создание пользователей с последовательными номерами телефонов."""
+    return [
+        User.objects.create(phone_number=f"+7900{number:07d}")
+        for number in range(start, start + count)
+    ]
+
+
+class UserListTests(TestCase):
+    """Список пользователей."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("api:users-list")
+
+    def get_num_queries(self) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def invite(self, inviter, invitees) -> None:
+        for invitee in invitees:
+            Referral.objects.create(inviter=inviter, invitee=invitee)
+
+    def test_list_is_cursor_paginated(self):
+        create_users(3)
+        response = self.client.get(self.url, {"page_size": 2})
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNotNone(response.data["next"])
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+
+    def test_inviters_contain_invitee_phone_numbers(self):
+        inviter, *invitees = create_users(3)
+        self.invite(inviter, invitees)
+        response = self.client.get(self.url)
+        inviters = response.data["results"][0]["inviters"]
+        self.assertCountEqual(
+            [item["phone_number"] for item in inviters],
+            [invitee.phone_number for invitee in invitees],
+        )
+
+    def test_num_queries_does_not_grow_with_data(self):
+        inviter, *invitees = create_users(3)
+        self.invite(inviter, invitees)
+        num_queries = self.get_num_queries()
+        inviter, *invitees = create_users(10, start=3)
+        self.invite(inviter, invitees)
+        self.assertEqual(self.get_num_queries(), num_queries)
+
+    def test_list_matches_user_serializer(self):
+        inviter, other, *invitees = create_users(9)
+        inviter.first_name = "Иван"
+        inviter.email = "ivan@example.com"
+        inviter.save()
+        self.invite(inviter, invitees)
+        self.invite(other, [inviter])
+        response = self.client.get(self.url)
+        queryset = UserViewSet.queryset.order_by("id")
+        expected = JSONRenderer().render(
+            UserSerializer(queryset, many=True).data
+        )
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"]), expected
+        )
+        # последних приглашенных больше, чем показывается в профиле
+        self.assertEqual(len(response.data["results"][0]["inviters"]), 5)
+
+
+class InvitedUsersTests(TestCase):
+    """Счетчик и список приглашенных пользователей."""
+
+    def setUp(self):
+        self.inviter, *self.invitees = create_users(7)
+        self.client = APIClient()
+
+    def activate(self, invitee):
+        self.client.force_authenticate(invitee)
+        return self.client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": self.inviter.invite_code.code},
+        )
+
+    def test_counter_follows_activation_and_deletion(self):
+        for invitee in self.invitees:
+            self.assertEqual(self.activate(invitee).status_code, 201)
+        self.inviter.invite_code.refresh_from_db()
+        self.assertEqual(self.inviter.invite_code.invited_count, 6)
+        self.invitees[0].delete()
+        Referral.objects.get(invitee=self.invitees[1]).delete()
+        self.inviter.invite_code.refresh_from_db()
+        self.assertEqual(self.inviter.invite_code.invited_count, 4)
+
+    def test_repeated_activation_is_rejected(self):
+        self.activate(self.invitees[0])
+        response = self.activate(self.invitees[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data, {"invite_code": ["Инвайт код уже активирован."]}
+        )
+        self.inviter.invite_code.refresh_from_db()
+        self.assertEqual(self.inviter.invite_code.invited_count, 1)
+
+    def test_profile_contains_count_and_preview(self):
+        for invitee in self.invitees:
+            self.activate(invitee)
+        response = self.client.get(
+            reverse("api:users-detail", args=(self.inviter.id,))
+        )
+        self.assertEqual(response.data["invited_count"], 6)
+        self.assertEqual(
+            [item["phone_number"] for item in response.data["inviters"]],
+            [invitee.phone_number for invitee in self.invitees[:0:-1]],
+        )
+
+    def test_invited_is_paginated(self):
+        for invitee in self.invitees:
+            self.activate(invitee)
+        url = reverse("api:users-invited", args=(self.inviter.id,))
+        response = self.client.get(url, {"page_size": 4})
+        self.assertEqual(len(response.data["results"]), 4)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [invitee.id for invitee in self.invitees[1::-1]],
+        )
+
+    def test_invited_with_same_activation_time(self):
+        for invitee in self.invitees:
+            self.activate(invitee)
+        Referral.objects.update(created_at=timezone.now())
+        url = reverse("api:users-invited", args=(self.inviter.id,))
+        response = self.client.get(url, {"page_size": 4})
+        ids = [item["id"] for item in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        ids += [item["id"] for item in response.data["results"]]
+        self.assertIsNone(response.data["next"])
+        invitees = self.invitees[::-1]
+        self.assertEqual(ids, [invitee.id for invitee in invitees])
+        response = self.client.get(
+            reverse("api:users-detail", args=(self.inviter.id,))
+        )
+        self.assertEqual(
+            [item["phone_number"] for item in response.data["inviters"]],
+            [invitee.phone_number for invitee in invitees[:5]],
+        )
+
+    def test_invited_of_unknown_user(self):
+        url = reverse("api:users-invited", args=(0,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ReferralTreeTests(TestCase):
+    """Таблица замыкания дерева приглашений."""
+
+    def setUp(self):
+        # дерево a -> b -> c -> d, b -> e
+        self.a, self.b, self.c, self.d, self.e = create_users(5)
+        self.client = APIClient()
+
+    def invite(self, inviter, invitee) -> None:
+        create_referral(inviter.id, invitee, inviter.invite_code.code)
+
+    def build_tree(self) -> None:
+        # ребра добавляются не сверху вниз: поддерево подключается целиком
+        self.invite(self.c, self.d)
+        self.invite(self.b, self.c)
+        self.invite(self.a, self.b)
+        self.invite(self.b, self.e)
+
+    def paths(self) -> set:
+        return set(
+            ReferralPath.objects.values_list(
+                "ancestor_id", "descendant_id", "depth"
+            )
+        )
+
+    def test_paths_are_built_for_any_order(self):
+        self.build_tree()
+        a, b, c, d, e = (
+            user.id for user in (self.a, self.b, self.c, self.d, self.e)
+        )
+        self.assertEqual(
+            self.paths(),
+            {
+                (a, b, 1),
+                (a, c, 2),
+                (a, d, 3),
+                (a, e, 2),
+                (b, c, 1),
+                (b, d, 2),
+                (b, e, 1),
+                (c, d, 1),
+            },
+        )
+
+    def test_deleted_referral_detaches_subtree(self):
+        self.build_tree()
+        Referral.objects.get(invitee=self.c).delete()
+        self.assertEqual(
+            self.paths(),
+            {
+                (self.a.id, self.b.id, 1),
+                (self.a.id, self.e.id, 2),
+                (self.b.id, self.e.id, 1),
+                (self.c.id, self.d.id, 1),
+            },
+        )
+
+    def test_deleted_user_breaks_paths_through_user(self):
+        self.build_tree()
+        self.b.delete()
+        self.assertEqual(self.paths(), {(self.c.id, self.d.id, 1)})
+
+    def test_cycle_is_rejected(self):
+        self.build_tree()
+        self.client.force_authenticate(self.a)
+        response = self.client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": self.d.invite_code.code},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Referral.objects.filter(invitee=self.a).exists())
+
+    def test_cycle_is_checked_under_lock(self):
+        self.build_tree()
+        self.assertEqual(lock_referral_trees(self.d.id, self.a.id), self.a.id)
+        with self.assertRaises(ReferralCycleError):
+            create_referral(self.d.id, self.a, self.d.invite_code.code)
+        self.assertFalse(Referral.objects.filter(invitee=self.a).exists())
+
+    def test_downline_and_upline(self):
+        self.build_tree()
+        response = self.client.get(
+            reverse("api:users-downline", args=(self.a.id,))
+        )
+        self.assertEqual(
+            response.data,
+            [
+                {"depth": 1, "count": 1},
+                {"depth": 2, "count": 2},
+                {"depth": 3, "count": 1},
+            ],
+        )
+        response = self.client.get(
+            reverse("api:users-upline", args=(self.d.id,))
+        )
+        self.assertEqual(
+            [(item["id"], item["depth"]) for item in response.data],
+            [(self.c.id, 1), (self.b.id, 2), (self.a.id, 3)],
+        )
+
+    def test_descendants_are_paginated_and_filtered(self):
+        self.build_tree()
+        url = reverse("api:users-descendants", args=(self.a.id,))
+        response = self.client.get(url, {"page_size": 3})
+        self.assertEqual(len(response.data["results"]), 3)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        response = self.client.get(url, {"depth": 2})
+        self.assertEqual(
+            {item["id"] for item in response.data["results"]},
+            {self.c.id, self.e.id},
+        )
+        self.assertEqual(self.client.get(url, {"depth": "x"}).status_code, 400)
+
+    def test_tree_queries_do_not_depend_on_depth(self):
+        self.build_tree()
+        for name, user in (
+            ("api:users-downline", self.a),
+            ("api:users-upline", self.d),
+            ("api:users-descendants", self.a),
+        ):
+            with self.assertNumQueries(2):
+                self.client.get(reverse(name, args=(user.id,)))
+
+
+class LeaderboardTests(TestCase):
+    """Таблица лидеров."""
+
+    def setUp(self):
+        self.users = create_users(8)
+        self.first, self.second, self.third = self.users[:3]
+        # первый пригласил троих, второй и третий - по одному
+        for inviter, invitee in zip(
+            (self.first, self.first, self.first, self.second, self.third),
+            self.users[3:],
+        ):
+            create_referral(inviter.id, invitee, inviter.invite_code.code)
+        self.client = APIClient()
+        self.url = reverse("api:users-leaderboard")
+
+    def entries(self) -> set:
+        return set(
+            LeaderboardEntry.objects.filter(invited_count__gt=0).values_list(
+                "period", "bucket", "user_id", "invited_count"
+            )
+        )
+
+    def test_top_with_shared_ranks(self):
+        self.client.force_authenticate(self.third)
+        response = self.client.get(self.url, {"period": "day"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (item["rank"], item["id"], item["invited_count"])
+                for item in response.data["results"]
+            ],
+            [
+                (1, self.first.id, 3),
+                (2, self.second.id, 1),
+                (2, self.third.id, 1),
+            ],
+        )
+        self.assertEqual(response.data["me"]["rank"], 2)
+
+    def test_rank_of_user_without_invitations(self):
+        self.client.force_authenticate(self.users[-1])
+        response = self.client.get(self.url, {"limit": 1})
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["me"])
+        self.assertEqual(
+            self.client.get(self.url, {"period": "year"}).status_code, 400
+        )
+
+    def test_old_referrals_are_not_in_current_periods(self):
+        old = timezone.now() - timedelta(days=8)
+        Referral.objects.filter(inviter=self.second).update(created_at=old)
+        call_command("rebuild_leaderboard", stdout=StringIO())
+        response = self.client.get(self.url, {"period": "week"})
+        self.assertNotIn(
+            self.second.id, [item["id"] for item in response.data["results"]]
+        )
+        response = self.client.get(self.url, {"period": "all"})
+        self.assertIn(
+            self.second.id, [item["id"] for item in response.data["results"]]
+        )
+
+    def test_rebuild_matches_incremental_updates(self):
+        expected = self.entries()
+        self.assertIn(
+            ("week", period_bucket("week"), self.first.id, 3), expected
+        )
+        LeaderboardEntry.objects.all().delete()
+        call_command("rebuild_leaderboard", stdout=StringIO())
+        self.assertEqual(self.entries(), expected)
+
+    def test_deleted_referral_is_discarded(self):
+        Referral.objects.get(invitee=self.users[3]).delete()
+        self.assertEqual(
+            LeaderboardEntry.objects.get(
+                period="all", user=self.first
+            ).invited_count,
+            2,
+        )
+
+    def test_top_costs_constant_queries(self):
+        self.client.force_authenticate(self.first)
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Планы запросов представлений не содержат полного чтения таблиц.
+
+    Запросы, выполненные при обращении к API, повторяются с EXPLAIN.
+    В PostgreSQL последовательное чтение запрещается настройкой
+    enable_seqscan, поэтому "Seq Scan" в плане означает отсутствие
+    подходящего индекса, а не выбор планировщика на маленькой таблице.
+    SQLite без статистики ANALYZE и так планирует запросы как для
+    больших таблиц.
+    """
+
+    def setUp(self):
+        # дерево приглашений: у каждого пользователя до трех приглашенных
+        self.users = create_users(60)
+        for number, invitee in enumerate(self.users[1:]):
+            inviter = self.users[number // 3]
+            create_referral(inviter.id, invitee, inviter.invite_code.code)
+        token = Token.objects.create(user=self.users[0])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.tables = set(connection.introspection.table_names())
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def sequential_scans(self, sql: str, params=()) -> list:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"{connection.ops.explain_query_prefix()} {sql}", params
+            )
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+        if connection.vendor == "postgresql":
+            return [line for line in plan if "Seq Scan" in line]
+        # в SQLite полное чтение обозначается "SCAN <таблица>",
+        # чтение промежуточных результатов подзапросов не учитывается
+        return [
+            line
+            for line in plan
+            if line.startswith("SCAN ") and line.split()[1] in self.tables
+        ]
+
+    def assertIndexedRequest(self, url, **params):
+        clear_caches()
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            if query["sql"].startswith("SELECT"):
+                self.assertEqual(
+                    self.sequential_scans(query["sql"]), [], query["sql"]
+                )
+        return response
+
+    def test_user_pages(self):
+        url = reverse("api:users-list")
+        response = self.client.get(url, {"page_size": 10})
+        self.assertIndexedRequest(response.data["next"])
+        self.assertIndexedRequest(
+            reverse("api:users-detail", args=(self.users[5].id,))
+        )
+        self.assertIndexedRequest(reverse("api:users-me"))
+
+    def test_first_page_and_phone_prefix_search(self):
+        if connection.vendor != "postgresql":
+            # SQLite читает первую страницу по порядку первичного ключа
+            # и не использует индекс для LIKE без учета регистра
+            self.skipTest(
+                "Индекс varchar_pattern_ops есть только в PostgreSQL"
+            )
+        url = reverse("api:users-list")
+        self.assertIndexedRequest(url, page_size=10)
+        response = self.assertIndexedRequest(url, phone_number="+790000000")
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_referral_tree_and_invited(self):
+        root, leaf = self.users[0], self.users[-1]
+        self.assertIndexedRequest(
+            reverse("api:users-invited", args=(root.id,))
+        )
+        self.assertIndexedRequest(
+            reverse("api:users-downline", args=(root.id,))
+        )
+        self.assertIndexedRequest(reverse("api:users-upline", args=(leaf.id,)))
+        self.assertIndexedRequest(
+            reverse("api:users-descendants", args=(root.id,)), depth=2
+        )
+
+    def test_leaderboard(self):
+        for period in ("day", "week", "all"):
+            self.assertIndexedRequest(
+                reverse("api:users-leaderboard"), period=period
+            )
+
+    def test_activations_by_time_range(self):
+        since = timezone.now() - timedelta(hours=1)
+        sql, params = (
+            Referral.objects.filter(created_at__gte=since)
+            .values_list("id")
+            .query.sql_with_params()
+        )
+        self.assertEqual(self.sequential_scans(sql, params), [])
+
+
+METRICS_TOKEN_SETTINGS = {
+    "REQUEST_METRICS": {**settings.REQUEST_METRICS, "TOKEN": "secret"}
+}
+
+
+@override_settings(
+    MIDDLEWARE=[
+        "api.instrumentation.RequestMetricsMiddleware",
+        *settings.MIDDLEWARE,
+    ]
+)
+class RequestMetricsTests(TestCase):
+    """Показатели запросов."""
+
+    def setUp(self):
+        registry.clear()
+        create_users(3)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("api:users-list"))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicates", '
+            r"serializer;dur=[\d.]+, total;dur=[\d.]+$",
+        )
+
+    @override_settings(**METRICS_TOKEN_SETTINGS)
+    def test_metrics_are_aggregated_per_view(self):
+        for _ in range(2):
+            self.client.get(reverse("api:users-list"))
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        labels = 'view="api:users-list",method="GET"'
+        self.assertIn(f"referralapp_requests_total{{{labels}}} 2", text)
+        self.assertIn(f'_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertRegex(
+            text,
+            rf"referralapp_serializer_duration_seconds_total{{{labels}}} 0\.\d+",
+        )
+        self.assertIn("referralapp_code_delivery_queue_depth 0", text)
+
+    def test_metrics_are_not_open_to_local_addresses(self):
+        """За обратным прокси все запросы приходят с 127.0.0.1."""
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="127.0.0.1")
+        self.assertIn(response.status_code, (401, 403))
+
+    @override_settings(**METRICS_TOKEN_SETTINGS)
+    def test_metrics_require_token(self):
+        url = reverse("metrics")
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertIn(response.status_code, (401, 403))
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_are_open_to_staff(self):
+        staff = User.objects.first()
+        staff.is_staff = True
+        staff.save(update_fields=["is_staff"])
+        token = Token.objects.create(user=staff)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_duplicate_queries_are_detected(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for user in User.objects.all():
+                InviteCode.objects.get(user=user)
+        self.assertEqual(metrics.queries, 4)
+        self.assertEqual(list(metrics.duplicates(3).values()), [3])
+        self.assertEqual(metrics.duplicates(4), {})
+
+
+class InviteCodeAllocatorTests(TestCase):
+    """Выделение инвайт-кодов."""
+
+    def test_permutation_is_reversible(self):
+        permutation = InviteCodePermutation(b"key")
+        for value in (0, 1, 238_327, 238_328, 56_800_235_583):
+            code = permutation.encode(value)
+            validate_invite_code(code)
+            self.assertEqual(permutation.decode(code), value)
+
+    def test_codes_are_unique(self):
+        allocator = InviteCodeAllocator(block_size=100)
+        codes = allocator.allocate_many(250) + [
+            allocator.allocate() for _ in range(100)
+        ]
+        self.assertEqual(len(set(codes)), 350)
+
+    def test_taken_codes_are_skipped(self):
+        allocator = InviteCodeAllocator(block_size=10)
+        user = User.objects.create(phone_number="+79000000000")
+        sequence, _ = InviteCodeSequence.objects.get_or_create(pk=1)
+        taken = allocator.permutation.encode(sequence.last_value)
+        InviteCode.objects.filter(user=user).update(code=taken)
+        self.assertNotIn(taken, allocator.allocate_many(10))
+
+    def test_block_is_discarded_after_rollback(self):
+        allocator = InviteCodeAllocator(block_size=10)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                allocator.allocate()
+                raise IntegrityError
+        codes = allocator.allocate_many(5)
+        other = InviteCodeAllocator(block_size=10).allocate_many(5)
+        self.assertFalse(set(codes) & set(other))
+
+
+def count_writes(queries) -> int:
+    """Количество запросов на изменение данных."""
+    return sum(
+        query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+        for query in queries
+    )
+
+
+class UserSaveTests(TestCase):
+    """Создание и сохранение пользователей."""
+
+    def test_user_is_created_with_invite_code(self):
+        user = User.objects.create_user("+79000000000", "password")
+        self.assertTrue(InviteCode.objects.filter(user=user).exists())
+
+    def test_bulk_create_users(self):
+        users = User.objects.bulk_create_users(
+            User(phone_number=f"+7900000000{number}") for number in range(5)
+        )
+        self.assertEqual(InviteCode.objects.filter(user__in=users).count(), 5)
+
+    def test_save_issues_one_query(self):
+        user = User.objects.create(phone_number="+79000000000")
+        user = User.objects.get(pk=user.pk)
+        user.first_name = "Иван"
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_profile_update_issues_one_write(self):
+        user = User.objects.create(phone_number="+79000000000")
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.patch(
+                reverse("api:users-me"), {"first_name": "Иван"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count_writes(context.captured_queries), 1)
+
+
+class ImportUsersTests(TestCase):
+    """Импорт пользователей из файла."""
+
+    def import_file(self, content: str, suffix: str, **options) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"users{suffix}")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(content)
+            call_command(
+                "import_users",
+                path,
+                stdout=StringIO(),
+                stderr=StringIO(),
+                **options,
+            )
+
+    def test_import_csv_with_referrals(self):
+        inviter = User.objects.create(phone_number="+79000000000")
+        code = inviter.invite_code.code
+        self.import_file(
+            "phone_number,first_name,invite_code\n"
+            f"+79000000001,Иван,{code}\n"
+            "+79000000002,Петр,\n"
+            "wrong,Сидор,\n"
+            f"+79000000000,Повтор,{code}\n",
+            ".csv",
+            batch_size=2,
+        )
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(InviteCode.objects.count(), 3)
+        invitee = User.objects.get(phone_number="+79000000001")
+        self.assertEqual(invitee.referral_info.inviter, inviter)
+        self.assertEqual(invitee.referral_info.activated_invite_code, code)
+        inviter.invite_code.refresh_from_db()
+        self.assertEqual(inviter.invite_code.invited_count, 1)
+        self.assertTrue(
+            ReferralPath.objects.filter(
+                ancestor=inviter, descendant=invitee, depth=1
+            ).exists()
+        )
+
+    def test_import_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "checkpoint")
+            with open(checkpoint, "w") as file:
+                file.write("1")
+            self.import_file(
+                '{"phone_number": "+79000000001"}\n'
+                '{"phone_number": "+79000000002"}\n',
+                ".jsonl",
+                checkpoint=checkpoint,
+            )
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(
+            list(User.objects.values_list("phone_number", flat=True)),
+            ["+79000000002"],
+        )
+
+
+class SeedReferralsTests(TestCase):
+    """Генерация синтетического графа приглашений."""
+
+    def test_seed_builds_consistent_graph(self):
+        call_command("seed_referrals", users=300, seed=1, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 300)
+        self.assertEqual(InviteCode.objects.count(), 300)
+        referrals = set(
+            Referral.objects.values_list("inviter_id", "invitee_id")
+        )
+        self.assertTrue(referrals)
+        self.assertFalse(
+            any(inviter == invitee for inviter, invitee in referrals)
+        )
+        self.assertEqual(
+            set(
+                ReferralPath.objects.filter(depth=1).values_list(
+                    "ancestor_id", "descendant_id"
+                )
+            ),
+            referrals,
+        )
+        counts = dict(
+            User.objects.annotate(count=Count("invited_users"))
+            .filter(count__gt=0)
+            .values_list("id", "count")
+        )
+        self.assertEqual(
+            dict(
+                InviteCode.objects.filter(invited_count__gt=0).values_list(
+                    "user_id", "invited_count"
+                )
+            ),
+            counts,
+        )
+        self.assertEqual(
+            dict(
+                LeaderboardEntry.objects.filter(
+                    period=LeaderboardEntry.ALL
+                ).values_list("user_id", "invited_count")
+            ),
+            counts,
+        )
+        # следующий пользователь получает id после сгенерированных
+        last_id = User.objects.order_by("-id").values_list("id")[0][0]
+        user = User.objects.create(phone_number="+79000000000")
+        self.assertGreater(user.id, last_id)
+
+    def test_taken_phone_numbers_are_rejected(self):
+        User.objects.create(phone_number="+70000000005")
+        with self.assertRaises(CommandError):
+            call_command("seed_referrals", users=10, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1)
+
+
+class DatabaseCodeStoreTests(TestCase):
+    """Хранилище кодов верификации в базе данных."""
+
+    phone_number = "+79000000000"
+
+    def setUp(self):
+        self.store = DatabaseCodeStore(ttl=300, max_attempts=3)
+        self.store.issue(self.phone_number, "1234")
+
+    def test_code_is_consumed(self):
+        self.assertTrue(self.store.verify(self.phone_number, "1234"))
+        self.assertFalse(self.store.verify(self.phone_number, "1234"))
+
+    def test_attempts_are_limited(self):
+        for _ in range(3):
+            self.assertFalse(self.store.verify(self.phone_number, "0000"))
+        self.assertFalse(self.store.verify(self.phone_number, "1234"))
+
+    def test_new_code_resets_attempts(self):
+        for _ in range(3):
+            self.store.verify(self.phone_number, "0000")
+        self.store.issue(self.phone_number, "4321")
+        self.assertTrue(self.store.verify(self.phone_number, "4321"))
+
+    def test_expired_code_is_rejected(self):
+        VerificationCode.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertFalse(self.store.verify(self.phone_number, "1234"))
+
+
+# проверка кода в отдельном процессе: процесс подключается к той же
+# базе, сообщает о готовности и проверяет код по команде родителя
+VERIFY_IN_PROCESS = """
+import sys
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+from api.code_stores import get_code_store
+
+connection.settings_dict["NAME"] = sys.argv[1]
+store = get_code_store()
+print("ready", flush=True)
+sys.stdin.readline()
+print(store.verify(sys.argv[2], sys.argv[3]), flush=True)
+"""
+
+
+class ConcurrentCodeVerificationTests(TransactionTestCase):
+    """
+    Параллельная проверка одного кода разными процессами.
+
+    Код выдается в тестовом процессе, а проверяется в отдельных
+    процессах Python, поэтому тест не проходит с хранилищем в памяти
+    процесса, а из одновременных проверок код принимает только одна.
+    """
+
+    databases = "__all__"
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Нужна база данных для нескольких подключений.")
+
+    def test_code_is_accepted_once(self):
+        phone_number = "+79000000000"
+        get_code_store().issue(phone_number, "1234")
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-c",
+                    VERIFY_IN_PROCESS,
+                    str(connection.settings_dict["NAME"]),
+                    phone_number,
+                    "1234",
+                ],
+                # настройки и переменные окружения наследуются
+                cwd=settings.BASE_DIR,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            for _ in range(4)
+        ]
+        try:
+            for worker in workers:
+                self.assertEqual(worker.stdout.readline().strip(), "ready")
+            # все процессы проверяют код одновременно
+            for worker in workers:
+                worker.stdin.write("go\n")
+                worker.stdin.flush()
+            results = [
+                worker.communicate(timeout=60)[0].strip() for worker in workers
+            ]
+        finally:
+            for worker in workers:
+                worker.kill()
+                worker.wait()
+        self.assertEqual(sorted(results), ["False"] * 3 + ["True"])
+
+
+@override_settings(
+    DATABASE_REPLICATION={
+        "REPLICAS": ["replica"],
+        "STICKY_SECONDS": 60,
+        "CACHE": "default",
+    },
+    DATABASE_ROUTERS=["api.replication.ReplicaRouter"],
+    MIDDLEWARE=[
+        "api.replication.PrimaryStickinessMiddleware",
+        *settings.MIDDLEWARE,
+    ],
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Чтение с реплики и чтение своих записей с основной базы.
+
+    Реплика - отдельный файл SQLite, данные копируются в нее явно,
+    поэтому записи после копирования видны только в основной базе.
+    """
+
+    phone_number = "+79000000009"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # реплика подключается после проверок тестового класса, которые
+        # знают только базы из settings.DATABASES
+        cls.databases = cls.databases | {"replica"}
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings["replica"] = connections.configure_settings(
+            {
+                "default": {},
+                "replica": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": os.path.join(cls.directory.name, "replica.db"),
+                },
+            }
+        )["replica"]
+        with override_settings(DATABASE_ROUTERS=[]):
+            call_command("migrate", database="replica", verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        clear_caches()
+        token_cache.clear()
+        self.inviter, self.invitee = create_users(2)
+        self.token = Token.objects.create(user=self.invitee)
+        self.replicate()
+        self.client = APIClient()
+
+    def replicate(self):
+        """Копирование пользователей основной базы в реплику."""
+        models = (User, InviteCode, Token, Referral)
+        for model in reversed(models):
+            model._base_manager.using("replica").all().delete()
+        for model in models:
+            model._base_manager.using("replica").bulk_create(
+                model._base_manager.using("default").all()
+            )
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(router.db_for_read(User), "replica")
+        self.assertEqual(router.db_for_write(User), "default")
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(User), "default")
+        self.assertEqual(
+            User.objects.get(pk=self.invitee.pk)._state.db, "replica"
+        )
+
+    def test_client_reads_own_writes_after_activation(self):
+        inviter_token = Token.objects.create(user=self.inviter)
+        self.replicate()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        response = self.client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": self.inviter.invite_code.code},
+        )
+        self.assertEqual(response.status_code, 201)
+        # профиль в кеше строится по основной базе для всех клиентов
+        other = APIClient()
+        response = other.get(
+            reverse("api:users-detail", args=[self.invitee.id])
+        )
+        self.assertEqual(
+            response.data["activated_invite_code"],
+            self.inviter.invite_code.code,
+        )
+        response = self.client.get(reverse("api:users-me"))
+        self.assertEqual(
+            response.data["activated_invite_code"],
+            self.inviter.invite_code.code,
+        )
+        # профиль пригласившего без закрепления тоже строится
+        # по основной базе
+        other.credentials(HTTP_AUTHORIZATION=f"Token {inviter_token.key}")
+        response = other.get(reverse("api:users-me"))
+        self.assertEqual(response.data["invited_count"], 1)
+        other.credentials()
+        # клиент без закрепления читает с реплики без нового реферала
+        response = other.get(reverse("api:users-list"))
+        invitee = next(
+            user
+            for user in response.data["results"]
+            if user["id"] == self.invitee.id
+        )
+        self.assertIsNone(invitee["activated_invite_code"])
+
+    async def test_async_client_reads_own_writes(self):
+        client = AsyncClient()
+        headers = {"Authorization": f"Token {self.token.key}"}
+        response = await client.patch(
+            reverse("api:users-me"),
+            {"first_name": "Иван"},
+            content_type="application/json",
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await client.get(reverse("api:users-me"), headers=headers)
+        self.assertEqual(response.json()["first_name"], "Иван")
+
+    @mock.patch("api.utils.get_delivery_pipeline")
+    def test_new_user_is_pinned_to_primary(self, pipeline):
+        self.client.post(
+            reverse("api:phone_auth"), {"phone_number": self.phone_number}
+        )
+        code = pipeline.return_value.enqueue.call_args.args[1][-4:]
+        response = self.client.post(
+            reverse("api:code_verify"),
+            {"phone_number": self.phone_number, "confirmation_code": code},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {response.data['token']}"
+        )
+        response = self.client.get(reverse("api:users-me"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["phone_number"], self.phone_number)
+        # токена еще нет в реплике, но после окончания закрепления
+        # аутентификация без кеша читает токен с основной базы
+        clear_caches()
+        token_cache.clear()
+        response = self.client.get(reverse("api:users-me"))
+        self.assertEqual(response.status_code, 200)
+
+
+class FlakySender(BaseSender):
+    """Отправитель, не доставляющий первый пакет."""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = 1
+
+    def send_many(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError
+        self.batches.append(messages)
+
+
+class DeliveryPipelineTests(TestCase):
+    """Очередь отправки кодов верификации."""
+
+    def test_messages_are_batched_and_retried(self):
+        sender = FlakySender()
+        pipeline = DeliveryPipeline(
+            sender, workers=1, batch_size=10, batch_timeout=1, retry_delay=0
+        )
+        with self.assertLogs("api.delivery", "ERROR"):
+            for number in range(25):
+                pipeline.enqueue(f"+7900000000{number:02d}", "Код")
+            pipeline.flush()
+        self.assertEqual(pipeline.queue_depth, 0)
+        self.assertEqual(sum(map(len, sender.batches)), 25)
+        self.assertLessEqual(max(map(len, sender.batches)), 10)
+
+
+@mock.patch("api.utils.get_delivery_pipeline")
+class PhoneAuthTests(TestCase):
+    """Вход по номеру телефона и коду верификации."""
+
+    phone_number = "+79000000000"
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+    def request_code(self, pipeline) -> str:
+        response = self.client.post(
+            reverse("api:phone_auth"), {"phone_number": self.phone_number}
+        )
+        self.assertEqual(response.status_code, 200)
+        phone_number, text = pipeline.return_value.enqueue.call_args.args
+        self.assertEqual(phone_number, self.phone_number)
+        return text[-4:]
+
+    def verify(self, code: str):
+        return self.client.post(
+            reverse("api:code_verify"),
+            {"phone_number": self.phone_number, "confirmation_code": code},
+        )
+
+    def test_code_is_enqueued_and_verified_once(self, pipeline):
+        code = self.request_code(pipeline)
+        response = self.verify(code)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("token", response.data)
+        self.assertEqual(self.verify(code).status_code, 400)
+
+    def test_failed_verification_does_not_create_user(self, pipeline):
+        self.request_code(pipeline)
+        self.assertEqual(self.verify("0000").status_code, 400)
+        self.assertFalse(User.objects.exists())
+
+    def test_verification_creates_user_with_token(self, pipeline):
+        code = self.request_code(pipeline)
+        token = self.verify(code).data["token"]
+        user = User.objects.get(phone_number=self.phone_number)
+        self.assertEqual(user.auth_token.key, token)
+        self.assertTrue(InviteCode.objects.filter(user=user).exists())
+        code = self.request_code(pipeline)
+        self.assertEqual(self.verify(code).data["token"], token)
+
+    def test_phone_requests_are_throttled(self, pipeline):
+        for _ in range(3):
+            self.request_code(pipeline)
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                reverse("api:phone_auth"),
+                {"phone_number": self.phone_number},
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(pipeline.return_value.enqueue.call_count, 3)
+
+    def test_spoofed_forwarded_for_is_ignored(self, pipeline):
+        throttle = ClientIPRateThrottle()
+        throttle.scope = "phone_auth_ip"
+        factory = RequestFactory()
+        keys = {
+            throttle.get_cache_key(
+                factory.post("/", HTTP_X_FORWARDED_FOR=address), None
+            )
+            for address in ("10.0.0.1", "10.0.0.2")
+        }
+        self.assertEqual(keys, {"throttle_phone_auth_ip_127.0.0.1"})
+
+    def test_non_object_body_is_rejected(self, pipeline):
+        for data in (["+79000000000"], "+79000000000"):
+            response = self.client.post(
+                reverse("api:phone_auth"), data, format="json"
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_tests_use_memory_caches(self, pipeline):
+        for alias in settings.CACHES:
+            self.assertIsInstance(caches[alias], LocMemCache)
+
+    def test_throttle_history_is_kept_apart(self, pipeline):
+        for _ in range(3):
+            self.request_code(pipeline)
+        # вытеснение профилей и других записей не сбрасывает историю
+        cache.clear()
+        response = self.client.post(
+            reverse("api:phone_auth"), {"phone_number": self.phone_number}
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_verification_attempts_are_throttled(self, pipeline):
+        self.request_code(pipeline)
+        for _ in range(10):
+            self.verify("0000")
+        with self.assertNumQueries(0):
+            response = self.verify("0000")
+        self.assertEqual(response.status_code, 429)
+
+
+@mock.patch("api.utils.get_delivery_pipeline")
+class AsyncAuthViewsTests(TestCase):
+    """Асинхронные представления авторизации для ASGI."""
+
+    phone_number = "+79000000000"
+
+    def setUp(self):
+        clear_caches()
+        self.factory = AsyncRequestFactory()
+
+    async def post(self, view, data):
+        request = self.factory.post("/", data, content_type="application/json")
+        response = await view.as_view()(request)
+        return response.render()
+
+    async def request_code(self, pipeline) -> str:
+        response = await self.post(
+            AsyncPhoneAuthView, {"phone_number": self.phone_number}
+        )
+        self.assertEqual(response.status_code, 200)
+        phone_number, text = pipeline.return_value.enqueue.call_args.args
+        self.assertEqual(phone_number, self.phone_number)
+        return text[-4:]
+
+    async def verify(self, code: str):
+        return await self.post(
+            AsyncCodeVerificationView,
+            {"phone_number": self.phone_number, "confirmation_code": code},
+        )
+
+    def test_views_are_async(self, pipeline):
+        self.assertTrue(AsyncPhoneAuthView.view_is_async)
+        self.assertTrue(AsyncCodeVerificationView.view_is_async)
+
+    async def test_verification_creates_user_with_token(self, pipeline):
+        # проверки прав и ограничения частоты не переходят в поток
+        with mock.patch(
+            "api.async_views.sync_to_async", side_effect=AssertionError
+        ):
+            code = await self.request_code(pipeline)
+        self.assertEqual((await self.verify("0000")).status_code, 400)
+        response = await self.verify(code)
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.select_related("auth_token").aget(
+            phone_number=self.phone_number
+        )
+        self.assertEqual(user.auth_token.key, response.data["token"])
+        self.assertEqual((await self.verify(code)).status_code, 400)
+        code = await self.request_code(pipeline)
+        response = await self.verify(code)
+        self.assertEqual(response.data["token"], user.auth_token.key)
+
+    async def test_invalid_phone_number(self, pipeline):
+        response = await self.post(
+            AsyncPhoneAuthView, {"phone_number": "номер"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("phone_number", response.data)
+
+    async def test_phone_requests_are_throttled(self, pipeline):
+        for _ in range(3):
+            await self.request_code(pipeline)
+        response = await self.post(
+            AsyncPhoneAuthView, {"phone_number": self.phone_number}
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(pipeline.return_value.enqueue.call_count, 3)
+
+
+class ProfileCacheTests(TestCase):
+    """Кеш профилей: ответ всегда совпадает с данными в базе."""
+
+    def setUp(self):
+        clear_caches()
+        token_cache.clear()
+        self.inviter, self.invitee, self.other = create_users(3)
+        self.client = APIClient()
+
+    def get_profile(self, user, **headers):
+        return self.client.get(
+            reverse("api:users-detail", args=(user.id,)), **headers
+        )
+
+    def assertFresh(self, user):
+        """Профиль из кеша совпадает с профилем, прочитанным из базы."""
+        response = self.get_profile(user)
+        self.assertEqual(response.status_code, 200)
+        expected = UserSerializer(UserViewSet.queryset.get(pk=user.pk)).data
+        self.assertEqual(response.data, expected)
+        return response
+
+    def activate(self, invitee, inviter):
+        self.client.force_authenticate(invitee)
+        response = self.client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": inviter.invite_code.code},
+        )
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 201)
+
+    def test_cached_profile_is_served_without_queries(self):
+        etag = self.assertFresh(self.inviter)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get_profile(self.inviter)
+        self.assertEqual(response["ETag"], etag)
+        response = self.get_profile(self.inviter, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_me_and_detail_share_entry(self):
+        self.client.force_authenticate(self.inviter)
+        etag = self.client.get(reverse("api:users-me"))["ETag"]
+        self.assertEqual(self.get_profile(self.inviter)["ETag"], etag)
+
+    def test_profile_update(self):
+        etag = self.assertFresh(self.inviter)["ETag"]
+        self.client.force_authenticate(self.inviter)
+        self.client.patch(reverse("api:users-me"), {"first_name": "Иван"})
+        response = self.get_profile(self.inviter, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["first_name"], "Иван"
+        )
+
+    def test_invite_code_change(self):
+        self.assertFresh(self.inviter)
+        self.inviter.invite_code.code = "ZZZZZZ"
+        self.inviter.invite_code.save()
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["invite_code"], "ZZZZZZ"
+        )
+
+    def test_new_referral(self):
+        self.assertFresh(self.inviter)
+        self.assertFresh(self.invitee)
+        self.activate(self.invitee, self.inviter)
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["invited_count"], 1
+        )
+        self.assertEqual(
+            self.assertFresh(self.invitee).data["activated_invite_code"],
+            self.inviter.invite_code.code,
+        )
+
+    def test_invitee_deletion(self):
+        self.activate(self.invitee, self.inviter)
+        self.assertFresh(self.inviter)
+        self.invitee.delete()
+        self.assertEqual(self.assertFresh(self.inviter).data["inviters"], [])
+
+    def test_invitee_phone_number_change(self):
+        self.activate(self.invitee, self.inviter)
+        self.assertFresh(self.inviter)
+        self.invitee.phone_number = "+79999999999"
+        self.invitee.save()
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["inviters"],
+            [{"phone_number": "+79999999999"}],
+        )
+
+    def test_unrelated_changes_keep_entry(self):
+        etag = self.assertFresh(self.inviter)["ETag"]
+        self.activate(self.invitee, self.other)
+        self.other.first_name = "Иван"
+        self.other.save()
+        with self.assertNumQueries(0):
+            response = self.get_profile(self.inviter, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_bulk_import(self):
+        self.assertFresh(self.inviter)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.csv")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(
+                    "phone_number,invite_code\n"
+                    f"+79100000000,{self.inviter.invite_code.code}\n"
+                )
+            call_command("import_users", path, stdout=StringIO())
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["invited_count"], 1
+        )
+
+    def test_entry_built_before_commit_is_not_served(self):
+        self.assertFresh(self.inviter)
+        stale = self.get_profile(self.inviter).data
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_referral(self.inviter.id, self.invitee, "")
+            # параллельный запрос прочитал новую версию, но данные
+            # из базы до фиксации транзакции
+            profile_cache.get_or_build(self.inviter.id, lambda: stale)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            self.assertFresh(self.inviter).data["invited_count"], 1
+        )
+
+    def test_lost_version_does_not_restore_entry(self):
+        profile_cache.get_or_build(self.inviter.id, lambda: {"version": 1})
+        cache.delete(profile_cache._version_key(self.inviter.id))
+        _, data = profile_cache.get_or_build(
+            self.inviter.id, lambda: {"version": 2}
+        )
+        self.assertEqual(data, {"version": 2})
+
+    def test_unknown_user(self):
+        response = self.client.get(reverse("api:users-detail", args=(0,)))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse("api:users-detail", args=("x",)))
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    """Потоковая выгрузка пользователей и рефералов."""
+
+    def setUp(self):
+        self.users = create_users(5)
+        inviter = self.users[0]
+        for invitee in self.users[1:]:
+            create_referral(inviter.id, invitee, inviter.invite_code.code)
+        self.admin = User.objects.create(
+            phone_number="+79990000000", is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, resource, **params):
+        response = self.client.get(
+            reverse("api:export", args=(resource,)), params
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_export_is_admin_only(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.get(reverse("api:export", args=("users",)))
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_resource(self):
+        response = self.client.get(reverse("api:export", args=("codes",)))
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch("api.exports.CHUNK_SIZE", 2)
+    def test_users_ndjson(self):
+        rows = [json.loads(line) for line in self.export("users").splitlines()]
+        self.assertEqual(
+            [row["id"] for row in rows],
+            [user.id for user in self.users] + [self.admin.id],
+        )
+        self.assertEqual(
+            rows[0]["invite_code"], self.users[0].invite_code.code
+        )
+        self.assertEqual(rows[0]["invited_count"], 4)
+
+    def test_referrals_csv_since(self):
+        referrals = list(Referral.objects.order_by("created_at"))
+        since = timezone.now() - timedelta(days=1)
+        Referral.objects.filter(pk=referrals[0].pk).update(
+            created_at=since - timedelta(seconds=1)
+        )
+        rows = list(
+            csv.DictReader(
+                StringIO(
+                    self.export(
+                        "referrals", output="csv", since=since.isoformat()
+                    )
+                )
+            )
+        )
+        self.assertEqual(
+            [int(row["id"]) for row in rows],
+            [referral.id for referral in referrals[1:]],
+        )
+        self.assertEqual(rows[0]["inviter_id"], str(self.users[0].id))
+
+    def test_invalid_since(self):
+        response = self.client.get(
+            reverse("api:export", args=("referrals",)), {"since": "вчера"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchActivationTests(TestCase):
+    """Пакетная активация инвайт-кодов."""
+
+    def setUp(self):
+        self.users = create_users(8)
+        self.admin = User.objects.create(
+            phone_number="+79990000000", is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse("api:batch_activation")
+
+    def activate(self, *pairs):
+        response = self.client.post(
+            self.url,
+            {
+                "activations": [
+                    {"invitee": invitee.id, "invite_code": code}
+                    for invitee, code in pairs
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def code(self, user) -> str:
+        return user.invite_code.code
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(self.url, {}, format="json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_request(self):
+        response = self.client.post(
+            self.url, {"activations": []}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_per_item_results(self):
+        a, b, c, d, e, f, g, h = self.users
+        create_referral(a.id, b, self.code(a))
+        missing = User(id=self.admin.id + 1)
+        data = self.activate(
+            (c, self.code(a)),
+            (d, "000000"),
+            (e, self.code(e)),
+            (b, self.code(c)),
+            (c, self.code(d)),
+            (missing, self.code(a)),
+            # цикл в базе: b приглашен a
+            (a, self.code(b)),
+            # цикл внутри пакета: g -> f, затем f -> g
+            (f, self.code(g)),
+            (g, self.code(f)),
+            (h, self.code(c)),
+        )
+        self.assertEqual(data["activated"], 3)
+        self.assertEqual(
+            [(item["activated"], item["error"]) for item in data["results"]],
+            [
+                (True, None),
+                (False, "Указанный инвайт-код не существует."),
+                (False, "Пользователь не может пригласить самого себя."),
+                (False, "Инвайт код уже активирован."),
+                (False, "Инвайт код уже активирован."),
+                (False, "Пользователь не найден."),
+                (
+                    False,
+                    "Пригласивший пользователь приглашен этим пользователем.",
+                ),
+                (True, None),
+                (
+                    False,
+                    "Пригласивший пользователь приглашен этим пользователем.",
+                ),
+                (True, None),
+            ],
+        )
+        self.assertEqual(data["results"][0]["invitee"], c.id)
+        self.assertEqual(
+            set(Referral.objects.values_list("inviter_id", "invitee_id")),
+            {(a.id, b.id), (a.id, c.id), (g.id, f.id), (c.id, h.id)},
+        )
+        self.assertEqual(InviteCode.objects.get(user=a).invited_count, 2)
+        self.assertEqual(InviteCode.objects.get(user=c).invited_count, 1)
+        self.assertEqual(
+            LeaderboardEntry.objects.get(period="all", user=a).invited_count,
+            2,
+        )
+        self.assertEqual(
+            set(
+                ReferralPath.objects.values_list(
+                    "ancestor_id", "descendant_id", "depth"
+                )
+            ),
+            {
+                (a.id, b.id, 1),
+                (a.id, c.id, 1),
+                (a.id, h.id, 2),
+                (c.id, h.id, 1),
+                (g.id, f.id, 1),
+            },
+        )
+
+    def test_profiles_are_invalidated(self):
+        inviter, invitee = self.users[:2]
+        url = reverse("api:users-detail", args=(inviter.id,))
+        self.assertEqual(self.client.get(url).data["invited_count"], 0)
+        self.activate((invitee, self.code(inviter)))
+        self.assertEqual(self.client.get(url).data["invited_count"], 1)
+
+    def test_queries_do_not_depend_on_batch_size(self):
+        inviter = self.users[0]
+        queries = []
+        for invitees in (self.users[1:3], self.users[3:]):
+            with CaptureQueriesContext(connection) as context:
+                self.activate(
+                    *((invitee, self.code(inviter)) for invitee in invitees)
+                )
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_concurrent_activation(self):
+        with mock.patch(
+            "api.views.activate_invite_codes", side_effect=IntegrityError
+        ):
+            response = self.client.post(
+                self.url,
+                {
+                    "activations": [
+                        {
+                            "invitee": self.users[1].id,
+                            "invite_code": self.code(self.users[0]),
+                        }
+                    ]
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 409)
+
+
+class SchemaArtifactTests(TestCase):
+    """Схема OpenAPI из артефакта, сгенерированного при сборке."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(
+            OPENAPI_SCHEMA={"DIR": self.directory}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_schema_artifact.cache_clear()
+        self.addCleanup(get_schema_artifact.cache_clear)
+
+    def build(self):
+        call_command("build_schema", stdout=StringIO())
+
+    def test_artifact_matches_live_generation(self):
+        self.build()
+        for format in ("yaml", "json"):
+            with self.subTest(format=format):
+                live = SpectacularAPIView.as_view()(
+                    RequestFactory().get("/schema/", {"format": format})
+                )
+                live.render()
+                with mock.patch(
+                    "api.schema.generate_schema",
+                    side_effect=AssertionError("схема генерируется"),
+                ):
+                    response = self.client.get(
+                        reverse("schema"), {"format": format}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response["Content-Type"], live["Content-Type"]
+                )
+                self.assertEqual(response.content, live.content)
+
+    def test_caching_headers(self):
+        self.build()
+        response = self.client.get(reverse("schema"))
+        etag = response["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        response = self.client.get(reverse("schema"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        version = get_schema_artifact().version
+        url = reverse("schema-version", args=(version,))
+        response = self.client.get(url)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+        response = self.client.get(url, {"format": "json"})
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.client.get(
+            reverse("schema-version", args=("0" * len(version),))
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertContains(self.client.get(reverse("swagger-ui")), url)
+
+    def test_regenerated_when_source_changes(self):
+        self.build()
+        previous = get_schema_artifact()
+        get_schema_artifact.cache_clear()
+        with (
+            mock.patch(
+                "api.schema.source_fingerprint", return_value="changed"
+            ),
+            mock.patch(
+                "api.schema.generate_schema",
+                wraps=generate_schema,
+            ) as generate,
+            self.assertLogs("api.schema", "WARNING"),
+        ):
+            for _ in range(2):
+                response = self.client.get(reverse("schema"))
+                self.assertEqual(response.status_code, 200)
+        generate.assert_called_once()
+        self.assertEqual(get_schema_artifact().version, "changed")
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            ["schema.changed.json", "schema.changed.yaml"],
+        )
+        self.assertEqual(get_schema_artifact().documents, previous.documents)
+
+    def test_fingerprint_depends_on_settings(self):
+        fingerprint = source_fingerprint()
+        self.assertEqual(source_fingerprint(), fingerprint)
+        with override_settings(ASYNC_AUTH_VIEWS=not settings.ASYNC_AUTH_VIEWS):
+            self.assertNotEqual(source_fingerprint(), fingerprint)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Аутентификация по токену с кешированием пользователя."""
+
+    def setUp(self):
+        clear_caches()
+        token_cache.clear()
+        self.user = User.objects.create(phone_number="+79000000000")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.url = reverse("api:users-me")
+
+    def test_cached_profile_costs_no_queries(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response.data["invite_code"], self.user.invite_code.code
+        )
+
+    def test_profile_query_budget(self):
+        # токен с пользователем и последние приглашенные
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+        # запись профиля вытеснена, версия пользователя не изменилась
+        version = profile_cache.version(self.user.pk)
+        cache.delete(f"profile:{self.user.pk}:{version}")
+        # пользователь из кеша аутентификации, из базы - приглашенные
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response.data["invite_code"], self.user.invite_code.code
+        )
+
+    def test_profile_reflects_activation(self):
+        inviter = User.objects.create(phone_number="+79000000001")
+        self.client.get(self.url)
+        self.client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": inviter.invite_code.code},
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.data["activated_invite_code"], inviter.invite_code.code
+        )
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get(self.url)
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_other_process_invalidation(self):
+        self.client.get(self.url)
+        # кеш другого процесса с тем же общим кешем поколений
+        other = TokenSnapshotCache(max_size=10, ttl=60, versions=profile_cache)
+        with mock.patch("api.signals.token_cache", other):
+            self.user.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_lost_version_invalidates_entry(self):
+        self.client.get(self.url)
+        cache.delete(profile_cache._version_key(self.user.pk))
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_deleted_user_is_not_authenticated(self):
+        self.client.get(self.url)
+        snapshot = token_cache.get(self.token.key)
+        User.objects.filter(pk=self.user.pk).delete()
+        with mock.patch.object(token_cache, "get", return_value=snapshot):
+            response = self.client.patch(self.url, {"first_name": "Иван"})
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(User.objects.exists())
+
+    def test_cache_is_bounded(self):
+        cache = TokenSnapshotCache(max_size=2, ttl=60, versions=profile_cache)
+        for key in ("a", "b", "c"):
+            cache.set(key, self.user)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), self.user)
+
+
+class PurgeUnverifiedUsersTests(TestCase):
+    """Удаление пользователей, не прошедших верификацию."""
+
+    def test_only_unverified_users_are_deleted(self):
+        unverified, verified, inviter, invitee = create_users(4)
+        Token.objects.create(user=verified)
+        Referral.objects.create(inviter=inviter, invitee=invitee)
+        tomorrow = timezone.now() + timedelta(days=1)
+        call_command(
+            "purge_unverified_users",
+            joined_before=tomorrow.strftime("%Y-%m-%d"),
+            batch_size=1,
+            stdout=StringIO(),
+        )
+        self.assertCountEqual(User.objects.all(), [verified, inviter, invitee])
+
+
+class ConcurrentActivationTests(TransactionTestCase):
+    """Параллельная активация инвайт-кодов одним пользователем."""
+
+    # при настроенных репликах чтение в потоках идет через маршрутизатор
+    databases = "__all__"
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Нужна база данных для нескольких подключений.")
+
+    def test_only_one_activation_succeeds(self):
+        invitee, *inviters = create_users(6)
+        barrier = threading.Barrier(len(inviters))
+        responses = []
+
+        def activate(inviter):
+            client = APIClient()
+            client.force_authenticate(invitee)
+            barrier.wait()
+            try:
+                responses.append(
+                    client.post(
+                        reverse("api:users-activate-invite-code"),
+                        {"invite_code": inviter.invite_code.code},
+                    )
+                )
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=activate, args=(inviter,))
+            for inviter in inviters
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        statuses = sorted(response.status_code for response in responses)
+        self.assertEqual(statuses, [201] + [400] * (len(inviters) - 1))
+        self.assertEqual(Referral.objects.filter(invitee=invitee).count(), 1)
+        self.assertEqual(
+            sum(InviteCode.objects.values_list("invited_count", flat=True)),
+            1,
+        )
+
+    def test_mutual_activations_do_not_create_cycle(self):
+        first, second = create_users(2)
+        barrier = threading.Barrier(2)
+        responses = []
+
+        def activate(invitee, inviter):
+            client = APIClient()
+            client.force_authenticate(invitee)
+            barrier.wait()
+            try:
+                responses.append(
+                    client.post(
+                        reverse("api:users-activate-invite-code"),
+                        {"invite_code": inviter.invite_code.code},
+                    )
+                )
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=activate, args=(first, second)),
+            threading.Thread(target=activate, args=(second, first)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        statuses = sorted(response.status_code for response in responses)
+        self.assertEqual(statuses, [201, 400])
+        self.assertEqual(Referral.objects.count(), 1)
+
+
+class MemorySink(BaseSink):
+    """Получатель, сохраняющий пакеты в памяти."""
+
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+
+    def publish(self, events):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("получатель недоступен")
+        self.batches.append(events)
+
+
+class OutboxTests(TestCase):
+    """События outbox и их публикация."""
+
+    def setUp(self):
+        self.inviter, self.invitee = create_users(2)
+
+    def events(self, event_type=None) -> list:
+        events = OutboxEvent.objects.order_by("id")
+        if event_type:
+            events = events.filter(type=event_type)
+        return [event.payload for event in events]
+
+    def relay(self, sink, *args, **options):
+        with mock.patch(
+            "api.management.commands.relay_outbox.get_outbox_relay",
+            return_value=OutboxRelay(sink, **options),
+        ):
+            call_command("relay_outbox", "--once", *args, stdout=StringIO())
+
+    def test_events_are_recorded_with_changes(self):
+        self.assertEqual(
+            [payload["user_id"] for payload in self.events()],
+            [self.inviter.id, self.invitee.id],
+        )
+        client = APIClient()
+        client.force_authenticate(self.invitee)
+        client.post(
+            reverse("api:users-activate-invite-code"),
+            {"invite_code": self.inviter.invite_code.code},
+        )
+        referral = Referral.objects.get(invitee=self.invitee)
+        self.assertEqual(
+            self.events(OutboxEvent.REFERRAL_CREATED),
+            [
+                {
+                    "referral_id": referral.id,
+                    "inviter_id": self.inviter.id,
+                    "invitee_id": self.invitee.id,
+                    "invite_code": self.inviter.invite_code.code,
+                    "created_at": DjangoJSONEncoder().default(
+                        referral.created_at
+                    ),
+                }
+            ],
+        )
+        invitee_id = self.invitee.id
+        self.invitee.delete()
+        self.assertEqual(
+            self.events(OutboxEvent.USER_DELETED), [{"user_id": invitee_id}]
+        )
+
+    def test_batch_activation_records_events(self):
+        invitees = create_users(3, start=2)
+        admin = User.objects.create(phone_number="+79990000000", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        client.post(
+            reverse("api:batch_activation"),
+            {
+                "activations": [
+                    {
+                        "invitee": invitee.id,
+                        "invite_code": self.inviter.invite_code.code,
+                    }
+                    for invitee in invitees
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(
+            [
+                payload["invitee_id"]
+                for payload in self.events(OutboxEvent.REFERRAL_CREATED)
+            ],
+            [invitee.id for invitee in invitees],
+        )
+
+    def test_failed_activation_records_no_event(self):
+        create_referral(
+            self.inviter.id, self.invitee, self.inviter.invite_code.code
+        )
+        with self.assertRaises(IntegrityError):
+            create_referral(
+                self.inviter.id, self.invitee, self.inviter.invite_code.code
+            )
+        self.assertEqual(len(self.events(OutboxEvent.REFERRAL_CREATED)), 1)
+
+    def test_events_are_published_in_order(self):
+        create_users(3, start=2)
+        sink = MemorySink()
+        self.relay(sink, "--batch-size", "2")
+        self.assertEqual([len(batch) for batch in sink.batches], [2, 2, 1])
+        ids = [event["id"] for batch in sink.batches for event in batch]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(sink.batches[0][0]["type"], OutboxEvent.USER_CREATED)
+        self.assertFalse(OutboxEvent.objects.unpublished().exists())
+        self.relay(sink)
+        self.assertEqual(len(sink.batches), 3)
+
+    def test_failed_batch_is_published_again(self):
+        sink = MemorySink(failures=1)
+        with self.assertRaises(CommandError):
+            self.relay(sink)
+        self.assertEqual(OutboxEvent.objects.unpublished().count(), 2)
+        self.relay(sink)
+        self.assertEqual(len(sink.batches[0]), 2)
+        self.assertFalse(OutboxEvent.objects.unpublished().exists())
+
+    def test_recent_events_wait_for_visibility_window(self):
+        """
+        Событие с меньшим id из незафиксированной транзакции не должно
+        опоздать к событию с большим id, уже переданному потребителю.
+        """
+        OutboxEvent.objects.filter(payload__user_id=self.inviter.id).update(
+            created_at=timezone.now() - timedelta(seconds=30)
+        )
+        sink = MemorySink()
+        self.relay(sink, visibility_delay=10)
+        self.assertEqual(
+            [event["payload"]["user_id"] for event in sink.batches[0]],
+            [self.inviter.id],
+        )
+        self.assertEqual(OutboxEvent.objects.unpublished().count(), 1)
+
+    def test_batch_is_claimed_during_delivery(self):
+        relay = OutboxRelay(MemorySink())
+
+        class ClaimCheckingSink(BaseSink):
+            def publish(sink, events):
+                # пакет занят, и другой процесс выберет следующий
+                self.assertEqual(relay.claim_batch(), [])
+
+        OutboxRelay(ClaimCheckingSink()).publish_batch()
+        self.assertFalse(
+            OutboxEvent.objects.filter(claimed_until__isnull=False).exists()
+        )
+        self.assertFalse(OutboxEvent.objects.unpublished().exists())
+
+    def test_expired_claim_is_published_again(self):
+        relay = OutboxRelay(MemorySink())
+        self.assertEqual(len(relay.claim_batch()), 2)
+        self.assertEqual(relay.claim_batch(), [])
+        # процесс остановился, не отметив пакет опубликованным
+        OutboxEvent.objects.update(claimed_until=timezone.now())
+        self.assertEqual(relay.publish_batch(), 2)
+        self.assertFalse(OutboxEvent.objects.unpublished().exists())
+
+    def test_published_events_are_purged(self):
+        self.relay(MemorySink())
+        OutboxEvent.objects.filter(payload__user_id=self.inviter.id).update(
+            published_at=timezone.now()
+            - timedelta(days=settings.OUTBOX["RETENTION_DAYS"] + 1)
+        )
+        self.relay(MemorySink())
+        self.assertEqual(
+            [payload["user_id"] for payload in self.events()],
+            [self.invitee.id],
+        )
+
+    def test_file_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "outbox", "events.ndjson")
+            self.relay(FileSink(path))
+            with open(path, encoding="utf-8") as file:
+                events = [json.loads(line) for line in file]
+        self.assertEqual(
+            [event["payload"]["user_id"] for event in events],
+            [self.inviter.id, self.invitee.id],
+        )
+
+    @mock.patch("urllib.request.urlopen")
+    def test_webhook_sink(self, urlopen):
+        self.relay(WebhookSink("http://billing.local/events", token="secret"))
+        request = urlopen.call_args.args[0]
+        self.assertEqual(request.get_header("Authorization"), "Bearer secret")
+        self.assertEqual(
+            [
+                event["payload"]["user_id"]
+                for event in json.loads(request.data)["events"]
+            ],
+            [self.inviter.id, self.invitee.id],
+        )
+
+    @override_settings(**METRICS_TOKEN_SETTINGS)
+    def test_lag_metrics(self):
+        OutboxEvent.objects.update(
+            created_at=timezone.now() - timedelta(seconds=30)
+        )
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        metrics = dict(
+            line.rsplit(" ", 1)
+            for line in response.content.decode().splitlines()
+            if line.startswith("referralapp_outbox")
+        )
+        self.assertEqual(
+            float(metrics["referralapp_outbox_pending_events"]), 2
+        )
+        self.assertGreaterEqual(
+            float(metrics["referralapp_outbox_lag_seconds"]), 30
+        )